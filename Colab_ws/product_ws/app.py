@@ -2,8 +2,23 @@ from flask import Flask, render_template, request, jsonify
 import base64
 import requests
 import re
+import os
+import sys
 from datetime import datetime
 
+def find_shared_root(directory):
+    """Nearest of directory and its parents holding prodscan_common/: the repository root
+    in a checkout, or e.g. MyDrive when product_ws/ sits on Colab's Drive beside it."""
+    while not os.path.isdir(os.path.join(directory, "prodscan_common")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise ImportError("prodscan_common/ not found beside this app or in any folder above it")
+        directory = parent
+    return directory
+
+sys.path.insert(0, find_shared_root(os.path.dirname(os.path.abspath(__file__))))
+from prodscan_common.resilience import Budget, Upstream, UpstreamUnavailable
+
 app = Flask(__name__, static_folder="static")
 
 # API Keys
@@ -13,6 +28,25 @@ GOOGLE_SEARCH_API_KEY = "---"  # Replace with your Google Search API Key
 GOOGLE_SEARCH_ENGINE_ID = "---"  # Your Programmable Search Engine ID
 GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
 
+# Upstream calls: a timeout on every call, capped by what is left of the scan's budget,
+# and a circuit breaker per service that fails fast after repeated failures
+HTTP_TIMEOUT = (3.05, 15)  # (connect, read) seconds for a single call
+SCAN_BUDGET = float(os.environ.get("PRODSCAN_SCAN_BUDGET", 25))  # Seconds for all calls of one scan
+HEDGE_AFTER_MS = float(os.environ.get("PRODSCAN_HEDGE_AFTER_MS", 0))  # 0: no hedged second attempts
+UPSTREAM_ERRORS = (requests.exceptions.RequestException, UpstreamUnavailable)
+gemini = Upstream("gemini", timeout=HTTP_TIMEOUT, hedge_after=HEDGE_AFTER_MS / 1000.0)
+google_search = Upstream("google_search", timeout=HTTP_TIMEOUT, hedge_after=HEDGE_AFTER_MS / 1000.0)
+upstreams = {"gemini": gemini, "google_search": google_search}
+
+def gemini_post(payload, hedge=True):
+    """Sends one request to Gemini through its circuit breaker and returns the JSON answer."""
+    def send(timeout):
+        response = requests.post(GEMINI_API_URL, json=payload, headers={"Content-Type": "application/json"},
+                                 timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    return gemini.call(send, hedge=hedge)
+
 def clean_text(text):
     """Clean AI response by removing unwanted characters and ensuring proper formatting."""
     if text:
@@ -23,7 +57,6 @@ def clean_text(text):
 
 def analyze_image_with_gemini(image_data):
     """Send image to Gemini API to recognize the product details."""
-    headers = {"Content-Type": "application/json"}
     payload = {
         "contents": [
             {
@@ -37,16 +70,13 @@ def analyze_image_with_gemini(image_data):
     }
     
     try:
-        response = requests.post(GEMINI_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return gemini_post(payload, hedge=False)  # The image is not worth uploading twice
+    except UPSTREAM_ERRORS as e:
         print("Error calling Gemini API:", e)
         return None
 
 def fetch_usage_with_gemini(product_name):
     """Send a separate request to Gemini API to get product usage if missing."""
-    headers = {"Content-Type": "application/json"}
     payload = {
         "contents": [
             {
@@ -59,11 +89,9 @@ def fetch_usage_with_gemini(product_name):
     }
 
     try:
-        response = requests.post(GEMINI_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
+        result = gemini_post(payload)
         return clean_text(result["candidates"][0]["content"]["parts"][0]["text"])
-    except requests.exceptions.RequestException as e:
+    except UPSTREAM_ERRORS as e:
         print("Error fetching product usage:", e)
         return "Not available."
 
@@ -75,10 +103,13 @@ def search_product_price(product_name):
         "key": GOOGLE_SEARCH_API_KEY,  # API Key Added Here
         "num": 5
     }
-    try:
-        response = requests.get(GOOGLE_SEARCH_URL, params=params)
+    def send(timeout):
+        response = requests.get(GOOGLE_SEARCH_URL, params=params, timeout=timeout)
         response.raise_for_status()
-        results = response.json()
+        return response.json()
+
+    try:
+        results = google_search.call(send)
 
         price_results = []
         for item in results.get("items", []):
@@ -87,7 +118,7 @@ def search_product_price(product_name):
 
         return "<br>".join(price_results) if price_results else "Price not available."
 
-    except requests.exceptions.RequestException as e:
+    except UPSTREAM_ERRORS as e:
         print("Error fetching product price:", e)
         return "Error retrieving price data."
 
@@ -101,10 +132,14 @@ def scan_product():
     data = request.json
     image_data = data['image'].split(',')[1]  
 
+    budget = Budget(SCAN_BUDGET)  # Shared by every Gemini / Google call of this scan
+
     # Step 1: Recognize product using Gemini API
-    response = analyze_image_with_gemini(image_data)
+    response = budget.run(analyze_image_with_gemini, image_data)
 
     if not response:
+        if gemini.breaker.state == "open":
+            return jsonify({"message": "❌ Error: Product lookup is temporarily unavailable. Try again shortly."})
         return jsonify({"message": "❌ Error: Could not get a response from Gemini API. Try again."})
 
     try:
@@ -135,10 +170,10 @@ def scan_product():
 
         # If usage is still missing, request it separately from Gemini
         if usage == "Not available.":
-            usage = fetch_usage_with_gemini(product_name)
+            usage = budget.run(fetch_usage_with_gemini, product_name)
 
         # Step 2: Search for the real price using Google Programmable Search API (Shopee & Lazada only)
-        product_price = search_product_price(product_name)
+        product_price = budget.run(search_product_price, product_name)
 
         # Step 3: Format final output
         formatted_result = f"""
@@ -155,6 +190,11 @@ def scan_product():
 
     return jsonify({"message": formatted_result})
 
+@app.route('/upstream/stats')
+def upstream_stats():
+    """Reports circuit breaker state and hedging counters of the Gemini and Google Search clients."""
+    return jsonify({name: upstream.stats() for name, upstream in upstreams.items()})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=2502, debug=True)
 
@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+# --- Inference Backends ---
+# Every backend takes a float32 batch shaped (N, H, W, 3), already rescaled, and returns
+# an (N, num_classes) array of probabilities. Heavy runtimes are imported inside the
+# backend that needs them, so serving a .tflite or .onnx model never imports TensorFlow.
+# Backends that can also expose the backbone's pooled features (the image embedding used
+# by embedding_index.py) implement predict_with_embedding(batch) -> (probabilities,
+# embeddings), computed in the same forward pass.
+#
+# fork_safe says whether a loaded backend keeps working in a forked child. prefork.py
+# loads fork-safe backends once in its master, so every worker shares the weights
+# copy-on-write; the others are loaded in each worker after the fork. mmap_weights says
+# whether a backend maps its model file read-only instead of reading it into memory, so
+# workers that each load the same file still share one copy of the weights.
+
+
+def pooling_layer(model):
+    """The backbone's global pooling layer, whose output is the image embedding."""
+    for layer in model.layers:
+        if type(layer).__name__ in ("GlobalAveragePooling2D", "GlobalMaxPooling2D"):
+            return layer
+    raise ValueError("Model has no global pooling layer to take embeddings from")
+
+
+class KerasBackend:
+    """Runs the full Keras .h5 model through TensorFlow."""
+    name = "keras"
+    fork_safe = False  # TensorFlow's runtime threads do not exist in a forked child
+    mmap_weights = False  # load_model reads the .h5 weights into each process
+
+    def __init__(self, model_path):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(model_path)
+        self._embedding_model = None  # Same weights, with the pooled features as a second output
+
+    def predict(self, batch):
+        return self.model.predict_on_batch(batch)
+
+    def predict_with_embedding(self, batch):
+        if self._embedding_model is None:
+            from tensorflow.keras.models import Model
+            self._embedding_model = Model(self.model.input, [self.model.output, pooling_layer(self.model).output])
+        probabilities, embeddings = self._embedding_model.predict_on_batch(batch)
+        return probabilities, embeddings
+
+
+class TFLiteBackend:
+    """Runs a (quantized) .tflite model with the standalone TFLite interpreter."""
+    name = "tflite"
+    fork_safe = False  # The interpreter's thread pool does not survive a fork
+    mmap_weights = True  # The interpreter memory-maps model_path
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            print("tflite_runtime not installed, falling back to tf.lite.Interpreter")
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=model_path,
+                                       num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_detail["shape"][0])
+
+    def _resize(self, batch_size):
+        """Reallocates the input tensor when the batch size changes (not on every call)."""
+        if batch_size == self._batch_size:
+            return
+        shape = list(self.input_detail["shape"])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_detail["index"], shape)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        # Not thread-safe: callers go through the single BatchingPredictor worker
+        self._resize(len(batch))
+        input_dtype = self.input_detail["dtype"]
+        if input_dtype in (np.int8, np.uint8):
+            scale, zero_point = self.input_detail["quantization"]
+            info = np.iinfo(input_dtype)
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        self.interpreter.set_tensor(self.input_detail["index"], batch.astype(input_dtype, copy=False))
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self.output_detail["index"])
+        if self.output_detail["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = self.output_detail["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class OnnxBackend:
+    """Runs an exported .onnx model with ONNX Runtime on the CPU."""
+    name = "onnx"
+    fork_safe = False  # The session's intra-op thread pool is created at load time
+    mmap_weights = False  # The session copies the .onnx graph and initializers into memory
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        # train.py exports (probabilities, embedding); older exports only have the first
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        if len(self.output_names) < 2:
+            self.predict_with_embedding = None
+
+    def predict(self, batch):
+        return self.session.run(self.output_names[:1], {self.input_name: batch.astype(np.float32, copy=False)})[0]
+
+    def predict_with_embedding(self, batch):
+        probabilities, embeddings = self.session.run(self.output_names[:2],
+                                                     {self.input_name: batch.astype(np.float32, copy=False)})
+        return probabilities, embeddings
+
+
+# Bundle artifact name -> backend class. "keras" always uses the bundle's .h5 weights.
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite_float16": TFLiteBackend,
+    "tflite_int8": TFLiteBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def weight_sharing(name):
+    """How pre-forked workers serving backend `name` share its weights: "fork" (loaded
+    once in the master), "mmap" (each worker maps the same file), or None (not at all)."""
+    backend = BACKENDS.get(name)
+    if getattr(backend, "fork_safe", False):
+        return "fork"
+    if getattr(backend, "mmap_weights", False):
+        return "mmap"
+    return None
+
+
+def load_backend(name, bundle, num_threads=None):
+    """Builds the named backend from the artifacts listed in a ModelBundle."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{name}' (choose from {', '.join(BACKENDS)})")
+    if name == "keras":
+        return KerasBackend(bundle.weights_path)
+    if name not in bundle.artifacts:
+        raise FileNotFoundError(f"Bundle {bundle.version} has no '{name}' artifact; run train.py --export")
+    return BACKENDS[name](bundle.artifacts[name], num_threads=num_threads)
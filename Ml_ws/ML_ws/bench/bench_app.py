@@ -0,0 +1,60 @@
+"""web.py (or web_async.py) with a synthetic model, so /scan can be load-tested offline.
+
+Registers a "synthetic" backend before web.py loads its model. bench_scan.py writes a
+model_bundle/ whose manifest lists a synthetic.json artifact, sets
+PRODSCAN_MODEL_BACKEND=synthetic and starts this module from that directory:
+
+    gunicorn -k gthread -w 2 --threads 32 -b 127.0.0.1:2502 bench_app:app
+    PRODSCAN_BENCH_ASYNC=1 hypercorn -w 2 -b 127.0.0.1:2502 bench_app:app
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backends  # noqa: E402
+
+
+class SyntheticBackend:
+    """Stands in for the classifier: keeps the CPU busy for a set time per batch.
+
+    The time is base_ms per forward pass plus per_image_ms per image, spent in NumPy
+    matrix products (which, like TensorFlow, release the GIL). A fixed share of frames,
+    chosen from their pixels so a frame always gets the same answer, is a phone.
+    """
+    name = "synthetic"
+    fork_safe = True  # Plain NumPy arrays: prefork.py can load it once in the master
+
+    def __init__(self, model_path, num_threads=None):
+        with open(model_path) as f:
+            config = json.load(f)
+        self.num_classes = config["num_classes"]
+        self.base_ms = config.get("base_ms", 20.0)
+        self.per_image_ms = config.get("per_image_ms", 5.0)
+        self.phone_ratio = config.get("phone_ratio", 0.5)
+        self._work = np.random.default_rng(0).random((192, 192), dtype=np.float32)
+
+    def predict(self, batch):
+        deadline = time.perf_counter() + (self.base_ms + self.per_image_ms * len(batch)) / 1000.0
+        while time.perf_counter() < deadline:
+            self._work @ self._work
+
+        output = np.full((len(batch), self.num_classes), 0.1 / self.num_classes, dtype=np.float32)
+        for row, image in enumerate(batch):
+            fingerprint = int(float(image.mean()) * 1e6)
+            if (fingerprint % 1000) / 1000.0 < self.phone_ratio:
+                output[row, fingerprint % self.num_classes] += 0.9  # Confident: a phone
+            else:
+                output[row, :] = 1.0 / self.num_classes  # Flat: not a phone, ask Gemini
+        return output
+
+
+backends.BACKENDS["synthetic"] = SyntheticBackend
+
+if os.environ.get("PRODSCAN_BENCH_ASYNC") == "1":
+    from web_async import app  # noqa: E402,F401
+else:
+    from web import app  # noqa: E402,F401
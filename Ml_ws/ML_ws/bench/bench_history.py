@@ -0,0 +1,87 @@
+"""Latency of /scans history pages over a large scans table.
+
+Builds a schema-version-0 product_scans.db (TEXT scan_time, no indexes) with --rows
+random scans, times the migration, then times first pages and deep keyset pages
+for the filter combinations the history API offers.
+
+    python bench/bench_history.py --rows 2000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+from prodscan_common.scan_history import ScanHistory, migrate_database, parse_history_args  # noqa: E402
+
+QUERIES = [
+    {},
+    {"brand": "brand7"},
+    {"product_name": "Product42"},
+    {"product_name": "Product42", "brand": "Brand1"},
+    {"brand": "Brand3", "since": "2020-09-20", "until": "2020-10-01"},
+]
+
+
+def build_legacy_db(path, rows, start=1.6e9):
+    """Original schema: TEXT scan_time in local time, no indexes, one scan every 10 s."""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE scans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_name TEXT, brand TEXT, brand_details TEXT, release_date TEXT,
+            usage TEXT, price TEXT, scan_time TEXT
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO scans (product_name, brand, price, scan_time) VALUES (?, ?, ?, ?)",
+        ((f"Product{random.randrange(5000)}", f"Brand{random.randrange(50)}", "฿999",
+          time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start + i * 10))) for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def time_pages(history, query, repeats, depth):
+    """(best first-page ms, worst ms over up to depth following pages, pages walked)."""
+    args = parse_history_args(query)
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        page = history.page(**args)
+        best = min(best, time.perf_counter() - started)
+
+    worst, walked = 0.0, 0
+    while page["next_cursor"] and walked < depth:
+        args = parse_history_args(dict(query, cursor=page["next_cursor"]))
+        started = time.perf_counter()
+        page = history.page(**args)
+        worst = max(worst, time.perf_counter() - started)
+        walked += 1
+    return best * 1000.0, worst * 1000.0, walked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--depth", type=int, default=200, help="keyset pages to walk per query")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "product_scans.db")
+        build_legacy_db(path, args.rows)
+        started = time.perf_counter()
+        migrate_database(path)
+        print(f"Migrated {args.rows} rows in {time.perf_counter() - started:.1f} s\n")
+
+        history = ScanHistory(path)
+        print(f"{'query':<68}{'first ms':>10}{'deep ms':>10}{'pages':>7}")
+        for query in QUERIES:
+            first, deep, walked = time_pages(history, query, repeats=20, depth=args.depth)
+            print(f"{str(query):<68}{first:>10.2f}{deep:>10.2f}{walked:>7}")
+
+
+if __name__ == "__main__":
+    main()
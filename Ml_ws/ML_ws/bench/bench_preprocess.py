@@ -0,0 +1,132 @@
+"""Per-stage time and allocations of the model preprocessing, old vs new.
+
+"old" is what predict_product used to do: a full-size decode, a generic resize,
+img_to_array (a float32 copy), expand_dims and an in-place divide. "new" is
+preprocessing.Preprocessor: a draft-mode decode, a resize from the reduced size,
+and a rescale written into a pooled buffer.
+
+Allocations are measured with tracemalloc. That covers NumPy arrays and Python
+objects, but not PIL's C-side image memory, so the smaller draft-mode decode
+shows up only in the timings.
+
+    python bench/bench_preprocess.py --iterations 200 [--frame path/to/frame.jpg]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import Preprocessor  # noqa: E402
+
+IMAGE_SIZE = (224, 224)
+
+
+def make_frame(width=1280, height=720, quality=90):
+    """A noisy 1280x720 JPEG, roughly the size of a real camera frame."""
+    bands = [Image.effect_noise((width, height), sigma).convert("L") for sigma in (30, 50, 70)]
+    buffer = BytesIO()
+    Image.merge("RGB", bands).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+# --- Stages ---
+# Each pipeline is a list of (stage name, function of the previous stage's output).
+
+def old_pipeline(image_data):
+    return [
+        ("open", lambda _: Image.open(BytesIO(image_data))),
+        ("decode", lambda img: img.convert("RGB")),
+        ("resize", lambda img: img.resize(IMAGE_SIZE)),
+        ("to_array", lambda img: np.asarray(img, dtype=np.float32)),  # keras img_to_array
+        ("normalize", lambda arr: np.divide(np.expand_dims(arr, axis=0), 255., out=np.expand_dims(arr, axis=0))),
+    ]
+
+
+def new_pipeline(image_data, preprocessor, out):
+    def open_draft(_):
+        img = Image.open(BytesIO(image_data))
+        img.draft("RGB", preprocessor.image_size)
+        return img
+
+    return [
+        ("open", open_draft),
+        ("decode", lambda img: img.convert("RGB") if img.mode != "RGB" else (img.load(), img)[1]),
+        ("resize", lambda img: img.resize(preprocessor.image_size, preprocessor.resample)
+         if img.size != preprocessor.image_size else img),
+        ("to_array", lambda img: np.asarray(img)),
+        ("normalize", lambda arr: np.multiply(np.copyto(out, arr) or out, preprocessor.rescale, out=out)),
+    ]
+
+
+def profile(make_stages, iterations):
+    """Returns {stage: (mean ms, peak KiB allocated)} over the given iterations."""
+    stage_names = [name for name, _ in make_stages()]
+    times = {name: 0.0 for name in stage_names}
+    for _ in range(iterations):
+        value = None
+        for name, stage in make_stages():
+            started = time.perf_counter()
+            value = stage(value)
+            times[name] += time.perf_counter() - started
+
+    peaks = {}
+    value = None
+    tracemalloc.start()
+    for name, stage in make_stages():
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        value = stage(value)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[name] = (peak - before) / 1024.0
+    tracemalloc.stop()
+    return {name: (times[name] * 1000.0 / iterations, peaks[name]) for name in stage_names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--frame", help="JPEG to use instead of a generated 1280x720 frame")
+    args = parser.parse_args()
+
+    if args.frame:
+        with open(args.frame, "rb") as f:
+            image_data = f.read()
+    else:
+        image_data = make_frame()
+    preprocessor = Preprocessor(IMAGE_SIZE)
+    out = preprocessor.buffers.acquire()
+
+    results = {
+        "old": profile(lambda: old_pipeline(image_data), args.iterations),
+        "new": profile(lambda: new_pipeline(image_data, preprocessor, out), args.iterations),
+    }
+    with Image.open(BytesIO(image_data)) as img:
+        print(f"Frame: {img.size[0]}x{img.size[1]} {img.format}, {len(image_data) / 1024:.0f} KiB, "
+              f"{args.iterations} iterations\n")
+
+    print(f"{'stage':<12}{'old ms':>10}{'new ms':>10}{'old KiB':>12}{'new KiB':>12}")
+    totals = {"old": [0.0, 0.0], "new": [0.0, 0.0]}
+    for stage in results["old"]:
+        old_ms, old_kib = results["old"][stage]
+        new_ms, new_kib = results["new"][stage]
+        print(f"{stage:<12}{old_ms:>10.3f}{new_ms:>10.3f}{old_kib:>12.0f}{new_kib:>12.0f}")
+        for key, ms, kib in (("old", old_ms, old_kib), ("new", new_ms, new_kib)):
+            totals[key][0] += ms
+            totals[key][1] += kib
+    print(f"{'total':<12}{totals['old'][0]:>10.3f}{totals['new'][0]:>10.3f}"
+          f"{totals['old'][1]:>12.0f}{totals['new'][1]:>12.0f}")
+
+    # Sanity check: both pipelines should feed the model nearly the same pixels
+    old_input = np.asarray(Image.open(BytesIO(image_data)).convert("RGB").resize(IMAGE_SIZE), dtype=np.float32) / 255.
+    new_input = preprocessor.preprocess_into(image_data, out)
+    print(f"\nmean |old - new| pixel difference: {np.mean(np.abs(old_input - new_input)):.4f}")
+
+
+if __name__ == "__main__":
+    main()
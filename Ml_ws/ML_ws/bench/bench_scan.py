@@ -0,0 +1,317 @@
+"""End-to-end /scan throughput and latency, fully offline.
+
+Starts the fake Gemini and Custom Search servers (fake_upstreams.py), builds a frame
+corpus (corpus.py), launches each target app in its own scratch directory with the
+upstream URLs pointed at the fakes, drives it at --rps with the open-loop load
+generator (loadgen.py) and reports throughput, p50/p95/p99 latency, upstream calls
+per scan and CPU/RSS of every server worker process.
+
+Targets: web (web.py, synthetic model, see bench_app.py), web_async, product
+(product_ws/app.py) and product_async. Sync targets run under gunicorn when it is
+installed (else the single-process Werkzeug server), async ones under hypercorn.
+--server prefork runs the web target under prefork.py.
+
+    python bench/bench_scan.py --target web --target product --rps 20 --duration 30 --workers 2
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import fake_upstreams
+from corpus import PHONE_PHOTO_DIR, build_corpus, load_corpus
+from loadgen import print_summary, run_load
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ML_WS_DIR = os.path.dirname(BENCH_DIR)
+PRODUCT_WS_DIR = os.path.join(os.path.dirname(os.path.dirname(ML_WS_DIR)), "product_ws")
+sys.path.insert(0, ML_WS_DIR)
+from model_bundle import write_manifest  # noqa: E402
+
+# target -> (source directory, module:app, async, extra environment)
+TARGETS = {
+    "web": (BENCH_DIR, "bench_app:app", False, {}),
+    "web_async": (BENCH_DIR, "bench_app:app", True, {"PRODSCAN_BENCH_ASYNC": "1"}),
+    "product": (PRODUCT_WS_DIR, "app:app", False, {}),
+    "product_async": (PRODUCT_WS_DIR, "app_async:app", True, {}),
+}
+SYNTHETIC_MODEL_NAME = "synthetic.json"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def module_available(name):
+    return subprocess.run([sys.executable, "-c", f"import {name}"], capture_output=True).returncode == 0
+
+
+def write_synthetic_bundle(bundle_dir, class_labels, base_ms, per_image_ms, phone_ratio):
+    """A model bundle whose only artifact is a bench_app.SyntheticBackend config."""
+    os.makedirs(bundle_dir, exist_ok=True)
+    with open(os.path.join(bundle_dir, SYNTHETIC_MODEL_NAME), "w") as f:
+        json.dump({"num_classes": len(class_labels), "base_ms": base_ms,
+                   "per_image_ms": per_image_ms, "phone_ratio": phone_ratio}, f)
+    write_manifest(bundle_dir, class_labels, (224, 224), None, artifacts={"synthetic": SYNTHETIC_MODEL_NAME})
+
+
+def phone_class_labels():
+    labels = sorted(name for name in os.listdir(PHONE_PHOTO_DIR)
+                    if os.path.isdir(os.path.join(PHONE_PHOTO_DIR, name)) and "_" in name)
+    return labels or ["acme_phone_1", "acme_phone_2"]
+
+
+def server_command(target, server, workers, threads, port):
+    app_spec = TARGETS[target][1]
+    bind = f"127.0.0.1:{port}"
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(workers), "--threads", str(threads),
+                "-b", bind, "--timeout", "120", app_spec]
+    if server == "hypercorn":
+        return [sys.executable, "-m", "hypercorn", "-w", str(workers), "-b", bind, app_spec]
+    module, attribute = app_spec.split(":")
+    if server == "prefork":  # web.py only: prefork.py always serves web.app
+        return [sys.executable, os.path.join(ML_WS_DIR, "prefork.py"), "--workers", str(workers),
+                "--threads", str(threads), "--bind", bind, "--app-module", module, "--report-interval", "10"]
+    return [sys.executable, "-c",
+            f"from werkzeug.serving import run_simple; import {module}; "
+            f"run_simple('127.0.0.1', {port}, {module}.{attribute}, threaded=True)"]
+
+
+def choose_server(target, requested):
+    is_async = TARGETS[target][2]
+    if requested != "auto":
+        return requested
+    if is_async:
+        return "hypercorn"
+    return "gunicorn" if module_available("gunicorn") else "werkzeug"
+
+
+def wait_until_up(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before answering")
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            time.sleep(0.25)
+    raise TimeoutError(f"{url} did not answer within {timeout} s")
+
+
+# --- Worker CPU / RSS ---
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_tree(root_pid):
+    """root_pid and all of its descendants (gunicorn/hypercorn workers), from /proc."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = [root_pid], [root_pid]
+    while frontier:
+        children = [pid for pid, parent in parents.items() if parent in frontier]
+        tree.extend(children)
+        frontier = children
+    return tree
+
+
+def process_usage(pid):
+    """(cpu seconds, rss bytes) of one process, or None once it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss_pages * PAGE_SIZE
+
+
+class ProcessSampler(threading.Thread):
+    """Samples CPU time and RSS of every process in a server's tree twice a second."""
+
+    def __init__(self, root_pid, interval=0.5):
+        super().__init__(name="process-sampler", daemon=True)
+        self.root_pid = root_pid
+        self.interval = interval
+        self.first = {}  # pid -> (time, cpu seconds)
+        self.last = {}
+        self.peak_rss = {}
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        now = time.monotonic()
+        for pid in process_tree(self.root_pid):
+            usage = process_usage(pid)
+            if usage is None:
+                continue
+            cpu, rss = usage
+            self.first.setdefault(pid, (now, cpu))
+            self.last[pid] = (now, cpu, rss)
+            self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        super().start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+    def report(self):
+        """[{pid, role, cpu_percent, rss_mib, peak_rss_mib}] for the sampled window."""
+        workers = []
+        for pid, (first_time, first_cpu) in sorted(self.first.items()):
+            last_time, last_cpu, rss = self.last[pid]
+            wall = last_time - first_time
+            workers.append({
+                "pid": pid,
+                "role": "master" if pid == self.root_pid and len(self.first) > 1 else "worker",
+                "cpu_percent": 100.0 * (last_cpu - first_cpu) / wall if wall else 0.0,
+                "rss_mib": rss / 2 ** 20,
+                "peak_rss_mib": self.peak_rss[pid] / 2 ** 20,
+            })
+        return workers
+
+
+# --- Benchmark ---
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.load(response)
+
+
+def bench_target(target, args, frames, upstream_env, stats_urls, workdir):
+    source_dir, _, _, extra_env = TARGETS[target]
+    server = choose_server(target, args.server)
+    run_dir = os.path.join(workdir, target)
+    os.makedirs(run_dir)
+    if source_dir == BENCH_DIR:
+        write_synthetic_bundle(os.path.join(run_dir, "model_bundle"), phone_class_labels(),
+                               args.model_base_ms, args.model_per_image_ms, args.phone_ratio)
+
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=source_dir,
+               PRODSCAN_MODEL_BACKEND="synthetic", **upstream_env, **extra_env)
+    command = server_command(target, server, args.workers, args.threads, port)
+    log_path = os.path.join(workdir, f"{target}.log")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        # web.py loads its model in the background; /readyz turns 200 once it is warm
+        wait_until_up(base_url + ("/readyz" if source_dir == BENCH_DIR else "/cache/stats"), process)
+        run_load(base_url, frames, rps=min(args.rps, 5), duration=args.warmup)  # Warm pools and caches
+
+        before = {name: fetch_json(url + "/stats") for name, url in stats_urls.items()}
+        sampler = ProcessSampler(process.pid)
+        sampler.start()
+        result = run_load(base_url, frames, args.rps, args.duration, stream=args.stream,
+                          repeat_ratio=args.repeat_ratio, max_in_flight=args.max_in_flight)
+        sampler.stop()
+        after = {name: fetch_json(url + "/stats") for name, url in stats_urls.items()}
+    except Exception as e:
+        print(f"{target}: {e} (server log: {log_path})")
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    summary = result.summary()
+    upstream_calls = {f"{service}.{kind}": count - before[service].get(kind, 0)
+                      for service, counts in after.items() for kind, count in counts.items()}
+    return {"target": target, "server": server, "workers": 1 if server == "werkzeug" else args.workers,
+            "summary": summary,
+            "upstream_calls": upstream_calls, "processes": sampler.report()}
+
+
+def print_report(report):
+    print(f"\n=== {report['target']} ({report['server']}, {report['workers']} workers) ===")
+    print_summary(report["summary"])
+    scans = max(1, report["summary"]["requests"])
+    calls = ", ".join(f"{name} {count / scans:.2f}" for name, count in sorted(report["upstream_calls"].items()))
+    print(f"upstream calls per scan: {calls or 'none'}")
+    print(f"{'pid':>8}  {'role':<7}{'cpu %':>8}{'rss MiB':>10}{'peak MiB':>10}")
+    for worker in report["processes"]:
+        print(f"{worker['pid']:>8}  {worker['role']:<7}{worker['cpu_percent']:>8.1f}"
+              f"{worker['rss_mib']:>10.1f}{worker['peak_rss_mib']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", action="append", choices=sorted(TARGETS), help="repeatable; default: web")
+    parser.add_argument("--rps", type=float, default=10.0, help="target scans per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per target")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--server", choices=("auto", "gunicorn", "hypercorn", "werkzeug", "prefork"), default="auto")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads per worker")
+    parser.add_argument("--stream", action="store_true", help="drive /scan/stream (web targets only)")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="requests that resend a recent frame")
+    parser.add_argument("--max-in-flight", type=int, default=512)
+    parser.add_argument("--frames", help="existing corpus directory; default: build one")
+    parser.add_argument("--frame-count", type=int, default=100)
+    parser.add_argument("--phone-ratio", type=float, default=0.5,
+                        help="share of frames the synthetic model calls a phone")
+    parser.add_argument("--model-base-ms", type=float, default=20.0, help="synthetic model time per batch")
+    parser.add_argument("--model-per-image-ms", type=float, default=5.0, help="synthetic model time per image")
+    parser.add_argument("--json", help="also write the reports to this file")
+    fake_upstreams.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profile = fake_upstreams.profile_from_args(args)
+    gemini = fake_upstreams.start_gemini(free_port(), profile)
+    search = fake_upstreams.start_search(free_port(), profile)
+    gemini_url = f"http://127.0.0.1:{gemini.server_port}"
+    search_url = f"http://127.0.0.1:{search.server_port}"
+    upstream_env = {"PRODSCAN_GEMINI_API_URL": gemini_url + "/generateContent",
+                    "PRODSCAN_GOOGLE_SEARCH_URL": search_url + "/customsearch/v1",
+                    "PRODSCAN_ENRICHMENT_CACHE_DB": "enrichment_cache.db"}
+
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="prodscan-bench-") as workdir:
+        corpus_dir = args.frames or os.path.join(workdir, "frames")
+        if not args.frames:
+            build_corpus(corpus_dir, args.frame_count, args.phone_ratio)
+        frames = load_corpus(corpus_dir)
+        print(f"{len(frames)} frames, {args.rps} scans/s for {args.duration} s per target")
+
+        for target in args.target or ["web"]:
+            report = bench_target(target, args, frames, upstream_env,
+                                  {"gemini": gemini_url, "search": search_url}, workdir)
+            if report:
+                print_report(report)
+                reports.append(report)
+
+    gemini.stop()
+    search.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compares wire size, peak allocations and time of the /scan upload paths.
+
+The old path parsed a JSON data URL, base64-decoded it and base64-encoded it again
+for Gemini. The new paths read raw JPEG bytes (or keep the original base64 text)
+through uploads.read_scan_upload.
+
+    python bench/bench_upload.py --iterations 200
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+from flask import Flask, request
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+from prodscan_common.uploads import read_scan_upload  # noqa: E402
+
+app = Flask(__name__)
+
+
+def make_frame(width=1280, height=720, quality=90):
+    """A noisy 1280x720 JPEG, roughly the size of a real camera frame."""
+    bands = [Image.effect_noise((width, height), sigma).convert("L") for sigma in (30, 50, 70)]
+    buffer = BytesIO()
+    Image.merge("RGB", bands).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def multipart_body(jpeg, boundary="benchboundary"):
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"frame.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode("ascii")
+    return head + jpeg + f"\r\n--{boundary}--\r\n".encode("ascii"), f"multipart/form-data; boundary={boundary}"
+
+
+# --- Request handlers under test ---
+
+def old_json_path():
+    """What scan_product did before: decode the data URL, then re-encode for Gemini."""
+    data = request.get_json()
+    image_data = base64.b64decode(data['image'].split(',')[1])
+    gemini_b64 = base64.b64encode(image_data).decode('utf-8')
+    return image_data, gemini_b64
+
+
+def gemini_only_path():
+    """product_ws/app.py with the scan cache off: base64 passes straight through."""
+    return read_scan_upload(request).b64
+
+
+def local_only_path():
+    """web.py phone path: only the decoded bytes are needed."""
+    return read_scan_upload(request).data
+
+
+def local_and_gemini_path():
+    """web.py non-phone path: bytes for the model, base64 for Gemini."""
+    upload = read_scan_upload(request)
+    return upload.data, upload.b64
+
+
+def measure(handler, body, content_type, iterations):
+    """Returns (peak bytes allocated by one request, mean milliseconds per request)."""
+    def run_once():
+        with app.test_request_context("/scan", method="POST", data=body, content_type=content_type):
+            return handler()
+
+    run_once()  # Warm up imports and caches
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    run_once()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        run_once()
+    return peak, (time.perf_counter() - started) * 1000.0 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    jpeg = make_frame()
+    json_body = json.dumps({"image": "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")})
+    multipart, multipart_type = multipart_body(jpeg)
+
+    scenarios = [
+        ("json, decode + re-encode (old)", old_json_path, json_body, "application/json"),
+        ("json, base64 pass-through", gemini_only_path, json_body, "application/json"),
+        ("json, bytes + base64", local_and_gemini_path, json_body, "application/json"),
+        ("raw image/jpeg, bytes", local_only_path, jpeg, "image/jpeg"),
+        ("raw image/jpeg, bytes + base64", local_and_gemini_path, jpeg, "image/jpeg"),
+        ("multipart, bytes + base64", local_and_gemini_path, multipart, multipart_type),
+    ]
+
+    print(f"Frame: {len(jpeg) / 1024:.0f} KiB JPEG, {args.iterations} iterations per path\n")
+    print(f"{'path':<34}{'wire KiB':>10}{'peak alloc KiB':>16}{'ms/request':>12}")
+    for name, handler, body, content_type in scenarios:
+        peak, mean_ms = measure(handler, body, content_type, args.iterations)
+        print(f"{name:<34}{len(body) / 1024:>10.0f}{peak / 1024:>16.0f}{mean_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
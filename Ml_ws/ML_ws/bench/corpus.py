@@ -0,0 +1,117 @@
+"""Builds the sample-frame corpus that bench_scan.py sends to /scan.
+
+Phone frames are photos from image_data_serpapi, placed on a noisy camera-sized
+background; the rest are synthetic "products" (coloured shapes on noise). Every
+frame is a 1280x720 JPEG at quality 90, about the size of a real camera capture.
+
+    python bench/corpus.py --out bench/frames --count 200
+"""
+import argparse
+import json
+import os
+import random
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PHONE_PHOTO_DIR = os.path.join(os.path.dirname(BENCH_DIR), "image_data_serpapi")
+FRAME_SIZE = (1280, 720)
+MANIFEST_NAME = "corpus.json"
+
+
+def noise_background(rng, size=FRAME_SIZE):
+    bands = [Image.effect_noise(size, rng.choice((20, 40, 60))).convert("L") for _ in range(3)]
+    return Image.merge("RGB", bands)
+
+
+def phone_frame(rng, photo_path, size=FRAME_SIZE):
+    """A catalogue photo scaled to most of the frame height, at a random spot."""
+    frame = noise_background(rng, size)
+    with Image.open(photo_path) as photo:
+        photo = photo.convert("RGBA" if photo.mode == "P" else "RGB").convert("RGB")
+        photo.thumbnail((int(size[0] * 0.6), int(size[1] * 0.9)))
+        frame.paste(photo, (rng.randrange(max(1, size[0] - photo.width)),
+                            rng.randrange(max(1, size[1] - photo.height))))
+    return frame
+
+
+def product_frame(rng, size=FRAME_SIZE):
+    """A few large coloured shapes, so perceptual hashes differ from frame to frame."""
+    frame = noise_background(rng, size)
+    draw = ImageDraw.Draw(frame)
+    for _ in range(rng.randint(2, 5)):
+        x0, y0 = rng.randrange(size[0] // 2), rng.randrange(size[1] // 2)
+        box = (x0, y0, x0 + rng.randint(150, size[0] // 2), y0 + rng.randint(100, size[1] // 2))
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=colour)
+    return frame
+
+
+def list_phone_photos(photo_dir=PHONE_PHOTO_DIR):
+    photos = []
+    for root, _, files in os.walk(photo_dir):
+        photos.extend(os.path.join(root, name) for name in sorted(files)
+                      if name.lower().endswith((".jpg", ".jpeg", ".png")))
+    return sorted(photos)
+
+
+def build_corpus(out_dir, count=100, phone_ratio=0.5, photo_dir=PHONE_PHOTO_DIR, quality=90, seed=0):
+    """Writes count JPEG frames plus corpus.json into out_dir; returns the manifest."""
+    rng = random.Random(seed)
+    photos = list_phone_photos(photo_dir)
+    if not photos:
+        print(f"No photos under {photo_dir}; every frame will be a synthetic product")
+    os.makedirs(out_dir, exist_ok=True)
+
+    frames = []
+    for index in range(count):
+        kind = "phone" if photos and rng.random() < phone_ratio else "product"
+        image = phone_frame(rng, rng.choice(photos)) if kind == "phone" else product_frame(rng)
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+        name = f"frame_{index:04d}_{kind}.jpg"
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(buffer.getvalue())
+        frames.append({"file": name, "kind": kind, "bytes": buffer.tell()})
+
+    manifest = {"frame_size": list(FRAME_SIZE), "quality": quality, "seed": seed, "frames": frames}
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_corpus(corpus_dir):
+    """JPEG bytes of every frame listed in corpus.json (or every .jpg if there is none)."""
+    manifest_path = os.path.join(corpus_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            names = [frame["file"] for frame in json.load(f)["frames"]]
+    else:
+        names = sorted(name for name in os.listdir(corpus_dir) if name.lower().endswith((".jpg", ".jpeg")))
+    frames = []
+    for name in names:
+        with open(os.path.join(corpus_dir, name), "rb") as f:
+            frames.append(f.read())
+    if not frames:
+        raise FileNotFoundError(f"No frames in {corpus_dir}")
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "frames"))
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--phone-ratio", type=float, default=0.5, help="share of frames showing a phone photo")
+    parser.add_argument("--photos", default=PHONE_PHOTO_DIR, help="directory of phone photos")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = build_corpus(args.out, args.count, args.phone_ratio, args.photos, seed=args.seed)
+    total = sum(frame["bytes"] for frame in manifest["frames"])
+    print(f"Wrote {len(manifest['frames'])} frames ({total / len(manifest['frames']) / 1024:.0f} KiB each "
+          f"on average) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Local stand-ins for Gemini generateContent and Google Custom Search.
+
+Both servers answer in the real APIs' JSON shapes after a log-normally distributed
+delay, fail a configurable share of calls with 429/500/503, and count every call
+(GET /stats). Gemini picks the product from a hash of the request, so the same frame
+is always "recognised" as the same product; answers come in three kinds:
+
+    complete   every field, including the price (no follow-up calls)
+    partial    no usage and no price (the app follows up with two text calls)
+    malformed  not JSON (web.py falls back to a free-text identification call)
+
+    python bench/fake_upstreams.py --gemini-port 8701 --search-port 8702 --latency-ms 400
+
+then point the apps at them with PRODSCAN_GEMINI_API_URL=http://127.0.0.1:8701/generateContent
+and PRODSCAN_GOOGLE_SEARCH_URL=http://127.0.0.1:8702/customsearch/v1.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BRANDS = ("Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Hooli", "Soylent")
+
+
+class UpstreamProfile:
+    """Latency, error and answer distribution of one fake service."""
+
+    def __init__(self, latency_ms=300.0, latency_sigma=0.5, error_rate=0.0, image_latency_ms=None,
+                 partial_ratio=0.3, malformed_ratio=0.05, catalog_size=200, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.image_latency_ms = image_latency_ms if image_latency_ms is not None else latency_ms
+        self.partial_ratio = partial_ratio
+        self.malformed_ratio = malformed_ratio
+        self.catalog_size = catalog_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, median_ms):
+        """Log-normal seconds with the given median; sigma 0 gives a fixed delay."""
+        with self._lock:
+            factor = math.exp(self._random.gauss(0.0, self.latency_sigma)) if self.latency_sigma else 1.0
+        return max(0.0, median_ms * factor / 1000.0)
+
+    def fails(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def error_status(self):
+        with self._lock:
+            return self._random.choice((429, 500, 503))
+
+    def kind(self, digest):
+        """Answer kind for a request digest: stable for the same frame."""
+        draw = int.from_bytes(digest[4:8], "big") / 2 ** 32
+        if draw < self.malformed_ratio:
+            return "malformed"
+        if draw < self.malformed_ratio + self.partial_ratio:
+            return "partial"
+        return "complete"
+
+    def product(self, digest):
+        index = int.from_bytes(digest[:4], "big") % self.catalog_size
+        brand = BRANDS[index % len(BRANDS)]
+        return {
+            "product_name": f"{brand} Gadget {index}",
+            "brand": brand,
+            "brand_details": f"{brand} is owned by {brand} Holdings.",
+            "release_date": "September 7, 2022",
+            "usage": f"Used for everyday gadget number {index}.",
+            "price_thb": 990 + 10 * index,
+        }
+
+
+def gemini_answer(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+def gemini_response(profile, body):
+    """(call kind, response body) for one generateContent request."""
+    parts = body["contents"][0]["parts"]
+    image = next((part["inline_data"]["data"] for part in parts if "inline_data" in part), None)
+    prompt = parts[0].get("text", "")
+    if image is None:
+        # Text follow-up; the product name is the only varying part of the prompt
+        product = profile.product(hashlib.sha1(prompt.encode("utf-8")).digest())
+        if "price" in prompt:
+            return "price", gemini_answer(f"It typically sells for around {product['price_thb']:,} THB.")
+        return "usage", gemini_answer(product["usage"])
+
+    digest = hashlib.sha1(image.encode("ascii", "ignore")).digest()
+    product = profile.product(digest)
+    kind = profile.kind(digest)
+    if "generationConfig" in body:
+        if kind == "malformed":
+            return "identify_structured", gemini_answer("Sorry, I can't answer in JSON right now.")
+        if kind == "partial":
+            product = dict(product, usage=None, price_thb=None)
+        return "identify_structured", gemini_answer(json.dumps(product))
+    lines = [f"Product Name: {product['product_name']}", f"Brand: {product['brand']}",
+             f"Brand Details: {product['brand_details']}", f"Release Date: {product['release_date']}"]
+    if kind == "complete":
+        lines.append(f"Used for: {product['usage']}")
+    return "identify", gemini_answer("\n".join(lines) + "\n")
+
+
+def search_response(profile, query):
+    """Custom Search result page with a mix of priced and unpriced hits."""
+    product_name = query.rsplit(" price", 1)[0]
+    product = profile.product(hashlib.sha1(product_name.encode("utf-8")).digest())
+    items = []
+    for shop in ("Shopee", "Lazada", "JIB", "Banana IT", "Power Buy"):
+        items.append({"title": f"{product_name} price at {shop}", "link": f"https://example.com/{shop}",
+                      "snippet": f"{product_name} ฿{product['price_thb']:,} free delivery"})
+    items.append({"title": f"{product_name} review", "link": "https://example.com/review",
+                  "snippet": "Hands-on with the latest model."})
+    return {"kind": "customsearch#search", "items": items}
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """One fake service on a background thread, with per-kind call counters."""
+    daemon_threads = True
+    request_queue_size = 1024  # Listen backlog; the default of 5 refuses connections under load
+
+    def __init__(self, port, profile, respond, host="127.0.0.1"):
+        self.profile = profile
+        self.respond = respond  # (handler) -> (call kind, median latency ms, body dict)
+        self.counts = {}
+        self.count_lock = threading.Lock()
+        super().__init__((host, port), _Handler)
+        self.thread = threading.Thread(target=self.serve_forever, name=f"fake-upstream-{port}", daemon=True)
+
+    def count(self, kind):
+        with self.count_lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        if self.path == "/stats":
+            with self.server.count_lock:
+                return self._send(200, dict(self.server.counts))
+        kind, median_ms, body = self.server.respond(self)
+        time.sleep(self.server.profile.delay(median_ms))
+        if self.server.profile.fails():
+            self.server.count("error")
+            status = self.server.profile.error_status()
+            return self._send(status, {"error": {"code": status, "message": "Injected failure",
+                                                 "status": "UNAVAILABLE"}})
+        self.server.count(kind)
+        self._send(200, body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def _gemini_respond(handler):
+    body = json.loads(handler.rfile.read(int(handler.headers.get("Content-Length", 0))))
+    kind, answer = gemini_response(handler.server.profile, body)
+    profile = handler.server.profile
+    return kind, profile.image_latency_ms if kind.startswith("identify") else profile.latency_ms, answer
+
+
+def _search_respond(handler):
+    query = parse_qs(urlsplit(handler.path).query).get("q", [""])[0]
+    return "search", handler.server.profile.latency_ms, search_response(handler.server.profile, query)
+
+
+def start_gemini(port, profile):
+    return FakeUpstream(port, profile, _gemini_respond).start()
+
+
+def start_search(port, profile):
+    return FakeUpstream(port, profile, _search_respond).start()
+
+
+def add_profile_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="median latency of text calls")
+    parser.add_argument("--image-latency-ms", type=float, default=None,
+                        help="median latency of image identification calls (default: --latency-ms)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread; 0 for fixed delays")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered 429/500/503")
+    parser.add_argument("--partial-ratio", type=float, default=0.3, help="identifications without usage/price")
+    parser.add_argument("--malformed-ratio", type=float, default=0.05, help="structured answers that are not JSON")
+    parser.add_argument("--catalog-size", type=int, default=200, help="distinct products the fake recognises")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def profile_from_args(args):
+    return UpstreamProfile(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                           error_rate=args.error_rate, image_latency_ms=args.image_latency_ms,
+                           partial_ratio=args.partial_ratio, malformed_ratio=args.malformed_ratio,
+                           catalog_size=args.catalog_size, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gemini-port", type=int, default=8701)
+    parser.add_argument("--search-port", type=int, default=8702)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profile = profile_from_args(args)
+    servers = [start_gemini(args.gemini_port, profile), start_search(args.search_port, profile)]
+    print(f"Fake Gemini: http://127.0.0.1:{args.gemini_port}/generateContent")
+    print(f"Fake Custom Search: http://127.0.0.1:{args.search_port}/customsearch/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Open-loop load generator for POST /scan (or /scan/stream).
+
+Requests are sent on a fixed schedule at the target rate, whether or not earlier
+ones have finished, and each latency is measured from the request's scheduled send
+time. A server that falls behind therefore shows up as growing latency instead
+of a quietly lower request rate (no coordinated omission).
+
+    python bench/loadgen.py http://127.0.0.1:2502 --frames bench/frames --rps 20 --duration 30
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from corpus import load_corpus
+
+
+class LoadResult:
+    """Per-request samples of one run: (scheduled offset s, latency s, first-event s, status)."""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+        self.started = None
+        self.finished = None
+
+    def add(self, scheduled, latency, first_event, status):
+        with self._lock:
+            self.samples.append((scheduled, latency, first_event, status))
+
+    def summary(self):
+        ok = sorted(latency for _, latency, _, status in self.samples if status == 200)
+        first = sorted(first for _, _, first, status in self.samples if status == 200 and first is not None)
+        elapsed = (self.finished - self.started) if self.started and self.finished else 0.0
+        summary = {
+            "requests": len(self.samples),
+            "ok": len(ok),
+            "statuses": dict(Counter(str(status) for *_, status in self.samples)),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        }
+        for name, values in (("latency", ok), ("first_event", first)):
+            for q in (50, 95, 99):
+                summary[f"{name}_p{q}_ms"] = percentile(values, q) * 1000.0 if values else None
+        summary["latency_max_ms"] = ok[-1] * 1000.0 if ok else None
+        return summary
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_load(base_url, frames, rps, duration, stream=False, repeat_ratio=0.2, max_in_flight=512,
+             timeout=60, poisson=False, seed=0):
+    """Sends rps scans per second for duration seconds; returns a LoadResult.
+
+    repeat_ratio is the share of requests that resend one of the last few frames,
+    like a user holding the camera on the same product (these hit the scan cache).
+    """
+    rng = random.Random(seed)
+    url = base_url.rstrip("/") + ("/scan/stream" if stream else "/scan")
+    sessions = threading.local()
+    result = LoadResult()
+
+    def send(frame, scheduled_at):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        first_event = None
+        try:
+            response = session.post(url, data=frame, headers={"Content-Type": "image/jpeg"},
+                                    timeout=timeout, stream=stream)
+            if stream:
+                for line in response.iter_lines():
+                    if line and first_event is None:
+                        first_event = time.perf_counter() - scheduled_at
+            else:
+                response.content
+            status = response.status_code
+        except requests.exceptions.Timeout:
+            status = "timeout"
+        except requests.exceptions.RequestException:
+            status = "connection_error"
+        result.add(scheduled_at - result.started, time.perf_counter() - scheduled_at, first_event, status)
+
+    recent = []
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadgen") as pool:
+        result.started = time.perf_counter()
+        next_at = result.started
+        end = result.started + duration
+        while next_at < end:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if recent and rng.random() < repeat_ratio:
+                frame = rng.choice(recent)
+            else:
+                frame = rng.choice(frames)
+                recent = (recent + [frame])[-4:]
+            pool.submit(send, frame, next_at)
+            next_at += rng.expovariate(rps) if poisson else 1.0 / rps
+    result.finished = time.perf_counter()
+    return result
+
+
+def print_summary(summary):
+    statuses = ", ".join(f"{status}: {count}" for status, count in sorted(summary["statuses"].items()))
+    print(f"{summary['requests']} requests in {summary['elapsed_s']:.1f} s ({statuses})")
+    print(f"throughput {summary['throughput_rps']:.1f} ok/s")
+    for name in ("latency", "first_event"):
+        if summary[f"{name}_p50_ms"] is not None:
+            print(f"{name:<12} p50 {summary[f'{name}_p50_ms']:8.1f} ms   p95 {summary[f'{name}_p95_ms']:8.1f} ms"
+                  f"   p99 {summary[f'{name}_p99_ms']:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url", help="server base URL, e.g. http://127.0.0.1:2502")
+    parser.add_argument("--frames", required=True, help="corpus directory (see corpus.py)")
+    parser.add_argument("--rps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--stream", action="store_true", help="use /scan/stream and time the first event")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2)
+    parser.add_argument("--max-in-flight", type=int, default=512)
+    parser.add_argument("--poisson", action="store_true", help="exponential gaps instead of a fixed rate")
+    args = parser.parse_args()
+
+    result = run_load(args.url, load_corpus(args.frames), args.rps, args.duration, stream=args.stream,
+                      repeat_ratio=args.repeat_ratio, max_in_flight=args.max_in_flight, poisson=args.poisson)
+    print_summary(result.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from backends import load_backend
+from embedding_index import FlatIndex, IVFPQIndex, load_index
+from model_bundle import BUNDLE_DIR, load_bundle
+from preprocessing import Preprocessor
+
+# --- Catalog Index ---
+# Builds and edits the catalog index web.py matches unknown products against. Each
+# product is a label with a few reference photos; its embeddings come from the same
+# bundle and backend the server uses, and the bundle version is stored with the index
+# so a server with different weights does not load it.
+#
+#     python catalog.py build --images catalog_photos            # one directory per label
+#     python catalog.py build --images catalog_photos --kind ivfpq --nlist 256
+#     python catalog.py add samsung_galaxy_a55 front.jpg back.jpg
+#     python catalog.py query photo.jpg
+#
+# The labels follow the training directories ('brand_model_name'). A server picks up
+# changes to the index when it next loads its model (restart or new worker).
+INDEX_DIR = os.environ.get("PRODSCAN_CATALOG_INDEX", os.path.join(BUNDLE_DIR, "catalog_index"))
+MODEL_BACKEND = os.environ.get("PRODSCAN_MODEL_BACKEND", "keras")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+EMBED_BATCH_SIZE = 16
+
+
+class Embedder:
+    """Image files -> embeddings, with the server's bundle, backend and preprocessing."""
+
+    def __init__(self, bundle_dir=BUNDLE_DIR, backend=MODEL_BACKEND):
+        self.bundle = load_bundle(bundle_dir)
+        self.model = load_backend(backend, self.bundle)
+        if getattr(self.model, "predict_with_embedding", None) is None:
+            raise SystemExit(f"Backend {backend} has no embedding output; use keras or a two-output onnx export")
+        self.preprocessor = Preprocessor(self.bundle.image_size, self.bundle.rescale)
+
+    def embed(self, paths):
+        """(len(paths), dim) float32 embeddings, EMBED_BATCH_SIZE images per forward pass."""
+        embeddings = []
+        for start in range(0, len(paths), EMBED_BATCH_SIZE):
+            chunk = paths[start:start + EMBED_BATCH_SIZE]
+            batch = np.empty((len(chunk), *self.bundle.image_size, 3), dtype=np.float32)
+            for row, path in enumerate(chunk):
+                with open(path, "rb") as f:
+                    self.preprocessor.preprocess_into(f.read(), batch[row])
+            embeddings.append(np.asarray(self.model.predict_with_embedding(batch)[1], dtype=np.float32))
+        return np.concatenate(embeddings)
+
+
+def list_photos(images_dir):
+    """(paths, labels) for every image under images_dir/<label>/."""
+    paths, labels = [], []
+    for label in sorted(os.listdir(images_dir)):
+        label_dir = os.path.join(images_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(label_dir, name))
+                labels.append(label)
+    return paths, labels
+
+
+def top1_agreement(index, exact, vectors):
+    """Share of vectors whose nearest row is the same in index and in the exact index."""
+    return float(np.mean(index.search(vectors, 1)[1][:, 0] == exact.search(vectors, 1)[1][:, 0]))
+
+
+def build(args):
+    paths, labels = list_photos(args.images)
+    if not paths:
+        raise SystemExit(f"No images found under {args.images}/<label>/")
+    embedder = Embedder()
+    started = time.perf_counter()
+    vectors = embedder.embed(paths)
+    print(f"Embedded {len(paths)} photos of {len(set(labels))} products in {time.perf_counter() - started:.1f}s")
+
+    index = FlatIndex(vectors.shape[1])
+    index.add(vectors, labels)
+    if args.kind == "ivfpq":
+        exact = index
+        index = IVFPQIndex(vectors.shape[1], nlist=args.nlist, m=args.m, nprobe=args.nprobe)
+        index.train(vectors)
+        index.add(vectors, labels)
+        print(f"IVF-PQ: {index.m} bytes per photo, top-1 agreement with exact search "
+              f"{top1_agreement(index, exact, vectors):.3f}")
+    index.metadata = {"bundle_version": embedder.bundle.version, "backend": MODEL_BACKEND}
+    index.save(args.index)
+    print(f"Catalog index written to {args.index}: {index.stats()}")
+
+
+def add(args):
+    index = load_index(args.index, mmap=False)
+    embedder = Embedder()
+    if index.metadata.get("bundle_version") != embedder.bundle.version:
+        raise SystemExit(f"Index was built with bundle {index.metadata.get('bundle_version')}, "
+                         f"not {embedder.bundle.version}; rebuild it")
+    index.add(embedder.embed(args.photos), [args.label] * len(args.photos))
+    index.save(args.index)
+    print(f"Added {len(args.photos)} photos of {args.label}: {index.stats()}")
+
+
+def query(args):
+    index = load_index(args.index)
+    embedding = Embedder().embed([args.photo])
+    started = time.perf_counter()
+    matches = index.match(embedding, args.k)[0]
+    print(f"Searched {len(index)} photos in {(time.perf_counter() - started) * 1000:.1f} ms")
+    for label, score in matches:
+        print(f"  {score:.3f}  {label}")
+
+
+# --- Main Execution ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, extend and query the product catalog index.")
+    parser.add_argument("--index", default=INDEX_DIR, help="Index directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Index every photo under --images/<label>/.")
+    build_parser.add_argument("--images", required=True)
+    build_parser.add_argument("--kind", choices=("flat", "ivfpq"), default="flat",
+                              help="flat: exact search; ivfpq: compressed, approximate, for large catalogs")
+    build_parser.add_argument("--nlist", type=int, default=64, help="IVF-PQ coarse clusters")
+    build_parser.add_argument("--m", type=int, default=16, help="IVF-PQ bytes per photo")
+    build_parser.add_argument("--nprobe", type=int, default=8, help="IVF-PQ clusters searched per query")
+    build_parser.set_defaults(handler=build)
+
+    add_parser = commands.add_parser("add", help="Register reference photos of one product.")
+    add_parser.add_argument("label", help="Product label, e.g. samsung_galaxy_a55")
+    add_parser.add_argument("photos", nargs="+")
+    add_parser.set_defaults(handler=add)
+
+    query_parser = commands.add_parser("query", help="Show the closest catalog products to a photo.")
+    query_parser.add_argument("photo")
+    query_parser.add_argument("-k", type=int, default=5)
+    query_parser.set_defaults(handler=query)
+
+    args = parser.parse_args()
+    args.handler(args)
@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- Crawl State ---
+# data.py records every step of a crawl in crawl_state.db (next to the images): each
+# search result page and the cursor of the page after it, every image URL found with
+# its download outcome (HTTP status, stored SHA-256 or rejection reason), and each
+# model's last price. A re-run picks up from there instead of starting over:
+#   - a model with MAX_IMAGES_PER_MODEL stored images and a fresh price is skipped
+#   - URLs left pending (not yet tried, or cancelled by Ctrl-C) are downloaded first,
+#     and searching resumes from the saved cursor rather than page one
+#   - stored, rejected and gone (HTTP 4xx) URLs are never fetched again; URLs that
+#     failed for a transient reason (timeout, 5xx, 429) get MAX_URL_ATTEMPTS runs
+#   - results older than SEARCH_MAX_AGE are searched again from page one, and prices
+#     older than PRICE_MAX_AGE are looked up again
+STATE_FILE = "crawl_state.db"
+SEARCH_MAX_AGE = 30 * 86400  # Seconds before a model's saved result pages count as stale
+PRICE_MAX_AGE = 86400  # Seconds a looked-up price stays fresh
+MAX_URL_ATTEMPTS = 3  # Runs in which a URL may fail transiently before it is given up on
+URL_STATUSES = ("pending", "stored", "rejected", "gone", "failed")
+
+STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    label TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    query TEXT NOT NULL,
+    results INTEGER NOT NULL,
+    next_cursor TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (label, page)
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    http_status INTEGER,
+    detail TEXT,
+    sha256 TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_by_label ON urls (label, status, page, position);
+CREATE TABLE IF NOT EXISTS prices (
+    label TEXT PRIMARY KEY,
+    price TEXT NOT NULL,
+    priced_at REAL NOT NULL
+);
+'''
+
+
+def download_status(download):
+    """The urls.status a settled download leaves its URL in."""
+    if download.outcome == "succeeded":
+        return "stored"
+    if download.outcome == "rejected":
+        return "rejected"
+    if download.outcome == "cancelled":
+        return "pending"
+    status = download.http_status
+    if status is not None and 400 <= status < 500 and status not in (408, 429):
+        return "gone"
+    return "failed"
+
+
+class CrawlState:
+    """SQLite record of pages, URLs and prices, shared by the crawl's threads."""
+
+    def __init__(self, path, search_max_age=SEARCH_MAX_AGE, price_max_age=PRICE_MAX_AGE,
+                 max_url_attempts=MAX_URL_ATTEMPTS):
+        self.path = path
+        self.search_max_age = search_max_age
+        self.price_max_age = price_max_age
+        self.max_url_attempts = max_url_attempts
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(STATE_SCHEMA)
+        self._lock = threading.Lock()
+
+    def resume(self, crawl):
+        """Loads what earlier runs left for crawl: its pending URLs, its search cursor
+        (unless the saved pages are stale) and a fresh price."""
+        now = time.time()
+        with self._lock:
+            last_page = self._conn.execute(
+                "SELECT page, next_cursor, fetched_at FROM pages WHERE label = ? ORDER BY page DESC LIMIT 1",
+                (crawl.label,)).fetchone()
+            urls = self._conn.execute(
+                "SELECT url FROM urls WHERE label = ? AND (status = 'pending' OR status = 'failed' AND attempts < ?) "
+                "ORDER BY page, position", (crawl.label, self.max_url_attempts)).fetchall()
+            price = self._conn.execute("SELECT price FROM prices WHERE label = ? AND priced_at > ?",
+                                       (crawl.label, now - self.price_max_age)).fetchone()
+        if last_page is not None and now - last_page[2] <= self.search_max_age:
+            crawl.pages = last_page[0] + 1
+            crawl.cursor = json.loads(last_page[1]) if last_page[1] else None
+            crawl.more_pages = last_page[1] is not None
+        elif last_page is not None:
+            with self._lock, self._conn:  # Stale: search again from page one
+                self._conn.execute("DELETE FROM pages WHERE label = ?", (crawl.label,))
+        crawl.urls.extend(url for (url,) in urls)
+        if price is not None:
+            crawl.price = price[0]
+
+    def record_page(self, crawl, query, urls, next_cursor):
+        """Saves result page crawl.pages and the cursor of the page after it (None on the
+        last page); returns the URLs on it that no earlier page had."""
+        now = time.time()
+        new_urls = []
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO pages (label, page, query, results, next_cursor, fetched_at) "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               (crawl.label, crawl.pages, query, len(urls),
+                                json.dumps(next_cursor) if next_cursor is not None else None, now))
+            for position, url in enumerate(urls):
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO urls (url, label, page, position, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'pending', ?)", (url, crawl.label, crawl.pages, position, now)).rowcount
+                if inserted:
+                    new_urls.append(url)
+        return new_urls
+
+    def record_download(self, download):
+        """Downloader on_finished hook: saves a URL's outcome."""
+        status = download_status(download)
+        sha256 = None
+        if download.saved_path:
+            sha256 = os.path.splitext(os.path.basename(download.saved_path))[0]
+        detail = str(download.error)[:500] if download.error is not None else None
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE urls SET status = ?, http_status = ?, detail = ?, sha256 = ?, "
+                               "attempts = attempts + ?, updated_at = ? WHERE url = ?",
+                               (status, download.http_status, detail, sha256, int(status == "failed"),
+                                time.time(), download.url))
+
+    def record_price(self, crawl, price):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO prices (label, price, priced_at) VALUES (?, ?, ?)",
+                               (crawl.label, price, time.time()))
+
+    def stats(self):
+        with self._lock:
+            statuses = dict(self._conn.execute("SELECT status, COUNT(*) FROM urls GROUP BY status"))
+            pages = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return dict({status: statuses.get(status, 0) for status in URL_STATUSES}, pages=pages)
+
+    def report(self):
+        stats = self.stats()
+        return (f"Crawl state: {stats['pages']} result pages, "
+                + ", ".join(f"{stats[status]} {status}" for status in URL_STATUSES) + " URLs")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,215 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# --- Crawl Pipeline ---
+# data.py refreshes the whole catalog by running every model through three stages at
+# once instead of one model after another:
+#   search   -> search_workers threads fetch result pages (SerpAPI) for one model at a time
+#   download -> the shared Downloader fetches that model's images; when a page runs out
+#               before max_images are saved, the model goes back to the search queue
+#   price    -> price_workers threads look up the model's price
+# Each stage has its own queue, so one model's slow search never holds up another's
+# downloads. The crawl is then limited by the upstream rate limits (the search limiter
+# and the Downloader's) rather than by a sequential loop. Ctrl-C stops the searches,
+# cancels the downloads and reports which models did not finish.
+PROGRESS_INTERVAL = 10.0  # Seconds between progress lines
+STOP_TIMEOUT = 15.0  # Seconds to wait for running searches and price lookups after Ctrl-C
+_STOP = object()
+
+
+class ModelCrawl:
+    """One catalog entry on its way through the pipeline."""
+
+    def __init__(self, brand, model, product_dir, max_images, min_images):
+        self.brand = brand
+        self.model = model
+        self.name = f"{brand} {model}"
+        self.product_dir = product_dir
+        self.label = os.path.basename(product_dir)
+        self.max_images = max_images
+        self.min_images = min_images
+        self.stage = "queued"  # queued, searching, downloading, pricing, done
+        self.cursor = None  # Where the search stage left off (its own state, e.g. a SerpAPI search)
+        self.more_pages = True
+        self.pages = 0
+        self.urls = deque()  # Image URLs found and not yet downloaded
+        self.in_flight = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.price = None  # Set up front (a fresh saved price) to skip the price lookup
+
+    def progress(self):
+        return f"{self.name}: {self.stage}, {self.downloaded}/{self.max_images} images, {self.pages} pages"
+
+
+class CrawlScheduler:
+    """Runs ModelCrawls through the search, download and price stages.
+
+    search(crawl) returns the image URLs of the crawl's next result page and clears
+    crawl.more_pages after the last one. save_path(crawl, url) names the file for a
+    download, and price(crawl) returns the price text.
+    """
+
+    def __init__(self, downloader, search, save_path, price, search_workers=4, price_workers=2,
+                 progress_interval=PROGRESS_INTERVAL):
+        self.downloader = downloader
+        self.search = search
+        self.save_path = save_path
+        self.price = price
+        self.search_workers = search_workers
+        self.price_workers = price_workers
+        self.progress_interval = progress_interval
+        self.crawls = []
+        self._search_queue = queue.Queue()
+        self._price_queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._finished = threading.Event()
+        self._done = 0
+
+    def run(self, crawls):
+        """Crawls every entry; returns False if the crawl was interrupted."""
+        self.crawls = list(crawls)
+        if not self.crawls:
+            return True
+        threads = [threading.Thread(target=self._stage_worker, args=(self._search_queue, self._search),
+                                    name=f"crawl-search-{i}", daemon=True) for i in range(self.search_workers)]
+        threads += [threading.Thread(target=self._stage_worker, args=(self._price_queue, self._price),
+                                     name=f"crawl-price-{i}", daemon=True) for i in range(self.price_workers)]
+        for thread in threads:
+            thread.start()
+        for crawl in self.crawls:
+            self._start(crawl)
+
+        started = time.monotonic()
+        interrupted = False
+        try:
+            while not self._finished.wait(self.progress_interval):
+                print(self.progress())
+        except KeyboardInterrupt:
+            interrupted = True
+            print("Interrupted: stopping the crawl...")
+            self.stop()
+
+        for _ in range(self.search_workers):
+            self._search_queue.put(_STOP)
+        for _ in range(self.price_workers):
+            self._price_queue.put(_STOP)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.downloader.close()
+
+        unfinished = [crawl for crawl in self.crawls if crawl.stage != "done"]
+        print(f"Crawled {self._done}/{len(self.crawls)} models in {time.monotonic() - started:.1f}s")
+        for crawl in unfinished:
+            print(f"  not finished: {crawl.progress()}")
+        print(self.downloader.report())
+        return not interrupted
+
+    def stop(self):
+        """Stops taking new work and cancels the downloads; searches and price lookups
+        already running finish on their own."""
+        self._stopping.set()
+        self.downloader.cancel()
+
+    def progress(self):
+        """One line: how many models are in each stage, and the download throughput."""
+        with self._lock:
+            stages = {}
+            for crawl in self.crawls:
+                stages[crawl.stage] = stages.get(crawl.stage, 0) + 1
+        stats = self.downloader.stats()
+        return (f"Crawl: {stages.get('done', 0)}/{len(self.crawls)} done, {stages.get('searching', 0)} searching, "
+                f"{stages.get('downloading', 0)} downloading, {stages.get('pricing', 0)} pricing, "
+                f"{stages.get('queued', 0)} queued | {stats['succeeded']} images, "
+                f"{stats['images_per_second']:.1f} images/s, {stats['bytes_per_second'] / 1e6:.2f} MB/s")
+
+    def _stage_worker(self, stage_queue, handle):
+        while True:
+            crawl = stage_queue.get()
+            if crawl is _STOP:
+                return
+            if not self._stopping.is_set():
+                handle(crawl)
+
+    # --- Stages ---
+
+    def _start(self, crawl):
+        """Sends crawl to the first stage it needs: downloads of the URLs it already has
+        (resuming a crawl), a search for more, or the price once its images are complete."""
+        with self._lock:
+            crawl.stage = "downloading"
+        self._top_up(crawl)
+
+    def _search(self, crawl):
+        with self._lock:
+            crawl.stage = "searching"
+        try:
+            urls = self.search(crawl)
+        except Exception as e:
+            print(f"Error during image search for {crawl.name}: {e}")
+            urls = []
+            crawl.more_pages = False
+        with self._lock:
+            crawl.pages += 1
+            crawl.urls.extend(urls)
+        print(f"[search] {crawl.name}: page {crawl.pages}, {len(urls)} image URLs")
+        self._top_up(crawl)
+
+    def _top_up(self, crawl):
+        """Keeps just enough of crawl's downloads in flight to reach max_images, then moves
+        it on: back to search when the URLs run out, to price once it is complete."""
+        if self._stopping.is_set():
+            return
+        with self._lock:
+            if crawl.stage not in ("searching", "downloading"):
+                return  # Already handed on by another download's callback
+            wanted = crawl.max_images - crawl.downloaded - crawl.in_flight
+            batch = [crawl.urls.popleft() for _ in range(min(wanted, len(crawl.urls)))]
+            crawl.in_flight += len(batch)
+            if crawl.in_flight:
+                crawl.stage = "downloading"
+            elif crawl.downloaded >= crawl.max_images or not crawl.more_pages:
+                crawl.stage = "pricing"
+            else:
+                crawl.stage = "queued"
+            stage = crawl.stage
+        if stage == "pricing":
+            self._price_queue.put(crawl)
+        elif stage == "queued":
+            self._search_queue.put(crawl)
+        for url in batch:
+            future = self.downloader.submit(url, self.save_path(crawl, url))
+            future.add_done_callback(lambda future, crawl=crawl: self._downloaded(crawl, future.result()))
+
+    def _downloaded(self, crawl, saved):
+        with self._lock:
+            crawl.in_flight -= 1
+            if saved:
+                crawl.downloaded += 1
+            else:
+                crawl.failed += 1
+        self._top_up(crawl)
+
+    def _price(self, crawl):
+        with self._lock:
+            crawl.stage = "pricing"
+        try:
+            if crawl.price is None:
+                crawl.price = self.price(crawl)
+        except Exception as e:
+            crawl.price = f"Error retrieving price: {e}"
+        with self._lock:
+            crawl.stage = "done"
+            self._done += 1
+            done = self._done
+        if crawl.downloaded < crawl.min_images:
+            print(f"WARNING: Only {crawl.downloaded} images for {crawl.name} (min: {crawl.min_images}).")
+        print(f"[{done}/{len(self.crawls)}] {crawl.name}: {crawl.downloaded} images "
+              f"({crawl.failed} failed, {crawl.pages} pages)\nPrice Info for {crawl.name}: {crawl.price}\n")
+        if done == len(self.crawls):
+            self._finished.set()
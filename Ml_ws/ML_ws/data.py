@@ -1,14 +1,24 @@
+import argparse
+import functools
 import requests
 import os
+import sys
 import json
 import uuid
 import time
 import random
 import re  # Import the regular expression module
-from urllib.parse import urlparse, unquote
+from urllib.parse import urlparse, unquote, parse_qsl
 from bs4 import BeautifulSoup  # For HTML parsing
 from serpapi import GoogleSearch
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))  # For prodscan_common
+from crawl_state import STATE_FILE, CrawlState
+from crawler import CrawlScheduler, ModelCrawl
+from downloader import Downloader, RateLimiter
+from image_store import ImageStore
+from ingest import Ingest, rejection_report, sniff_image_type
+
 # --- Constants ---
 SERPAPI_KEY = ""  # Replace with your SerpApi key!
 DATA_DIR = "image_data_serpapi"  # Use a different directory for SerpAPI data
@@ -17,6 +27,18 @@ MIN_IMAGES_PER_MODEL = 5
 GOOGLE_SEARCH_API_KEY = ""  # Replace!
 GOOGLE_SEARCH_ENGINE_ID = ""  # Replace!
 GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+DOWNLOAD_WORKERS = 16  # Image downloads in flight at once
+DOWNLOADS_PER_HOST = 4  # ...of which at most this many from one site
+DOWNLOAD_QPS = 20  # Image requests started per second, across all sites
+DOWNLOAD_BYTES_PER_SECOND = None  # Bandwidth cap, e.g. 5_000_000; None for no cap
+SEARCH_WORKERS = 4  # Models whose SerpAPI searches run at once
+SEARCH_QPS = 2  # SerpAPI requests per second, across all models
+PRICE_WORKERS = 2  # Models whose price lookups run at once
+MAX_IMAGE_BYTES = 15_000_000  # Downloads bigger than this are abandoned mid-stream
+MIN_IMAGE_EDGE = 128  # Images whose shorter edge is smaller are dropped
+MAX_IMAGE_EDGE = 640  # Stored images are downscaled to at most this longer edge
+IMAGE_FORMAT = "JPEG"  # Or "WEBP": smaller files, but Keras' flow_from_directory skips .webp
+INGEST_WORKERS = os.cpu_count()  # Threads decoding, checking and re-encoding downloaded images
 
 # --- Phone Models ---
 #  We no longer need the "sites" key since SerpAPI searches across the web.
@@ -86,29 +108,18 @@ def is_valid_image_url(image_url):
     except Exception:
         return False
 
-def download_image(image_url, save_path, timeout=10):
-    """Downloads an image."""
-    if not is_valid_image_url(image_url):
-        print(f"Skipping invalid image URL: {image_url}")
-        return False
+def make_downloader(store, state):
+    """The Downloader shared by every model's downloads: one connection pool, one set of rate limits.
+
+    Its thread pools start here, so it is built by main() rather than on import.
+    """
+    # Downloaded images are checked, downscaled and re-encoded before they are stored
+    ingest = Ingest(store, min_edge=MIN_IMAGE_EDGE, max_edge=MAX_IMAGE_EDGE, image_format=IMAGE_FORMAT)
+    return Downloader(workers=DOWNLOAD_WORKERS, per_host=DOWNLOADS_PER_HOST,
+                      max_qps=DOWNLOAD_QPS, max_bytes_per_second=DOWNLOAD_BYTES_PER_SECOND,
+                      max_bytes=MAX_IMAGE_BYTES, sniff=sniff_image_type,
+                      store=ingest, store_workers=INGEST_WORKERS, on_finished=state.record_download)
 
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(image_url, stream=True, timeout=timeout)
-            response.raise_for_status()
-            with open(save_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            return True
-        except requests.exceptions.RequestException as e:
-            print(f"Attempt {attempt + 1}/{max_retries} failed: {e}")
-            time.sleep(2 ** attempt)  # Exponential backoff
-        except Exception as e:
-            print(f"Error saving image: {e}")
-            return False
-    print(f"Failed to download after {max_retries} attempts: {image_url}")
-    return False
 def search_gsmarena_for_price(brand, model):
     """Searches GSM Arena for a phone's price."""
     query = f"{brand} {model} gsmarena"
@@ -174,65 +185,123 @@ def search_product_price(brand, model):
         return "Error retrieving price data."
 
 
-def search_and_download_images(brand, model, max_images=MAX_IMAGES_PER_MODEL, min_images=MIN_IMAGES_PER_MODEL):
-    """Searches (using SerpAPI) and downloads images, enforcing limits."""
-    product_dir = create_data_dir(DATA_DIR, brand, model)
-    downloaded_count = 0
-    query = f"{brand} {model}"
+# Shared by every model's searches, in place of a fixed sleep between one model's pages
+search_limiter = RateLimiter(SEARCH_QPS)
+# The one SerpAPI "error" that means the results have run out; any other (an exhausted
+# quota, a bad key) is transient and must not end the model's search
+SERPAPI_NO_RESULTS = "hasn't returned any results"
 
-    params = {
-        "q": query,
-        "engine": "google_images",
-        "ijn": "0",  # Page number
-        "api_key": SERPAPI_KEY,
-        "tbs": "isz:m" #add Medium size
-    }
-    search = GoogleSearch(params) #initiate SerpAPI
-
-    while downloaded_count < max_images:
-        try:
-            results = search.get_dict() #get the result
-
-            if "images_results" not in results:
-                print(f"No more image results found for {query}.")
-                break
-
-            for result in results["images_results"]:
-                if downloaded_count >= max_images:
-                    break
-
-                image_url = result["original"]
-                image_filename = f"{brand}_{model}_{uuid.uuid4().hex}.jpg".replace(" ", "_").replace("/", "_").lower()
-                save_path = os.path.join(product_dir, image_filename)
-
-                if download_image(image_url, save_path):
-                    downloaded_count += 1
-
-            # SerpAPI Pagination (if needed):  Move to the next page
-            if "next" in results["serpapi_pagination"]:
-                #Instead of increment page number, we get it from the next URL
-                search.params_dict.update(dict(parse_qsl(urlparse(results["serpapi_pagination"]["next"]).query)))
-            else:
-                print(f"No more pagination for {query}.")
-                break
-            time.sleep(random.uniform(1, 3)) #delay
-
-        except Exception as e:
-            print(f"Error during SerpAPI search or download: {e}")
-            break  #  Exit loop on error
-
-    if downloaded_count < min_images:
-        print(f"WARNING: Only {downloaded_count} images for {brand} {model} (min: {min_images}).")
+def search_image_page(state, crawl):
+    """Fetches the next page of SerpAPI image results for a model; returns the valid image URLs no earlier page had.
+
+    Each page (and its cursor) is recorded in the CrawlState, so a later run resumes after it.
+    """
+    if crawl.cursor is None:
+        crawl.cursor = {
+            "q": crawl.name,
+            "engine": "google_images",
+            "ijn": "0",  # Page number
+            "tbs": "isz:m" #add Medium size
+        }
+    search_limiter.acquire()
+    # The cursor is saved in the crawl state, so the API key is only added here
+    results = GoogleSearch(dict(crawl.cursor, api_key=SERPAPI_KEY)).get_dict() #initiate SerpAPI, get the result
+
+    error = results.get("error")
+    if error and SERPAPI_NO_RESULTS not in error:
+        # Not recorded as a page: the next run resumes from the saved cursor
+        raise RuntimeError(f"SerpAPI error: {error}")
+    if "images_results" not in results:
+        print(f"No more image results found for {crawl.name}.")
+        crawl.more_pages = False
+        state.record_page(crawl, crawl.name, [], None)
+        return []
+
+    image_urls = []
+    for result in results["images_results"]:
+        if is_valid_image_url(result.get("original", "")):
+            image_urls.append(result["original"])
+        else:
+            print(f"Skipping invalid image URL: {result.get('original')}")
+
+    # SerpAPI Pagination (if needed):  Move to the next page
+    next_cursor = None
+    if "next" in results.get("serpapi_pagination", {}):
+        #Instead of increment page number, we get it from the next URL
+        next_cursor = dict(crawl.cursor, **dict(parse_qsl(urlparse(results["serpapi_pagination"]["next"]).query)))
+        next_cursor.pop("api_key", None)
     else:
-        print(f"Downloaded {downloaded_count} images for {brand} {model}")
+        print(f"No more pagination for {crawl.name}.")
+        crawl.more_pages = False
+    new_urls = state.record_page(crawl, crawl.name, image_urls, next_cursor)
+    crawl.cursor = next_cursor
+    return new_urls
+
+def lookup_price(state, crawl):
+    """search_product_price for a model, saved in the crawl state unless the lookup failed."""
+    price_info = search_product_price(crawl.brand, crawl.model)
+    if not price_info.startswith("Error"):
+        state.record_price(crawl, price_info)
+    return price_info
 
-    price_info = search_product_price(brand, model)  # Get price info
-    print(f"Price Info for {brand} {model}: {price_info}\n")
+def image_save_path(crawl, image_url):
+    """Unique download name for one of a model's images; the store renames it to its SHA-256."""
+    image_filename = f"{crawl.brand}_{crawl.model}_{uuid.uuid4().hex}.jpg".replace(" ", "_").replace("/", "_").lower()
+    return os.path.join(crawl.product_dir, image_filename)
+
+def search_and_download_images(phones, store, state, downloader, max_images=MAX_IMAGES_PER_MODEL,
+                               min_images=MIN_IMAGES_PER_MODEL, search_workers=SEARCH_WORKERS,
+                               price_workers=PRICE_WORKERS):
+    """Searches (using SerpAPI), downloads images and gets prices for many models at once, enforcing limits.
+
+    The downloader is closed once the crawl ends. Returns False if the crawl was interrupted with Ctrl-C.
+    """
+    stored = store.counts()
+    crawls, up_to_date = [], 0
+    for phone in phones:
+        crawl = ModelCrawl(phone["brand"], phone["model"], create_data_dir(DATA_DIR, phone["brand"], phone["model"]),
+                           max_images, min_images)
+        crawl.downloaded = stored.get(crawl.label, 0)
+        state.resume(crawl)
+        if crawl.downloaded >= max_images and crawl.price is not None:
+            up_to_date += 1  # Nothing missing and nothing stale
+            continue
+        crawls.append(crawl)
+    print(f"{up_to_date} models up to date, {len(crawls)} to crawl "
+          f"({sum(len(crawl.urls) for crawl in crawls)} image URLs left from earlier runs)")
+    scheduler = CrawlScheduler(downloader, functools.partial(search_image_page, state), image_save_path,
+                               functools.partial(lookup_price, state),
+                               search_workers=search_workers, price_workers=price_workers)
+    return scheduler.run(crawls)
 
 def main():
-    """Iterates, collects data, and gets prices."""
-    for phone in PHONE_MODELS:
-        search_and_download_images(phone["brand"], phone["model"])
+    """Collects images and prices for every catalog model, several models at a time."""
+    parser = argparse.ArgumentParser(description="Crawl training images and prices for PHONE_MODELS.")
+    parser.add_argument("--search-workers", type=int, default=SEARCH_WORKERS, help="Models searched at once")
+    parser.add_argument("--price-workers", type=int, default=PRICE_WORKERS, help="Price lookups at once")
+    parser.add_argument("--only", help="Crawl only models whose 'brand model' contains this text")
+    parser.add_argument("--prune-duplicates", action="store_true",
+                        help="Delete duplicates found among the images already downloaded")
+    args = parser.parse_args()
+
+    # Images are stored by content (<label>/<sha256>.jpg); duplicates of stored images are dropped
+    store = ImageStore(DATA_DIR)
+    store.sync(prune=args.prune_duplicates)
+    # Pages, URLs and prices of earlier runs, so a re-run only fetches what is missing or stale
+    state = CrawlState(os.path.join(DATA_DIR, STATE_FILE))
+
+    phones = [phone for phone in PHONE_MODELS
+              if not args.only or args.only.lower() in f"{phone['brand']} {phone['model']}".lower()]
+    downloader = make_downloader(store, state)
+    completed = search_and_download_images(phones, store, state, downloader, search_workers=args.search_workers,
+                                           price_workers=args.price_workers)
+    print(rejection_report(downloader.stats()["rejections"]))
+    print(store.report())
+    print(state.report())
+    store.close()
+    state.close()
+    if not completed:
+        raise SystemExit(130)  # Interrupted (Ctrl-C)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,368 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from prodscan_common.resilience import is_upstream_failure
+
+# --- Image Downloads ---
+# data.py fetches training images through one Downloader instead of a requests.get per
+# image. Downloads run on a thread pool that shares one keep-alive connection pool, with
+# three limits on top:
+#   - per host: at most per_host downloads from one site at a time; the rest wait in
+#     that host's queue without holding a worker
+#   - requests per second and bytes per second across all downloads (token buckets)
+#   - retries: a failed download is put back after a backoff by a scheduler thread, so
+#     the worker moves on to other downloads instead of sleeping
+# While the body streams in, a download is rejected as soon as it passes max_bytes (or
+# its Content-Length says it will) or its first bytes fail sniff(). A finished download
+# is handed to store(partial_path, path) on a separate pool of store_workers threads, so
+# CPU-heavy checks there never hold a download worker; the store keeps the file or
+# rejects it by raising Rejected. Without a store the file is renamed to path. Once a
+# download is settled, on_finished(download) sees its outcome, HTTP status and saved path.
+# cancel() (Ctrl-C in data.py) drops the queued downloads and aborts the running ones
+# between chunks, so an interrupted crawl leaves no half-written images behind.
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 16  # Bytes from the start of the body passed to sniff()
+POOLED_HOSTS = 64  # Hosts whose connections the session keeps open
+MAX_RETRY_AFTER = 60.0  # Longest Retry-After (seconds) honoured on a 429/503
+USER_AGENT = "Mozilla/5.0"
+
+
+class RateLimiter:
+    """At most rate units per second on average, allowing bursts of burst seconds' worth.
+
+    acquire(n) sleeps the calling thread until its n units fit; callers are served in
+    order, so one large acquire delays the ones after it instead of starving.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = float(rate)
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next_free = time.monotonic()
+
+    def acquire(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            # An idle limiter catches up to now, not past it: the burst is credited once, below
+            self._next_free = max(self._next_free, now) + amount / self.rate
+            wait = self._next_free - now - self.burst
+        if wait > 0:
+            time.sleep(wait)
+
+
+def pooled_session(workers):
+    """A requests Session that keeps up to workers connections open per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOLED_HOSTS, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def retry_delay(error, attempt, base):
+    """Seconds before retry number attempt: the server's Retry-After, else jittered backoff."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+    if retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_AFTER)
+    return base * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+class Rejected(Exception):
+    """A downloaded image the store would not keep; reason is one short word for the
+    rejection counts."""
+
+    def __init__(self, reason, detail=""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+class DownloadCancelled(Exception):
+    """The Downloader was cancelled while this download was running."""
+
+
+class _Download:
+    __slots__ = ("url", "path", "host", "attempt", "future", "outcome", "http_status", "error", "saved_path")
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.host = urlparse(url).netloc.lower()
+        self.attempt = 0
+        self.future = Future()
+        self.outcome = None  # succeeded, failed, rejected or cancelled
+        self.http_status = None
+        self.error = None  # The last attempt's exception
+        self.saved_path = None  # Where the store kept the file (it may rename it)
+
+
+class Downloader:
+    """Concurrent url -> file downloads; submit() returns a Future of True (saved) or False."""
+
+    def __init__(self, workers=16, per_host=4, max_qps=None, max_bytes_per_second=None,
+                 max_retries=3, retry_base=1.0, timeout=10, session=None, max_bytes=None, sniff=None,
+                 store=None, store_workers=None, on_finished=None):
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.sniff = sniff
+        self.store = store
+        self.on_finished = on_finished
+        self.session = session or pooled_session(workers)
+        self.request_limiter = RateLimiter(max_qps) if max_qps else None
+        self.bandwidth_limiter = RateLimiter(max_bytes_per_second) if max_bytes_per_second else None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._store_executor = None
+        if store is not None:
+            self._store_executor = ThreadPoolExecutor(max_workers=store_workers or os.cpu_count() or 1,
+                                                      thread_name_prefix="download-store")
+        self._lock = threading.Lock()
+        self._retry_ready = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._hosts = {}  # host -> [downloads running, deque of downloads waiting for a slot]
+        self._retries = []  # Heap of (due, sequence, download)
+        self._sequence = itertools.count()
+        self._retry_thread = None
+        self._outstanding = 0
+        self._started = None
+        self._closed = False
+        self._cancelled = False
+        self._counters = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "rejected": 0,
+                          "retried": 0, "bytes": 0}
+        self._rejections = {}  # Rejected.reason -> count
+
+    def submit(self, url, path):
+        download = _Download(url, path)
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            self._counters["submitted"] += 1
+            self._outstanding += 1
+        self._dispatch(download)
+        return download.future
+
+    def _dispatch(self, download):
+        """Runs download now if its host has a free slot, else queues it behind that host."""
+        with self._lock:
+            cancelled = self._cancelled
+            if not cancelled:
+                host = self._hosts.setdefault(download.host, [0, deque()])
+                if host[0] >= self.per_host:
+                    host[1].append(download)
+                    return
+                host[0] += 1
+        if cancelled:
+            self._resolve(download, "cancelled")
+            return
+        self._executor.submit(self._run, download)
+
+    def _release(self, host_name):
+        """Hands a finished download's host slot to the next download waiting for it."""
+        with self._lock:
+            host = self._hosts[host_name]
+            if not host[1]:
+                host[0] -= 1
+                if host[0] == 0:
+                    del self._hosts[host_name]
+                return
+            download = host[1].popleft()
+        self._executor.submit(self._run, download)
+
+    def _run(self, download):
+        try:
+            if self._cancelled:
+                raise DownloadCancelled()
+            partial_path = self._fetch(download)
+        except Exception as e:
+            self._release(download.host)
+            self._failed(download, e)
+            return
+        self._release(download.host)
+        if self.store is None:
+            self._keep(download, partial_path)
+        else:
+            self._store_executor.submit(self._keep, download, partial_path)
+
+    def _keep(self, download, partial_path):
+        """Stores (or renames) a fetched download and settles it."""
+        try:
+            if self._cancelled:
+                raise DownloadCancelled()
+            if self.store is not None:
+                download.saved_path = self.store(partial_path, download.path)
+            else:
+                os.replace(partial_path, download.path)
+                download.saved_path = download.path
+        except Exception as e:
+            error = e
+        else:
+            error = None
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        if error is None:
+            self._resolve(download, "succeeded")
+        else:
+            self._failed(download, error)
+
+    def _fetch(self, download):
+        if self.request_limiter is not None:
+            self.request_limiter.acquire()
+        partial_path = download.path + ".part"  # Never leave a truncated image under the real name
+        download.http_status = None
+        try:
+            with self.session.get(download.url, stream=True, timeout=self.timeout) as response:
+                download.http_status = response.status_code
+                response.raise_for_status()
+                length = response.headers.get("Content-Length", "")
+                if self.max_bytes and length.isdigit() and int(length) > self.max_bytes:
+                    raise Rejected("oversize", f"Content-Length {length}")
+                head = b"" if self.sniff is not None else None  # None once sniffed
+                received = 0
+                with open(partial_path, "wb") as file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if self._cancelled:
+                            raise DownloadCancelled()
+                        received += len(chunk)
+                        if self.max_bytes and received > self.max_bytes:
+                            raise Rejected("oversize", f"over {self.max_bytes} bytes")
+                        if head is not None:
+                            head += chunk[:SNIFF_BYTES]
+                            if len(head) >= SNIFF_BYTES:
+                                self._check_head(head, response)
+                                head = None
+                        file.write(chunk)
+                        with self._lock:
+                            self._counters["bytes"] += len(chunk)
+                        if self.bandwidth_limiter is not None:
+                            self.bandwidth_limiter.acquire(len(chunk))
+                if head is not None:
+                    self._check_head(head, response)  # A body shorter than SNIFF_BYTES
+            return partial_path
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    def _check_head(self, head, response):
+        if self.sniff(head) is None:
+            raise Rejected("not_image", f"Content-Type {response.headers.get('Content-Type', 'missing')}")
+
+    def _failed(self, download, error):
+        download.error = error
+        if isinstance(error, DownloadCancelled):
+            self._resolve(download, "cancelled")
+            return
+        if isinstance(error, Rejected):
+            with self._lock:
+                self._rejections[error.reason] = self._rejections.get(error.reason, 0) + 1
+            self._resolve(download, "rejected")
+            return
+        download.attempt += 1
+        retryable = isinstance(error, requests.exceptions.RequestException) and is_upstream_failure(error)
+        if retryable and download.attempt < self.max_retries and not (self._closed or self._cancelled):
+            delay = retry_delay(error, download.attempt, self.retry_base)
+            print(f"Attempt {download.attempt}/{self.max_retries} failed, retrying in {delay:.1f}s: {error}")
+            self._schedule_retry(download, delay)
+            return
+        if retryable:
+            print(f"Failed to download after {download.attempt} attempts: {download.url}")
+        else:
+            print(f"Error downloading {download.url}: {error}")
+        self._resolve(download, "failed")
+
+    def _schedule_retry(self, download, delay):
+        with self._lock:
+            heapq.heappush(self._retries, (time.monotonic() + delay, next(self._sequence), download))
+            self._counters["retried"] += 1
+            if self._retry_thread is None:
+                self._retry_thread = threading.Thread(target=self._retry_loop, name="download-retries", daemon=True)
+                self._retry_thread.start()
+            self._retry_ready.notify()
+
+    def _retry_loop(self):
+        while True:
+            with self._lock:
+                while not self._retries or self._retries[0][0] > time.monotonic():
+                    if self._closed and not self._retries:
+                        return
+                    self._retry_ready.wait(self._retries[0][0] - time.monotonic() if self._retries else None)
+                download = heapq.heappop(self._retries)[2]
+            self._dispatch(download)
+
+    def _resolve(self, download, outcome):
+        """Settles download as succeeded, failed, rejected or cancelled; its Future gets True or False."""
+        with self._lock:
+            self._counters[outcome] += 1
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._idle.notify_all()
+        download.outcome = outcome
+        if self.on_finished is not None:
+            try:
+                self.on_finished(download)
+            except Exception as e:
+                print(f"Error recording download of {download.url}: {e}")
+        download.future.set_result(outcome == "succeeded")
+
+    def cancel(self):
+        """Drops every download not yet started and aborts the running ones at their next chunk."""
+        with self._lock:
+            self._cancelled = True
+            dropped = [download for host in self._hosts.values() for download in host[1]]
+            dropped.extend(entry[2] for entry in self._retries)
+            for host in self._hosts.values():
+                host[1].clear()
+            self._retries.clear()
+            self._retry_ready.notify()
+        for download in dropped:
+            self._resolve(download, "cancelled")
+
+    def wait(self):
+        """Blocks until every submitted download has been saved or has failed."""
+        with self._lock:
+            while self._outstanding:
+                self._idle.wait()
+
+    def close(self):
+        """Waits for the submitted downloads, then stops the workers."""
+        self.wait()
+        with self._lock:
+            self._closed = True
+            self._retry_ready.notify()
+        self._executor.shutdown()
+        if self._store_executor is not None:
+            self._store_executor.shutdown()
+        self.session.close()
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+            stats = dict(self._counters,
+                         waiting_for_host=sum(len(host[1]) for host in self._hosts.values()),
+                         rejections=dict(self._rejections),
+                         waiting_for_retry=len(self._retries),
+                         elapsed=round(elapsed, 3))
+        stats["images_per_second"] = round(stats["succeeded"] / elapsed, 2) if elapsed else 0.0
+        stats["bytes_per_second"] = round(stats["bytes"] / elapsed) if elapsed else 0
+        return stats
+
+    def report(self):
+        """One line of throughput for the log."""
+        stats = self.stats()
+        return (f"Downloaded {stats['succeeded']} images ({stats['bytes'] / 1e6:.1f} MB) in {stats['elapsed']:.1f}s: "
+                f"{stats['images_per_second']:.1f} images/s, {stats['bytes_per_second'] / 1e6:.2f} MB/s; "
+                f"{stats['failed']} failed, {stats['rejected']} rejected, {stats['retried']} retried"
+                + (f", {stats['cancelled']} cancelled" if stats["cancelled"] else ""))
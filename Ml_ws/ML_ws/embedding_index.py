@@ -0,0 +1,352 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# --- Embedding Index ---
+# Nearest-neighbour search over L2-normalized image embeddings, so a product can be
+# recognised from a few reference photos without retraining the classifier head.
+#   FlatIndex:  exact cosine search, one float32 matrix product per query batch
+#   IVFPQIndex: for large catalogs; vectors are assigned to one of nlist coarse clusters
+#               and their residuals stored as m one-byte product-quantization codes,
+#               so a 1280-d embedding takes m bytes instead of 5 KiB
+# Both accept incremental adds, save to a directory and load back memory-mapped.
+INDEX_FORMAT_VERSION = 1
+INDEX_FILE = "index.json"
+KMEANS_CHUNK = 16384  # Rows per distance block, so k-means never holds an N x k matrix
+
+
+def normalize(vectors):
+    """float32 copy of vectors with every row scaled to unit length (zero rows stay zero)."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def nearest_centroid(data, centroids):
+    """Index of the closest centroid (squared L2) for every row of data."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    nearest = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), KMEANS_CHUNK):
+        block = data[start:start + KMEANS_CHUNK]
+        nearest[start:start + len(block)] = np.argmin(centroid_norms - 2.0 * block @ centroids.T, axis=1)
+    return nearest
+
+
+def kmeans(data, k, iterations=20, seed=0):
+    """Lloyd's k-means; returns (min(k, len(data)), dim) float32 centroids."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(data, centroids)
+        order = np.argsort(assignment, kind="stable")
+        present, starts, counts = np.unique(assignment[order], return_index=True, return_counts=True)
+        centroids[present] = np.add.reduceat(data[order], starts, axis=0) / counts[:, None]
+        empty = np.setdiff1d(np.arange(k), present)
+        if len(empty):  # Re-seed clusters that lost every point
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class _Rows:
+    """Append-only array: a (possibly memory-mapped) base plus an in-memory tail whose
+    capacity doubles as rows are added, so incremental adds never copy the base."""
+
+    def __init__(self, base):
+        self.base = base
+        self._tail = np.empty((0,) + base.shape[1:], dtype=base.dtype)
+        self._tail_count = 0
+
+    def __len__(self):
+        return len(self.base) + self._tail_count
+
+    def append(self, rows):
+        needed = self._tail_count + len(rows)
+        if needed > len(self._tail):
+            grown = np.empty((max(needed, 2 * len(self._tail), 64),) + self.base.shape[1:], dtype=self.base.dtype)
+            grown[:self._tail_count] = self._tail[:self._tail_count]
+            self._tail = grown
+        self._tail[self._tail_count:needed] = rows
+        self._tail_count = needed
+
+    def parts(self):
+        """(base, tail) views of the rows added so far."""
+        return self.base, self._tail[:self._tail_count]
+
+    def take(self, ids):
+        base, tail = self.parts()
+        if not len(tail):
+            return base[ids]
+        rows = np.empty((len(ids),) + base.shape[1:], dtype=base.dtype)
+        in_base = ids < len(base)
+        rows[in_base] = base[ids[in_base]]
+        rows[~in_base] = tail[ids[~in_base] - len(base)]
+        return rows
+
+    def array(self):
+        base, tail = self.parts()
+        return np.concatenate([base, tail]) if len(tail) else np.asarray(base)
+
+
+def _top_k(scores, ids, k):
+    """The k best (score, id) pairs of one query, best first."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[best], ids[best]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], ids[order]
+
+
+def _save_array(directory, name, array):
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.asarray(array))
+    os.replace(path + ".tmp", path)
+
+
+def _load_array(directory, name, count, mmap):
+    array = np.load(os.path.join(directory, name), mmap_mode="r" if mmap else None)
+    return array[:count]  # Arrays are written before index.json, so they may hold extra rows
+
+
+class _LabelledIndex:
+    """Label bookkeeping, locking and persistence shared by both index kinds."""
+    kind = None
+    _arrays = ()  # Per-row arrays saved as <name>.npy
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.label_names = []
+        self._label_numbers = {}
+        self._label_ids = _Rows(np.empty(0, dtype=np.int32))
+        self.metadata = {}  # Saved with the index, e.g. the model bundle version
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._label_ids)
+
+    def _label_numbers_for(self, labels):
+        numbers = []
+        for label in labels:
+            if label not in self._label_numbers:
+                self._label_numbers[label] = len(self.label_names)
+                self.label_names.append(label)
+            numbers.append(self._label_numbers[label])
+        return np.asarray(numbers, dtype=np.int32)
+
+    def labels_of(self, ids):
+        """Label of every row id (None for the -1 padding of a short result)."""
+        ids = np.asarray(ids)
+        numbers = self._label_ids.take(np.maximum(ids, 0))
+        return [self.label_names[number] if row_id >= 0 else None for row_id, number in zip(ids, numbers)]
+
+    def match(self, queries, k=5):
+        """Per query, the best score of each label among the k nearest rows: [[(label, score)]]."""
+        scores, ids = self.search(queries, k)
+        matches = []
+        for row_scores, row_ids in zip(scores, ids):
+            best = {}
+            for label, score in zip(self.labels_of(row_ids), row_scores):
+                if label is not None and label not in best:
+                    best[label] = float(score)
+            matches.append(list(best.items()))
+        return matches
+
+    def stats(self):
+        return {"kind": self.kind, "dim": self.dim, "size": len(self), "labels": len(self.label_names)}
+
+    def _manifest(self):
+        return {"format_version": INDEX_FORMAT_VERSION, "kind": self.kind, "dim": self.dim,
+                "count": len(self), "label_names": list(self.label_names), "metadata": self.metadata}
+
+    def _restore(self, manifest):
+        self.label_names = list(manifest["label_names"])
+        self._label_numbers = {label: number for number, label in enumerate(self.label_names)}
+        self.metadata = manifest.get("metadata", {})
+
+    def save(self, directory):
+        """Writes the index to directory; a server that has it memory-mapped keeps its old copy."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            arrays = {name: getattr(self, name).array() if isinstance(getattr(self, name), _Rows)
+                      else getattr(self, name) for name in self._arrays}
+            manifest = self._manifest()
+        for name, array in arrays.items():
+            _save_array(directory, name.lstrip("_") + ".npy", array)
+        tmp_path = os.path.join(directory, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(directory, INDEX_FILE))  # The commit point
+
+
+class FlatIndex(_LabelledIndex):
+    """Exact cosine search: all embeddings in one normalized float32 matrix."""
+    kind = "flat"
+    _arrays = ("_vectors", "_label_ids")
+
+    def __init__(self, dim):
+        super().__init__(dim)
+        self._vectors = _Rows(np.empty((0, dim), dtype=np.float32))
+
+    def add(self, vectors, labels):
+        """Adds one row per embedding; labels may repeat (several photos of one product)."""
+        vectors = normalize(vectors)
+        if len(vectors) != len(labels):
+            raise ValueError(f"{len(vectors)} vectors but {len(labels)} labels")
+        with self._lock:
+            self._vectors.append(vectors)
+            self._label_ids.append(self._label_numbers_for(labels))
+
+    def search(self, queries, k=5):
+        """(scores, ids), each (len(queries), min(k, len(self))), highest cosine first."""
+        queries = normalize(queries)
+        with self._lock:
+            base, tail = self._vectors.parts()
+        # (rows @ queries.T) streams the matrix once; for a few queries the scan is memory-bound
+        scores = np.hstack([(part @ queries.T).T for part in (base, tail)])
+        k = min(k, scores.shape[1])
+        top_scores = np.empty((len(queries), k), dtype=np.float32)
+        top_ids = np.empty((len(queries), k), dtype=np.int64)
+        for row, row_scores in enumerate(scores):
+            top_scores[row], top_ids[row] = _top_k(row_scores, np.arange(len(row_scores)), k)
+        return top_scores, top_ids
+
+    def vectors(self):
+        with self._lock:
+            return self._vectors.array()
+
+    @classmethod
+    def load(cls, directory, manifest, mmap=True):
+        index = cls(manifest["dim"])
+        index._restore(manifest)
+        index._vectors = _Rows(_load_array(directory, "vectors.npy", manifest["count"], mmap))
+        index._label_ids = _Rows(_load_array(directory, "label_ids.npy", manifest["count"], mmap))
+        return index
+
+
+class IVFPQIndex(_LabelledIndex):
+    """Approximate search: coarse clusters (IVF) plus product-quantized residuals (PQ).
+
+    A query scores only the rows of its nprobe closest clusters, as q.centroid plus the
+    sum of m table lookups (q's sub-vector against each code's codeword), so the full
+    vectors are never stored. train() must see a representative sample before add().
+    """
+    kind = "ivfpq"
+    _arrays = ("centroids", "codebooks", "_codes", "_list_ids", "_label_ids")
+
+    def __init__(self, dim, nlist=64, m=16, nprobe=8):
+        super().__init__(dim)
+        if dim % m:
+            raise ValueError(f"Embedding size {dim} is not divisible into {m} sub-vectors")
+        self.nlist, self.m, self.nprobe = nlist, m, nprobe
+        self.centroids = None  # (nlist, dim)
+        self.codebooks = None  # (m, ksub, dim // m)
+        self._codes = _Rows(np.empty((0, m), dtype=np.uint8))
+        self._list_ids = _Rows(np.empty(0, dtype=np.int32))
+        self._inverted = None  # (row ids sorted by list, list start offsets), rebuilt after adds
+        self._inverted_size = -1
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations=20, seed=0):
+        """Learns the coarse centroids and the residual codebooks from sample embeddings."""
+        vectors = normalize(vectors)
+        centroids = kmeans(vectors, self.nlist, iterations, seed)
+        residuals = vectors - centroids[nearest_centroid(vectors, centroids)]
+        subvectors = residuals.reshape(len(vectors), self.m, -1)
+        codebooks = [kmeans(subvectors[:, j], 256, iterations, seed + j) for j in range(self.m)]
+        ksub = min(len(codebook) for codebook in codebooks)
+        with self._lock:
+            self.centroids = centroids
+            self.nlist = len(centroids)
+            self.codebooks = np.stack([codebook[:ksub] for codebook in codebooks])
+
+    def _encode(self, vectors):
+        list_ids = nearest_centroid(vectors, self.centroids)
+        subvectors = (vectors - self.centroids[list_ids]).reshape(len(vectors), self.m, -1)
+        codes = np.stack([nearest_centroid(subvectors[:, j], self.codebooks[j]) for j in range(self.m)], axis=1)
+        return codes.astype(np.uint8), list_ids.astype(np.int32)
+
+    def add(self, vectors, labels):
+        if not self.trained:
+            raise RuntimeError("IVFPQIndex.add() before train()")
+        vectors = normalize(vectors)
+        if len(vectors) != len(labels):
+            raise ValueError(f"{len(vectors)} vectors but {len(labels)} labels")
+        codes, list_ids = self._encode(vectors)
+        with self._lock:
+            self._codes.append(codes)
+            self._list_ids.append(list_ids)
+            self._label_ids.append(self._label_numbers_for(labels))
+
+    def _inverted_lists(self):
+        """Row ids grouped by cluster; re-sorted only when rows were added since the last search."""
+        if self._inverted_size != len(self._list_ids):
+            list_ids = self._list_ids.array()
+            order = np.argsort(list_ids, kind="stable")
+            starts = np.searchsorted(list_ids[order], np.arange(self.nlist + 1))
+            self._inverted, self._inverted_size = (order, starts), len(list_ids)
+        return self._inverted
+
+    def search(self, queries, k=5, nprobe=None):
+        """(scores, ids) like FlatIndex.search; approximate cosine, ids -1 where a query has fewer hits."""
+        queries = normalize(queries)
+        k = min(k, len(self))
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        top_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if not k:
+            return top_scores, top_ids
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        with self._lock:
+            order, starts = self._inverted_lists()
+            coarse = queries @ self.centroids.T
+            # Closest clusters by L2: ||q - c||^2 = 1 - 2 q.c + ||c||^2
+            closeness = 2.0 * coarse - np.einsum("ij,ij->i", self.centroids, self.centroids)
+            for row, query in enumerate(queries):
+                lists = np.argpartition(-closeness[row], nprobe - 1)[:nprobe]
+                candidates = np.concatenate([order[starts[l]:starts[l + 1]] for l in lists])
+                if not len(candidates):
+                    continue
+                tables = np.einsum("jd,jkd->jk", query.reshape(self.m, -1), self.codebooks)
+                codes = self._codes.take(candidates).astype(np.intp)
+                scores = coarse[row, self._list_ids.take(candidates)] + tables[np.arange(self.m), codes].sum(axis=1)
+                found_scores, found_ids = _top_k(scores.astype(np.float32), candidates, k)
+                top_scores[row, :len(found_ids)], top_ids[row, :len(found_ids)] = found_scores, found_ids
+        return top_scores, top_ids
+
+    def stats(self):
+        return dict(super().stats(), nlist=self.nlist, m=self.m, nprobe=self.nprobe,
+                    bytes_per_vector=self.m)
+
+    def _manifest(self):
+        return dict(super()._manifest(), nlist=self.nlist, m=self.m, nprobe=self.nprobe)
+
+    @classmethod
+    def load(cls, directory, manifest, mmap=True):
+        index = cls(manifest["dim"], manifest["nlist"], manifest["m"], manifest["nprobe"])
+        index._restore(manifest)
+        count = manifest["count"]
+        index.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        index.codebooks = np.load(os.path.join(directory, "codebooks.npy"))
+        index._codes = _Rows(_load_array(directory, "codes.npy", count, mmap))
+        index._list_ids = _Rows(_load_array(directory, "list_ids.npy", count, mmap))
+        index._label_ids = _Rows(_load_array(directory, "label_ids.npy", count, mmap))
+        return index
+
+
+INDEX_KINDS = {"flat": FlatIndex, "ivfpq": IVFPQIndex}
+
+
+def load_index(directory, mmap=True):
+    """Loads a saved index; per-row arrays are memory-mapped unless mmap is False."""
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format: {manifest.get('format_version')}")
+    if manifest["kind"] not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{manifest['kind']}'")
+    return INDEX_KINDS[manifest["kind"]].load(directory, manifest, mmap)
@@ -0,0 +1,302 @@
+import asyncio
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from prodscan_common.singleflight import SingleFlight
+
+# --- Cache Tiers ---
+# Every tier stores (value, stored_at) pairs under a string key. TieredCache decides
+# freshness from stored_at, so tiers only need get/set.
+
+
+class MemoryTier:
+    """In-process LRU tier."""
+    name = "memory"
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at, expire_after):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteTier:
+    """Persistent tier shared by every worker process on one machine."""
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # A forked worker opens its own connections; SQLite ones must not cross a fork
+        os.register_at_fork(after_in_child=self._forget_connections)
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS enrichment_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                stored_at REAL,
+                expires_at REAL
+            )
+        ''')
+        conn.commit()
+
+    def _forget_connections(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        """One connection per thread; WAL lets readers run alongside a writer."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, stored_at FROM enrichment_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key, value, stored_at, expire_after):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO enrichment_cache VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value), stored_at, stored_at + expire_after))
+        conn.commit()
+
+
+class RedisTier:
+    """Network tier for multi-node deployments (needs the redis package)."""
+    name = "network"
+
+    def __init__(self, url, prefix="prodscan:enrichment:"):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["value"], entry["stored_at"]
+
+    def set(self, key, value, stored_at, expire_after):
+        self.client.set(self.prefix + key, json.dumps({"value": value, "stored_at": stored_at}),
+                        ex=max(1, int(expire_after)))
+
+
+class LocalNetworkTier:
+    """Dict-backed stand-in for RedisTier, for tests and single-node runs."""
+    name = "network"
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[2] <= time.time():
+            return None
+        return entry[0], entry[1]
+
+    def set(self, key, value, stored_at, expire_after):
+        with self._lock:
+            self._entries[key] = (value, stored_at, stored_at + expire_after)
+
+
+# --- Tiered Cache ---
+
+def normalize_key(text):
+    """Case- and whitespace-insensitive cache key for a product name."""
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+class TieredCache:
+    """Read-through cache over an ordered list of tiers (fastest first).
+
+    ttls[field] is how long an answer is fresh. For stale_ttls[field] seconds after
+    that it is still served, but a background refresh is started. Older entries
+    count as misses and are fetched synchronously. Hits in a slower tier are copied
+    into the faster tiers. Concurrent misses for the same key share one fetch.
+    """
+
+    def __init__(self, tiers, ttls, stale_ttls=None, refresh_workers=4):
+        self.tiers = list(tiers)
+        self.ttls = dict(ttls)
+        self.stale_ttls = dict(stale_ttls or {})
+        self._refresh_pool = ThreadPoolExecutor(max_workers=refresh_workers,
+                                                thread_name_prefix="enrichment-refresh")
+        self._refreshing = set()
+        self._refresh_tasks = set()  # Keeps asyncio refreshes referenced until they finish
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.flights = SingleFlight()  # Misses in flight, per field; stats() has the waiter counts
+
+    def _count(self, field, counter):
+        with self._lock:
+            field_counters = self._counters.setdefault(field, {})
+            field_counters[counter] = field_counters.get(counter, 0) + 1
+
+    def _lookup(self, key):
+        """Returns (value, stored_at, index of the tier that had it) or None."""
+        for index, tier in enumerate(self.tiers):
+            try:
+                entry = tier.get(key)
+            except Exception as e:
+                print(f"Error reading {tier.name} cache tier: {e}")
+                continue
+            if entry is not None:
+                return entry[0], entry[1], index
+        return None
+
+    def _store(self, key, value, stored_at, expire_after, tiers):
+        for tier in tiers:
+            try:
+                tier.set(key, value, stored_at, expire_after)
+            except Exception as e:
+                print(f"Error writing {tier.name} cache tier: {e}")
+
+    def _store_answer(self, field, key, value, should_cache):
+        if should_cache is None or should_cache(value):
+            expire_after = self.ttls[field] + self.stale_ttls.get(field, 0)
+            self._store(key, value, time.time(), expire_after, self.tiers)
+
+    def _fetch_and_store(self, field, key, fetch, should_cache):
+        value = fetch()
+        self._store_answer(field, key, value, should_cache)
+        return value
+
+    def _claim_refresh(self, key):
+        """True if no other refresh of key is running (the caller then owns it)."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _refresh(self, field, key, fetch, should_cache):
+        """Re-fetches a stale entry off the request thread, once per key at a time."""
+        if not self._claim_refresh(key):
+            return
+
+        def run():
+            try:
+                self._fetch_and_store(field, key, fetch, should_cache)
+                self._count(field, "refreshes")
+            except Exception as e:
+                print(f"Error refreshing cached {field}: {e}")
+                self._count(field, "refresh_errors")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_pool.submit(run)
+
+    def _usable_entry(self, field, key):
+        """Returns (value, is_stale) for a cached answer that may still be served, else None."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        value, stored_at, tier_index = entry
+        age = time.time() - stored_at
+        ttl = self.ttls[field]
+        if age > ttl + self.stale_ttls.get(field, 0):
+            return None
+        if tier_index:  # Promote into the faster tiers
+            expire_after = ttl + self.stale_ttls.get(field, 0) - age
+            self._store(key, value, stored_at, expire_after, self.tiers[:tier_index])
+        self._count(field, f"{self.tiers[tier_index].name}_hits")
+        if age > ttl:
+            self._count(field, "stale_hits")
+        return value, age > ttl
+
+    def get_or_fetch(self, field, name, fetch, should_cache=None):
+        """Returns the cached answer for (field, name), calling fetch() on a miss."""
+        key = f"{field}:{normalize_key(name)}"
+        entry = self._usable_entry(field, key)
+        if entry is not None:
+            value, stale = entry
+            if stale:
+                self._refresh(field, key, fetch, should_cache)
+            return value
+
+        self._count(field, "misses")
+        return self.flights.do(field, key, lambda: self._fetch_and_store(field, key, fetch, should_cache))
+
+    async def aget_or_fetch(self, field, name, fetch, should_cache=None):
+        """get_or_fetch for a coroutine function fetch; tier I/O runs in the loop's executor."""
+        loop = asyncio.get_running_loop()
+        key = f"{field}:{normalize_key(name)}"
+        entry = await loop.run_in_executor(None, self._usable_entry, field, key)
+        if entry is not None:
+            value, stale = entry
+            if stale and self._claim_refresh(key):
+                task = loop.create_task(self._arefresh(field, key, fetch, should_cache))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return value
+
+        self._count(field, "misses")
+
+        async def fetch_and_store():
+            value = await fetch()
+            await loop.run_in_executor(None, self._store_answer, field, key, value, should_cache)
+            return value
+        return await self.flights.ado(field, key, fetch_and_store)
+
+    async def _arefresh(self, field, key, fetch, should_cache):
+        try:
+            value = await fetch()
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._store_answer, field, key, value, should_cache)
+            self._count(field, "refreshes")
+        except Exception as e:
+            print(f"Error refreshing cached {field}: {e}")
+            self._count(field, "refresh_errors")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def cached(self, field, should_cache=None):
+        """Decorator for single-argument lookups such as fetch_usage_with_gemini(product_name)."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(name):
+                return self.get_or_fetch(field, name, lambda: function(name), should_cache)
+            wrapper.uncached = function
+            return wrapper
+        return decorator
+
+    def stats(self):
+        """Per-field hit/miss counters and hit rates."""
+        with self._lock:
+            stats = {field: dict(counters) for field, counters in self._counters.items()}
+        for counters in stats.values():
+            hits = sum(count for name, count in counters.items()
+                       if name.endswith("_hits") and name != "stale_hits")
+            lookups = hits + counters.get("misses", 0)
+            counters["hit_rate"] = (hits / lookups) if lookups else 0.0
+        return stats
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from downloader import Rejected
+from prodscan_common.scan_cache import HASH_BITS, from_sqlite_int, hamming_distance, perceptual_hash, to_sqlite_int
+
+# --- Image Store ---
+# Crawled training images are stored under their content: <data_dir>/<label>/<sha256>.jpg.
+# A SQLite index next to them holds every stored image's SHA-256 and perceptual hash,
+# so a re-run of the crawler recognises the press shots it already has:
+#   - an exact copy (same SHA-256) anywhere in the store is dropped
+#   - a near-duplicate (pHash within max_distance bits: a resize, re-encode or crop
+#     margin) of an image of the same label is dropped, since it adds nothing to training
+#     and would leak between the train and validation splits
+#   - a near-duplicate of an image of another label is dropped too: the same photo under
+#     two models is a mislabelled search result for one of them
+# Near matches come from a band index, as in PerceptualCache: hashes within max_distance
+# bits agree exactly on at least one of max_distance + 1 bands, so each check is a few
+# indexed lookups however large the store grows.
+INDEX_FILE = "image_index.db"
+DUPLICATE_DISTANCE = 4  # pHash bits two images may differ by and still count as the same
+SPLIT_DIRS = ("train", "validation")  # Made by train.py from the label directories; not labels
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+REJECTIONS = ("duplicate", "near_duplicate", "cross_class_duplicate", "undecodable")
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    sha256 TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    path TEXT NOT NULL,
+    phash INTEGER NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phash_bands (
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phash_bands_lookup ON phash_bands (band, value);
+CREATE INDEX IF NOT EXISTS phash_bands_image ON phash_bands (sha256);
+'''
+
+
+class ImageStore:
+    """Content-addressed label directories with a persistent duplicate index; thread-safe."""
+
+    def __init__(self, data_dir, index_path=None, max_distance=DUPLICATE_DISTANCE):
+        self.data_dir = data_dir
+        self.index_path = index_path or os.path.join(data_dir, INDEX_FILE)
+        self.max_distance = max(0, min(int(max_distance), HASH_BITS - 1))
+        self._band_count = self.max_distance + 1
+        self._band_width = -(-HASH_BITS // self._band_count)  # Ceiling division
+        os.makedirs(data_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.executescript(INDEX_SCHEMA)
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("stored",) + REJECTIONS, 0)
+
+    def _bands(self, phash):
+        """(band number, band value) pairs as stored (one 64-bit band when max_distance is 0)."""
+        mask = (1 << self._band_width) - 1
+        return [(band, to_sqlite_int((phash >> (band * self._band_width)) & mask))
+                for band in range(self._band_count)]
+
+    def _find_duplicate(self, sha256, phash):
+        """(kind, label) of the stored image an image with these hashes duplicates, or None."""
+        row = self._conn.execute("SELECT label FROM images WHERE sha256 = ?", (sha256,)).fetchone()
+        if row:
+            return "duplicate", row[0]
+        candidates = set()
+        for band, value in self._bands(phash):
+            candidates.update(sha for (sha,) in self._conn.execute(
+                "SELECT sha256 FROM phash_bands WHERE band = ? AND value = ?", (band, value)))
+        best = None
+        for sha in candidates:
+            label, stored = self._conn.execute("SELECT label, phash FROM images WHERE sha256 = ?", (sha,)).fetchone()
+            distance = hamming_distance(phash, from_sqlite_int(stored))
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, label)
+        return ("near", best[1]) if best else None
+
+    def _check_new(self, sha256, phash, label):
+        """Raises Rejected if the store already has this image (call with the lock held)."""
+        found = self._find_duplicate(sha256, phash)
+        if found is None:
+            return
+        kind, other_label = found
+        if kind == "duplicate":
+            raise Rejected("duplicate", f"same file as an image of {other_label}")
+        if other_label == label:
+            raise Rejected("near_duplicate", f"looks like an image already stored for {label}")
+        raise Rejected("cross_class_duplicate", f"looks like an image stored for {other_label}")
+
+    def _insert(self, sha256, label, relative_path, phash):
+        with self._conn:
+            self._conn.execute("INSERT INTO images (sha256, label, path, phash, added_at) VALUES (?, ?, ?, ?, ?)",
+                               (sha256, label, relative_path, to_sqlite_int(phash), time.time()))
+            self._conn.executemany("INSERT INTO phash_bands (band, value, sha256) VALUES (?, ?, ?)",
+                                   [(band, value, sha256) for band, value in self._bands(phash)])
+
+    @staticmethod
+    def _hashes(path):
+        """(sha256, phash) of the image file at path; Rejected if it does not decode."""
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            phash = perceptual_hash(data)
+        except Exception as e:
+            raise Rejected("undecodable", str(e))
+        return hashlib.sha256(data).hexdigest(), phash
+
+    def add(self, partial_path, path):
+        """Stores the downloaded file at partial_path in path's label directory under its
+        SHA-256; returns the stored path, or raises Rejected for a duplicate."""
+        label_dir = os.path.dirname(path)
+        label = os.path.basename(label_dir)
+        try:
+            sha256, phash = self._hashes(partial_path)
+            stored_name = sha256 + os.path.splitext(path)[1]
+            with self._lock:  # Check and insert together, or two copies could both get in
+                self._check_new(sha256, phash, label)
+                os.replace(partial_path, os.path.join(label_dir, stored_name))
+                self._insert(sha256, label, os.path.join(label, stored_name), phash)
+                self._counters["stored"] += 1
+        except Rejected as e:
+            with self._lock:
+                self._counters[e.reason] += 1
+            raise
+        return os.path.join(label_dir, stored_name)
+
+    def sync(self, prune=False):
+        """Indexes images already in the label directories (say, from before the index
+        existed) and forgets indexed files that have been deleted. Duplicates among the
+        existing files are counted, and deleted with prune."""
+        indexed, missing, added, duplicates = set(), [], 0, 0
+        with self._lock:
+            for sha, path in self._conn.execute("SELECT sha256, path FROM images").fetchall():
+                if os.path.exists(os.path.join(self.data_dir, path)):
+                    indexed.add(path)
+                else:
+                    missing.append(sha)
+            with self._conn:
+                for sha in missing:
+                    self._conn.execute("DELETE FROM images WHERE sha256 = ?", (sha,))
+                    self._conn.execute("DELETE FROM phash_bands WHERE sha256 = ?", (sha,))
+            for label in sorted(os.listdir(self.data_dir)):
+                label_dir = os.path.join(self.data_dir, label)
+                if label in SPLIT_DIRS or not os.path.isdir(label_dir):
+                    continue
+                for name in sorted(os.listdir(label_dir)):
+                    relative_path = os.path.join(label, name)
+                    if relative_path in indexed or not name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    try:
+                        sha256, phash = self._hashes(os.path.join(label_dir, name))
+                        self._check_new(sha256, phash, label)
+                    except Rejected as e:
+                        duplicates += 1
+                        print(f"Existing image {relative_path}: {e}{' (deleted)' if prune else ''}")
+                        if prune:
+                            os.remove(os.path.join(label_dir, name))
+                        continue
+                    self._insert(sha256, label, relative_path, phash)
+                    added += 1
+        if missing or added or duplicates:
+            print(f"Image index: {added} existing images indexed, {len(missing)} deleted images forgotten, "
+                  f"{duplicates} existing duplicates {'deleted' if prune else 'kept (use --prune-duplicates)'}")
+
+    def counts(self):
+        """label -> number of images stored for it."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT label, COUNT(*) FROM images GROUP BY label"))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["images"] = self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return stats
+
+    def report(self):
+        """One line of dedup counts since the store was opened."""
+        stats = self.stats()
+        dropped = sum(stats[reason] for reason in REJECTIONS if reason != "undecodable")
+        return (f"Image store: {stats['stored']} new images stored, {dropped} duplicates dropped "
+                f"({stats['duplicate']} exact, {stats['near_duplicate']} near, "
+                f"{stats['cross_class_duplicate']} across classes), {stats['undecodable']} undecodable; "
+                f"{stats['images']} images indexed")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# --- Histogram Buckets ---
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_WAIT_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class QueueFull(Exception):
+    """Raised by submit when the queue has no room within its timeout."""
+
+
+class _Request:
+    """One image waiting for the next batch."""
+    __slots__ = ("array", "future", "enqueued_at")
+
+    def __init__(self, array):
+        self.array = array
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+def _bucket_index(buckets, value):
+    """Returns the index of the first bucket whose upper bound holds value."""
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)  # The +Inf bucket
+
+
+class BatchingPredictor:
+    """Collects concurrent predict calls into one batched forward pass.
+
+    A single worker thread takes the first waiting request, then keeps pulling
+    requests until either max_batch_size is reached or max_wait_ms has passed
+    since that first request, and runs predict_fn once on the stacked batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0, max_queue_size=256):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._batch_sizes = [0] * (self.max_batch_size + 1)
+        self._queue_depths = [0] * (len(QUEUE_DEPTH_BUCKETS) + 1)
+        self._queue_waits = [0] * (len(QUEUE_WAIT_MS_BUCKETS) + 1)
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._rejected = 0
+        self._thread = threading.Thread(target=self._run, name="batching-predictor", daemon=True)
+        self._thread.start()
+
+    def submit(self, array, timeout=0):
+        """Queues one preprocessed image (H, W, C) and returns a Future for its prediction row.
+
+        Waits up to timeout seconds (None: indefinitely) for room in a full queue, then
+        raises QueueFull; the default never blocks, so it is safe on an event loop.
+        """
+        request = _Request(array)
+        depth = self._queue.qsize()
+        with self._lock:
+            self._queue_depths[_bucket_index(QUEUE_DEPTH_BUCKETS, depth)] += 1
+        try:
+            self._queue.put(request, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull(f"Inference queue full ({self._queue.maxsize} waiting)") from None
+        return request.future
+
+    def predict(self, array, timeout=None):
+        """Blocking helper: submits one image and waits for its prediction row; the
+        timeout covers both waiting for room in the queue and the batch itself."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = self.submit(array, timeout=timeout)
+        return future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def _collect_batch(self):
+        """Blocks for the first request, then gathers more until the size or wait limit."""
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())  # Still drain what is already here
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Worker loop: one forward pass per collected batch."""
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                for request in batch:
+                    wait_ms = (started - request.enqueued_at) * 1000.0
+                    self._queue_waits[_bucket_index(QUEUE_WAIT_MS_BUCKETS, wait_ms)] += 1
+
+            try:
+                inputs = np.stack([request.array for request in batch])
+                outputs = np.asarray(self.predict_fn(inputs))
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for i, request in enumerate(batch):
+                request.future.set_result(outputs[i])
+
+    def stats(self):
+        """Returns queue depth and batch-size histograms for tuning the limits."""
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "rejected": self._rejected,
+                "mean_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "batch_size_histogram": {str(size): count
+                                         for size, count in enumerate(self._batch_sizes) if size},
+                "queue_depth_histogram": _histogram(QUEUE_DEPTH_BUCKETS, self._queue_depths),
+                "queue_wait_ms_histogram": _histogram(QUEUE_WAIT_MS_BUCKETS, self._queue_waits),
+            }
+
+
+def _histogram(buckets, counts):
+    """Labels per-bucket counts with their upper bounds ('+Inf' for the overflow bucket)."""
+    labels = [f"<={bound}" for bound in buckets] + ["+Inf"]
+    return dict(zip(labels, counts))
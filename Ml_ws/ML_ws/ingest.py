@@ -0,0 +1,113 @@
+import os
+
+from PIL import Image
+
+from downloader import Rejected
+
+# --- Image Ingest ---
+# Every crawled image passes through these stages before it reaches the training set.
+# Each stage rejects for its own reasons, and the rejection counts are reported by stage:
+#   stream     (in the Downloader, while the body arrives)
+#              not_image: the first bytes are no known image format (an HTML error page,
+#              say), whatever the URL or Content-Type claims
+#              oversize: Content-Length, or the bytes received so far, exceed max_bytes
+#   decode     too_many_pixels: the header declares a decompression bomb
+#              undecodable: the image is truncated or corrupt
+#   resolution too_small: the shorter edge is under min_edge
+#   dedup      duplicate / near_duplicate / cross_class_duplicate (ImageStore)
+# An image that passes is re-encoded as RGB JPEG (or WebP) with its longer edge at most
+# max_edge. Large JPEGs are decoded with PIL's draft mode, which scales down while
+# decoding, so a 20 MP original costs about as much as the stored copy. train.py then
+# never pays to decode a huge original again. The Downloader runs this on its own pool
+# of store_workers threads (PIL releases the GIL while it decodes, resizes and encodes),
+# so slow image work never holds up the downloads.
+MAX_PIXELS = 80_000_000  # Declared width x height beyond this is treated as a decompression bomb
+FORMATS = {"JPEG": ".jpg", "WEBP": ".webp"}
+REJECTION_STAGES = (
+    ("stream", ("not_image", "oversize")),
+    ("decode", ("too_many_pixels", "undecodable")),
+    ("resolution", ("too_small",)),
+    ("dedup", ("duplicate", "near_duplicate", "cross_class_duplicate")),
+)
+
+
+def sniff_image_type(head):
+    """Image format of a body from its first bytes ('jpeg', 'png', ...), or None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head.startswith(b"BM"):
+        return "bmp"
+    return None
+
+
+def _flatten(img):
+    """RGB copy of img, with any transparency composited onto white."""
+    if img.mode == "RGB":
+        return img
+    if (img.mode == "P" and "transparency" in img.info) or img.mode in ("LA", "PA"):
+        img = img.convert("RGBA")
+    if img.mode == "RGBA":
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+class Ingest:
+    """Downloader store hook: decode, check and normalise an image, then store it."""
+
+    def __init__(self, store, min_edge=128, max_edge=640, image_format="JPEG", quality=90):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unknown image format {image_format}; use one of {sorted(FORMATS)}")
+        self.store = store
+        self.min_edge = min_edge
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+
+    def normalize(self, source_path, target_path):
+        """Writes the normalised image at source_path to target_path; Rejected if it fails a check."""
+        try:
+            img = Image.open(source_path)
+        except Exception as e:
+            raise Rejected("undecodable", str(e))
+        with img:
+            width, height = img.size
+            if width * height > MAX_PIXELS:
+                raise Rejected("too_many_pixels", f"{width}x{height}")
+            if min(width, height) < self.min_edge:
+                raise Rejected("too_small", f"{width}x{height}")
+            img.draft("RGB", (self.max_edge, self.max_edge))  # JPEG: decode at 1/2..1/8 scale directly
+            try:
+                img.load()
+            except Exception as e:
+                raise Rejected("undecodable", str(e))
+            normalized = _flatten(img)
+            normalized.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            normalized.save(target_path, self.image_format, quality=self.quality)
+
+    def __call__(self, partial_path, path):
+        normalized_path = partial_path + ".norm"
+        try:
+            self.normalize(partial_path, normalized_path)
+            extension = FORMATS[self.image_format]
+            return self.store.add(normalized_path, os.path.splitext(path)[0] + extension)
+        finally:
+            if os.path.exists(normalized_path):
+                os.remove(normalized_path)
+
+
+def rejection_report(rejections):
+    """One line of rejection counts by stage, from Downloader.stats()["rejections"]."""
+    parts = []
+    for stage, reasons in REJECTION_STAGES:
+        total = sum(rejections.get(reason, 0) for reason in reasons)
+        detail = ", ".join(f"{rejections[reason]} {reason}" for reason in reasons if rejections.get(reason))
+        parts.append(f"{stage} {total}" + (f" ({detail})" if detail else ""))
+    return "Ingest rejections: " + "; ".join(parts)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+# --- Bundle Layout ---
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_DIR = "model_bundle"  # Everything web.py needs to serve the model lives here
+MANIFEST_NAME = "manifest.json"
+WEIGHTS_NAME = "efficientnet_phone_model.h5"
+
+# Immutable view of a loaded manifest. class_labels is a tuple ordered by softmax index
+# and class_table holds the pre-split (brand, model name) pair for every index.
+ModelBundle = namedtuple("ModelBundle", [
+    "version", "weights_path", "class_labels", "class_table",
+    "image_size", "rescale", "data_hash", "artifacts",
+])
+
+
+def hash_training_data(*dirs):
+    """Hashes the relative paths and bytes of every file under the given directories."""
+    digest = hashlib.sha256()
+    for base_dir in dirs:
+        if not os.path.isdir(base_dir):
+            continue
+        for root, subdirs, files in os.walk(base_dir):
+            subdirs.sort()  # Make the walk order deterministic
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, os.path.dirname(os.path.abspath(base_dir)))
+                digest.update(rel_path.replace(os.sep, "/").encode("utf-8"))
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b""):
+                        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_class_label(label):
+    """Turns a directory label like 'apple_iphone_15_pro' into ('apple', 'iphone 15 pro')."""
+    brand, model_name = label.split("_", 1)
+    return brand, model_name.replace("_", " ")
+
+
+def write_manifest(bundle_dir, class_labels, image_size, data_hash, rescale=1. / 255,
+                   weights_name=WEIGHTS_NAME, artifacts=None, extra=None):
+    """Writes the bundle manifest next to the saved weights."""
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "version": datetime.utcnow().strftime("%Y%m%d%H%M%S"),
+        "weights": weights_name,
+        "class_labels": list(class_labels),
+        "input": {
+            "image_size": list(image_size),
+            "color_mode": "rgb",
+            "rescale": rescale,
+        },
+        "training_data_sha256": data_hash,
+        "artifacts": dict(artifacts or {}),
+    }
+    if extra:
+        manifest.update(extra)
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    manifest_path = os.path.join(bundle_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)  # Never leave a half-written manifest behind
+    return manifest_path
+
+
+def update_manifest(bundle_dir, **fields):
+    """Merges extra top-level fields (e.g. new artifacts) into an existing manifest."""
+    manifest_path = os.path.join(bundle_dir, MANIFEST_NAME)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(manifest.get(key), dict):
+            manifest[key].update(value)
+        else:
+            manifest[key] = value
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def load_bundle(bundle_dir=BUNDLE_DIR):
+    """Reads a bundle manifest into an immutable ModelBundle."""
+    with open(os.path.join(bundle_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format: {manifest.get('format_version')}")
+
+    class_labels = tuple(manifest["class_labels"])
+    artifacts = {name: os.path.join(bundle_dir, path)
+                 for name, path in manifest.get("artifacts", {}).items()}
+    return ModelBundle(
+        version=manifest["version"],
+        weights_path=os.path.join(bundle_dir, manifest["weights"]),
+        class_labels=class_labels,
+        class_table=tuple(split_class_label(label) for label in class_labels),
+        image_size=tuple(manifest["input"]["image_size"]),
+        rescale=float(manifest["input"]["rescale"]),
+        data_hash=manifest.get("training_data_sha256"),
+        artifacts=artifacts,
+    )
+
+
+def legacy_bundle(weights_path, train_dir, image_size, rescale=1. / 255):
+    """Builds a ModelBundle for an old bare .h5 model by listing the train directory once."""
+    class_labels = tuple(sorted(d for d in os.listdir(train_dir)
+                                if os.path.isdir(os.path.join(train_dir, d))))
+    return ModelBundle(
+        version="legacy",
+        weights_path=weights_path,
+        class_labels=class_labels,
+        class_table=tuple(split_class_label(label) for label in class_labels),
+        image_size=tuple(image_size),
+        rescale=rescale,
+        data_hash=None,
+        artifacts={},
+    )
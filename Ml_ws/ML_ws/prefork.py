@@ -0,0 +1,192 @@
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+
+from gunicorn.app.base import BaseApplication
+
+from backends import weight_sharing
+from metrics import process_memory
+
+# --- Pre-fork Serving ---
+# Runs web.app under gunicorn with preload: the master imports web.py and loads what it
+# can share, then gunicorn forks --workers gthread workers that serve from one listening
+# socket. Everything the master loaded before forking (the imported modules, the bundle,
+# and the model itself for fork-safe backends) stays shared copy-on-write; the .tflite
+# weights and the catalog index are memory-mapped from disk, so they are shared even
+# though each worker loads them. A backend that shares neither way (keras, onnx) costs
+# a full copy of the weights per worker, so the launcher refuses it unless
+# --allow-private-weights is given. Unlike web.py on its own (keras), it therefore
+# serves tflite_float16 unless --backend or PRODSCAN_MODEL_BACKEND says otherwise.
+#
+#     python prefork.py --workers 4 --bind 0.0.0.0:2502 --max-requests 5000
+#
+# Each worker loads and warms the model before it accepts connections. Workers are
+# recycled by gunicorn after --max-requests (plus jitter), by this module when their
+# private memory passes --max-worker-mb, and all of them on SIGHUP; a stopping worker
+# finishes its in-flight requests first. SIGTERM or Ctrl-C stops every worker the same
+# way. Worker memory (RSS, PSS, USS) is logged by the master every --report-interval seconds.
+GRACEFUL_TIMEOUT = 30  # Seconds a stopping worker gets to finish its requests before SIGKILL
+WORKER_TIMEOUT = 120  # Seconds a worker may go without a heartbeat before gunicorn kills it
+THREADS = 32  # Request threads per worker; scans spend most of their time waiting on Gemini
+MEMORY_CHECK_EVERY = 100  # Requests between a worker's checks of its own private memory
+DEFAULT_BACKEND = "tflite_float16"  # Memory-mapped, so every worker shares one copy of the weights
+MIB = 2 ** 20
+
+
+class PreforkApplication(BaseApplication):
+    """gunicorn serving an app imported (and a model preloaded) before the fork."""
+
+    def __init__(self, app, preloaded, args):
+        self.wsgi_app = app
+        self.preloaded = preloaded
+        self.args = args
+        super().__init__()
+
+    def load_config(self):
+        options = {
+            "bind": self.args.bind,
+            "workers": self.args.workers,
+            "worker_class": "gthread",
+            "threads": self.args.threads,
+            "preload_app": True,
+            "max_requests": self.args.max_requests,
+            "max_requests_jitter": self.args.max_requests_jitter,
+            "graceful_timeout": self.args.graceful_timeout,
+            "timeout": self.args.timeout,
+            "backlog": 2048,
+            "when_ready": self.when_ready,
+            "post_worker_init": self.post_worker_init,
+            "post_request": self.post_request,
+            "worker_exit": self.worker_exit,
+        }
+        for key, value in options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.wsgi_app
+
+    # --- Master ---
+
+    def when_ready(self, server):
+        threading.Thread(target=self.report_memory, args=(server,), name="prefork-memory", daemon=True).start()
+
+    def report_memory(self, server):
+        while True:
+            time.sleep(self.args.report_interval)
+            lines, _ = memory_report(os.getpid(), list(server.WORKERS))
+            for line in lines:
+                print(line)
+
+    # --- Worker ---
+
+    def post_worker_init(self, worker):
+        """Loads and warms the model; gunicorn only starts accepting once this returns."""
+        import web
+        loading = threading.Event()
+
+        def heartbeat():
+            # Loading can outlast --timeout; the master would take the silence for a hang
+            while not loading.wait(1.0):
+                worker.notify()
+
+        threading.Thread(target=heartbeat, name="prefork-heartbeat", daemon=True).start()
+        web.BOOT_STARTED = time.perf_counter()  # A worker's "ready" time counts from its fork
+        try:
+            web.load_model(self.preloaded)
+        finally:
+            loading.set()
+        if web.model_state != "ready":
+            print(f"Worker {os.getpid()} could not load the model")
+
+    def post_request(self, worker, req, environ, resp):
+        """Stops a worker (gracefully; gunicorn starts another) once its private memory
+        passes --max-worker-mb."""
+        if not self.args.max_worker_mb or worker.nr % MEMORY_CHECK_EVERY or not worker.alive:
+            return
+        uss = process_memory().get("uss", 0)
+        if uss > self.args.max_worker_mb * MIB:
+            print(f"Worker {os.getpid()} holds {uss / MIB:.0f} MiB private memory; recycling it")
+            worker.alive = False
+
+    def worker_exit(self, server, worker):
+        import web
+        web.scan_writer.close()  # Flush the history rows this worker queued
+        print(f"Worker {os.getpid()} stopped after {worker.nr} requests")
+
+
+def memory_report(master_pid, worker_pids):
+    """(log lines, {pid: process_memory}) for the master and its workers."""
+    usage = {pid: memory for pid in worker_pids for memory in [process_memory(pid)] if memory}
+    master = process_memory(master_pid)
+    if not usage or not master:
+        return ["Memory report unavailable (needs /proc/<pid>/smaps_rollup)"], usage
+    lines = [f"  worker {pid}: rss {memory['rss'] / MIB:.0f} MiB, pss {memory['pss'] / MIB:.0f} MiB, "
+             f"uss {memory['uss'] / MIB:.0f} MiB, shared {memory['shared'] / MIB:.0f} MiB"
+             for pid, memory in sorted(usage.items())]
+    # Each extra worker costs its private pages; everything shared is paid once
+    mean_uss = sum(memory["uss"] for memory in usage.values()) / len(usage)
+    total = master["pss"] + sum(memory["pss"] for memory in usage.values())
+    lines.insert(0, f"Memory: master rss {master['rss'] / MIB:.0f} MiB, {len(usage)} workers, "
+                    f"{total / MIB:.0f} MiB in total (pss), {mean_uss / MIB:.0f} MiB per extra worker (uss), "
+                    f"~{1024 * MIB / mean_uss:.1f} workers per GiB")
+    return lines, usage
+
+
+# --- Main Execution ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve web.py from pre-forked gunicorn workers sharing one model load.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=THREADS, help="Request threads per worker")
+    parser.add_argument("--bind", default="0.0.0.0:2502", help="host:port (default: %(default)s)")
+    parser.add_argument("--max-requests", type=int, default=0, help="Recycle a worker after this many requests (0: never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=0,
+                        help="Random extra requests per worker, so they are not all recycled at once")
+    parser.add_argument("--max-worker-mb", type=float, default=0,
+                        help="Recycle a worker whose private memory (uss) passes this many MiB (0: never)")
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT)
+    parser.add_argument("--timeout", type=int, default=WORKER_TIMEOUT,
+                        help="Kill a worker that has not answered the master for this many seconds")
+    parser.add_argument("--report-interval", type=float, default=60, help="Seconds between memory reports")
+    parser.add_argument("--backend", default=os.environ.get("PRODSCAN_MODEL_BACKEND", DEFAULT_BACKEND),
+                        help=f"Model backend (default: PRODSCAN_MODEL_BACKEND, else {DEFAULT_BACKEND})")
+    parser.add_argument("--allow-private-weights", action="store_true",
+                        help="Serve a backend whose weights every worker loads privately (keras, onnx)")
+    parser.add_argument("--app-module", default="web",
+                        help="Module imported in the master before serving web.app, e.g. bench_app")
+    args = parser.parse_args()
+
+    os.environ["PRODSCAN_PREFORK"] = "1"  # web.py then leaves model loading to the workers
+    os.environ["PRODSCAN_MODEL_BACKEND"] = args.backend
+    started = time.perf_counter()
+    importlib.import_module(args.app_module)
+    import web
+
+    sharing = weight_sharing(web.MODEL_BACKEND)
+    if sharing is None:
+        message = (f"Backend {web.MODEL_BACKEND} shares no weights between workers: each of the "
+                   f"{args.workers} workers would load its own copy.")
+        if not args.allow_private_weights:
+            print(f"{message} Export a memory-mapped model (python train.py --export) and serve it "
+                  f"with --backend {DEFAULT_BACKEND}, or pass --allow-private-weights.")
+            sys.exit(2)
+        print(f"WARNING: {message}")
+
+    try:
+        preloaded = web.preload_model()
+    except Exception as e:  # Each worker retries and reports the failure itself
+        print(f"Error preloading model: {e}")
+        preloaded = (None, None)
+    bundle = preloaded[0]
+    if bundle is not None and web.MODEL_BACKEND != "keras" and web.MODEL_BACKEND not in bundle.artifacts:
+        print(f"Bundle {bundle.version} has no '{web.MODEL_BACKEND}' model for the workers to load: "
+              f"export it with python train.py --export, or choose another --backend.")
+        sys.exit(2)
+    shared = {"fork": "model", "mmap": "bundle (weights memory-mapped)"}.get(sharing, "bundle only")
+    print(f"Master {os.getpid()} ready in {time.perf_counter() - started:.2f}s "
+          f"({shared if preloaded[0] is not None else 'nothing'} preloaded, backend {web.MODEL_BACKEND})")
+
+    PreforkApplication(web.app, preloaded, args).run()
@@ -0,0 +1,84 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+class BufferPool:
+    """Free list of preallocated float32 input arrays.
+
+    A buffer stays checked out until the batched forward pass has copied it, so
+    the next request can never overwrite an image that is still queued.
+    """
+
+    def __init__(self, shape, size=16):
+        self.shape = tuple(shape)
+        self._free = queue.LifoQueue()  # LIFO keeps recently used (cache-warm) buffers in play
+        for _ in range(size):
+            self._free.put(np.empty(self.shape, dtype=np.float32))
+
+    def acquire(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return np.empty(self.shape, dtype=np.float32)  # Burst beyond the pool: allocate
+
+    def release(self, buffer):
+        self._free.put(buffer)
+
+
+class Preprocessor:
+    """Turns an encoded frame into a rescaled (H, W, 3) float32 model input.
+
+    JPEG frames use PIL's draft mode, so libjpeg scales the DCT blocks down while
+    decoding (to 1/2, 1/4 or 1/8, never below the target size). A 1280x720 frame
+    then decodes straight to 640x360 instead of full size. The result is written
+    into a pooled buffer. With workers > 0 the CPU work runs in a thread pool off
+    the request thread (PIL releases the GIL while decoding and resizing).
+    """
+
+    def __init__(self, image_size, rescale=1. / 255, workers=0, pool_size=16, resample=Image.BICUBIC):
+        self.image_size = tuple(image_size)  # (width, height), as PIL expects
+        self.rescale = np.float32(rescale)
+        self.resample = resample
+        self.buffers = BufferPool((self.image_size[1], self.image_size[0], 3), size=pool_size)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preprocess") if workers else None
+        self._lock = threading.Lock()
+        self._draft_hits = 0
+        self._frames = 0
+
+    def decode(self, image_data):
+        """Decodes to RGB at (or just above) the target size using DCT-domain downscaling."""
+        img = Image.open(BytesIO(image_data))
+        drafted = img.draft("RGB", self.image_size) is not None  # No-op (None) for non-JPEG
+        with self._lock:
+            self._frames += 1
+            self._draft_hits += drafted
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size != self.image_size:
+            img = img.resize(self.image_size, self.resample)
+        img.load()  # A target-size RGB frame skips convert and resize, which would otherwise load it
+        return img
+
+    def preprocess_into(self, image_data, out):
+        """Decodes, resizes and rescales one frame into the float32 array out."""
+        # A uint8 copy of the pixels (made through tobytes): PIL has no public API that
+        # writes a decoded image into caller-owned memory
+        pixels = np.asarray(self.decode(image_data))
+        np.copyto(out, pixels)
+        np.multiply(out, self.rescale, out=out)  # In place: a uint8 operand would need cast buffers
+        return out
+
+    def run(self, image_data, out):
+        """preprocess_into, on the worker pool when one is configured."""
+        if self._pool is None:
+            return self.preprocess_into(image_data, out)
+        return self._pool.submit(self.preprocess_into, image_data, out).result()
+
+    def stats(self):
+        with self._lock:
+            return {"frames": self._frames, "draft_decodes": self._draft_hits}
@@ -5,9 +5,16 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+from tensorflow.keras.models import load_model
+import numpy as np
+import argparse
+import json
 import os
 import shutil
 import random
+import time
+from model_bundle import BUNDLE_DIR, WEIGHTS_NAME, hash_training_data, write_manifest, update_manifest
+from backends import TFLiteBackend, OnnxBackend, pooling_layer
 
 # --- Constants (Adjust these if needed) ---
 IMAGE_SIZE = (224, 224)  # EfficientNetB0 input size
@@ -16,7 +23,10 @@ EPOCHS = 50  # Maximum number of epochs (EarlyStopping will likely stop sooner)
 DATA_DIR = "image_data_serpapi"  #  Path to your data directory
 TRAIN_DIR = os.path.join(DATA_DIR, "train")
 VALIDATION_DIR = os.path.join(DATA_DIR, "validation")
-MODEL_SAVE_PATH = "efficientnet_phone_model.h5"  # Where to save the trained model
+MODEL_SAVE_PATH = os.path.join(BUNDLE_DIR, WEIGHTS_NAME)  # Where to save the trained model
+QUANTIZATION_MODES = ("float16", "int8")  # Quantized .tflite variants exported after training
+REPRESENTATIVE_SAMPLES = 100  # Training images used to calibrate int8 ranges
+REPORT_NAME = "quantization_report.json"
 
 # --- 1. Data Splitting (Train/Validation) ---
 
@@ -116,6 +126,12 @@ def create_model(num_classes):
     model = Model(inputs=base_model.input, outputs=predictions)
     return model
 
+
+def create_embedding_model(model):
+    """Same weights with two outputs: the class probabilities and the pooled backbone features
+    (the embedding catalog.py indexes)."""
+    return Model(inputs=model.input, outputs=[model.output, pooling_layer(model).output])
+
 # --- 4. Training Loop ---
 
 def compile_and_train_model(model, train_generator, validation_generator, epochs, model_save_path):
@@ -148,11 +164,128 @@ def compile_and_train_model(model, train_generator, validation_generator, epochs
     )
     return history
 
+# --- 5. Model Bundle ---
+
+def write_model_bundle(train_generator, bundle_dir=BUNDLE_DIR):
+    """Writes the manifest (labels, input spec, data hash) that web.py loads at startup."""
+
+    # class_indices maps label -> softmax index; store the labels in index order
+    class_labels = sorted(train_generator.class_indices, key=train_generator.class_indices.get)
+    data_hash = hash_training_data(TRAIN_DIR, VALIDATION_DIR)
+    return write_manifest(bundle_dir, class_labels, IMAGE_SIZE, data_hash,
+                          rescale=1. / 255, weights_name=WEIGHTS_NAME)
+
+
+# --- 6. Quantized Export ---
+
+def representative_dataset(data_dir, num_samples=REPRESENTATIVE_SAMPLES):
+    """Yields un-augmented training images for int8 calibration."""
+    calibration_generator = ImageDataGenerator(rescale=1. / 255).flow_from_directory(
+        data_dir, target_size=IMAGE_SIZE, batch_size=1, class_mode=None, shuffle=True)
+
+    def generator():
+        for _ in range(min(num_samples, calibration_generator.samples)):
+            yield [next(calibration_generator).astype(np.float32)]
+    return generator
+
+
+def convert_to_tflite(model, mode):
+    """Converts the Keras model to a float16 or int8 quantized TFLite flatbuffer."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        # Full integer kernels; input/output stay float32 so serving code is unchanged
+        converter.representative_dataset = representative_dataset(TRAIN_DIR)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    return converter.convert()
+
+
+def export_onnx(model, output_path):
+    """Exports the model to ONNX if tf2onnx is installed; returns False otherwise.
+
+    The export has the embedding as a second output; OnnxBackend.predict only runs the first.
+    """
+    try:
+        import tf2onnx
+    except ImportError:
+        print("tf2onnx not installed, skipping ONNX export.")
+        return False
+    spec = (tf.TensorSpec((None,) + IMAGE_SIZE + (3,), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(create_embedding_model(model), input_signature=spec, opset=13, output_path=output_path)
+    return True
+
+
+def evaluate_predict_fn(predict_fn, validation_generator):
+    """Returns top-1 predictions, accuracy and mean per-batch latency over the validation split."""
+    predicted, expected, latencies = [], [], []
+    for i in range(len(validation_generator)):
+        batch, labels = validation_generator[i]
+        started = time.perf_counter()
+        outputs = np.asarray(predict_fn(batch.astype(np.float32)))
+        latencies.append((time.perf_counter() - started) * 1000.0)
+        predicted.append(np.argmax(outputs, axis=1))
+        expected.append(np.argmax(labels, axis=1))
+    predicted = np.concatenate(predicted)
+    expected = np.concatenate(expected)
+    return predicted, {
+        "accuracy": float(np.mean(predicted == expected)),
+        "mean_batch_latency_ms": float(np.mean(latencies)),
+    }
+
+
+def export_quantized_models(model, validation_generator, bundle_dir=BUNDLE_DIR):
+    """Exports quantized variants and reports their accuracy delta against the Keras model."""
+    keras_predicted, keras_report = evaluate_predict_fn(model.predict_on_batch, validation_generator)
+    keras_report["size_bytes"] = os.path.getsize(MODEL_SAVE_PATH)
+    report = {"validation_samples": int(len(keras_predicted)), "keras": keras_report}
+    artifacts = {}
+
+    candidates = []
+    for mode in QUANTIZATION_MODES:
+        name = f"tflite_{mode}"
+        filename = f"model_{mode}.tflite"
+        with open(os.path.join(bundle_dir, filename), "wb") as f:
+            f.write(convert_to_tflite(model, mode))
+        candidates.append((name, filename, TFLiteBackend))
+    if export_onnx(model, os.path.join(bundle_dir, "model.onnx")):
+        candidates.append(("onnx", "model.onnx", OnnxBackend))
+
+    for name, filename, backend_class in candidates:
+        path = os.path.join(bundle_dir, filename)
+        predicted, variant_report = evaluate_predict_fn(backend_class(path).predict, validation_generator)
+        variant_report["size_bytes"] = os.path.getsize(path)
+        variant_report["accuracy_delta"] = variant_report["accuracy"] - keras_report["accuracy"]
+        variant_report["agreement_with_keras"] = float(np.mean(predicted == keras_predicted))
+        report[name] = variant_report
+        artifacts[name] = filename
+        print(f"{name}: accuracy {variant_report['accuracy']:.4f} "
+              f"(delta {variant_report['accuracy_delta']:+.4f}), {variant_report['size_bytes']} bytes")
+
+    with open(os.path.join(bundle_dir, REPORT_NAME), "w") as f:
+        json.dump(report, f, indent=2)
+    update_manifest(bundle_dir, artifacts=artifacts, quantization_report=REPORT_NAME)
+    return report
 
 
 # --- Main Execution ---
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the phone classifier and write the model bundle.")
+    parser.add_argument("--export", action="store_true",
+                        help="Skip training; export quantized models from the existing bundle.")
+    args = parser.parse_args()
+
+    if args.export:
+        # Reuse the existing split so the accuracy report matches the trained bundle
+        _, validation_generator = create_data_generators(TRAIN_DIR, VALIDATION_DIR, IMAGE_SIZE, BATCH_SIZE)
+        export_quantized_models(load_model(MODEL_SAVE_PATH), validation_generator)
+        print("Export complete! Report written to:", os.path.join(BUNDLE_DIR, REPORT_NAME))
+        raise SystemExit(0)
+
     # 1. Create the training/validation split
     create_train_val_split(DATA_DIR, TRAIN_DIR, VALIDATION_DIR)
 
@@ -163,9 +296,17 @@ if __name__ == "__main__":
     num_classes = train_generator.num_classes
 
     # 4. Create the model
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
     model = create_model(num_classes)
 
     # 5. Compile and train the model
     history = compile_and_train_model(model, train_generator, validation_generator, EPOCHS, MODEL_SAVE_PATH)
 
+    # 6. Write the bundle manifest next to the weights
+    manifest_path = write_model_bundle(train_generator)
+
+    # 7. Export quantized variants of the best checkpoint (the weights web.py serves)
+    export_quantized_models(load_model(MODEL_SAVE_PATH), validation_generator)
+
     print("Training complete! Model saved to:", MODEL_SAVE_PATH)
+    print("Model bundle manifest written to:", manifest_path)
@@ -1,63 +1,354 @@
-from flask import Flask, render_template, request, jsonify
-import base64
+import time
+BOOT_STARTED = time.perf_counter()  # Import time is reported from here
+
+from flask import Flask, Response, render_template, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
 import re
-import sqlite3
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 import numpy as np
-from io import BytesIO
 import os
-from bs4 import BeautifulSoup
-from PIL import Image
+import sys
 from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))  # For prodscan_common
+from model_bundle import BUNDLE_DIR, load_bundle, legacy_bundle, split_class_label
+from inference import BatchingPredictor, QueueFull
+from backends import load_backend, weight_sharing
+from embedding_index import INDEX_FILE, load_index
+from prodscan_common.scan_cache import PerceptualCache, perceptual_hash
+from enrichment_cache import TieredCache, MemoryTier, SQLiteTier, RedisTier
+from prodscan_common.uploads import MAX_UPLOAD_BYTES, UploadError, read_scan_upload
+from preprocessing import Preprocessor
+from prodscan_common.scan_history import ScanWriter, ScanHistory, migrate_database, parse_history_args
+from metrics import CONTENT_TYPE, Registry, family, histogram_samples, process_memory, track_upstream
+from prodscan_common.resilience import Budget, Upstream, UpstreamUnavailable, is_cacheable_answer, is_degraded
+from prodscan_common.singleflight import WAITER_BUCKETS
+from io import BytesIO
+from PIL import Image
 
-app = Flask(__name__, static_folder="static")
+IMPORT_SECONDS = time.perf_counter() - BOOT_STARTED
 
-# --- Model Loading ---
-MODEL_PATH = "efficientnet_phone_model.h5"  # Path to your trained model
-try:
-    model = load_model(MODEL_PATH)
-    print("Model loaded successfully!")
-except Exception as e:
-        print(f"Error loading model: {e}")
-        model = None
+app = Flask(__name__, static_folder="static")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES  # Larger uploads get a 413
 
 # --- Constants ---
 IMAGE_SIZE = (224, 224)
 DATA_DIR = "image_data_serpapi"  # Use the correct data directory
 EXCHANGE_RATE = 35  # THB to USD
 
+# --- Metrics ---
+# Served in Prometheus text format at /metrics. Stage timings cover one scan end to end;
+# cache, batching and history-writer counters are read from their own stats() at scrape time.
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    "prodscan_stage_seconds", "Seconds spent in each stage of a scan.", ["stage"])
+scan_seconds = metrics.histogram(
+    "prodscan_scan_seconds", "Seconds from upload to the last event of a scan, by final event.", ["endpoint", "outcome"])
+upstream_requests = metrics.counter(
+    "prodscan_upstream_requests_total", "Gemini and Google Search calls by outcome (ok, error, timeout).",
+    ["service", "call", "outcome"])
+upstream_seconds = metrics.histogram(
+    "prodscan_upstream_seconds", "Latency of Gemini and Google Search calls.", ["service", "call"])
+enrichment_results = metrics.counter(
+    "prodscan_enrichment_results_total", "Enrichment lookups by outcome (ok, failed, deadline).",
+    ["enrichment", "outcome"])
+in_flight = metrics.gauge("prodscan_in_flight_scans", "Scans currently being handled.", ["endpoint"])
+
+# --- Inference Batching ---
+# Concurrent scans are grouped into one forward pass of at most BATCH_MAX_SIZE images,
+# waiting at most BATCH_MAX_WAIT_MS after the first image for others to arrive.
+BATCH_MAX_SIZE = int(os.environ.get("PRODSCAN_BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("PRODSCAN_BATCH_MAX_WAIT_MS", 5))
+PREDICT_TIMEOUT = 30  # Seconds a scan waits for its batch before giving up
+# Decode/resize threads; 0 runs preprocessing on the request thread
+PREPROCESS_WORKERS = int(os.environ.get("PRODSCAN_PREPROCESS_WORKERS", 0))
+
+# --- Scan Result Cache ---
+# Frames whose perceptual hashes differ by at most SCAN_CACHE_MAX_DISTANCE bits reuse
+# the earlier result. Set PRODSCAN_SCAN_CACHE_SPILL_DB to keep evicted entries in SQLite.
+SCAN_CACHE_SIZE = int(os.environ.get("PRODSCAN_SCAN_CACHE_SIZE", 1024))
+SCAN_CACHE_TTL = int(os.environ.get("PRODSCAN_SCAN_CACHE_TTL", 600))  # Seconds
+SCAN_CACHE_MAX_DISTANCE = int(os.environ.get("PRODSCAN_SCAN_CACHE_MAX_DISTANCE", 4))
+SCAN_CACHE_SPILL_DB = os.environ.get("PRODSCAN_SCAN_CACHE_SPILL_DB") or None
+
+scan_cache = PerceptualCache(max_entries=SCAN_CACHE_SIZE, ttl=SCAN_CACHE_TTL,
+                             max_distance=SCAN_CACHE_MAX_DISTANCE, spill_path=SCAN_CACHE_SPILL_DB)
+
+# --- Model Loading ---
+# "keras" serves the .h5 through TensorFlow; "tflite_int8", "tflite_float16" and "onnx"
+# serve the quantized exports from train.py without importing TensorFlow.
+MODEL_BACKEND = os.environ.get("PRODSCAN_MODEL_BACKEND", "keras")
+MODEL_THREADS = int(os.environ.get("PRODSCAN_MODEL_THREADS", 0)) or None
+LEGACY_MODEL_PATH = "efficientnet_phone_model.h5"  # Bare model from before bundles existed
+
+
+def load_model_bundle():
+    """Loads the bundle manifest once, falling back to a bare .h5 plus the train directory."""
+    try:
+        return load_bundle(BUNDLE_DIR)
+    except FileNotFoundError:
+        print(f"No bundle manifest in '{BUNDLE_DIR}', falling back to {LEGACY_MODEL_PATH}")
+        return legacy_bundle(LEGACY_MODEL_PATH, os.path.join(DATA_DIR, "train"), IMAGE_SIZE)
+
+
+# --- Catalog Recognition ---
+# Products outside the classifier's classes are matched by embedding against a catalog
+# index built by catalog.py from a few reference photos per product, with no retraining.
+# The search runs in the batch worker on the embeddings of the same forward pass, so a
+# catalog hit costs one matrix product instead of a Gemini round trip. Scans take the
+# classifier's answer above CLASSIFIER_MIN_CONFIDENCE, else the nearest catalog product
+# whose cosine similarity reaches CATALOG_MIN_SCORE, else go to Gemini.
+CATALOG_INDEX_DIR = os.environ.get("PRODSCAN_CATALOG_INDEX", os.path.join(BUNDLE_DIR, "catalog_index"))
+CATALOG_MIN_SCORE = float(os.environ.get("PRODSCAN_CATALOG_MIN_SCORE", 0.75))
+CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get("PRODSCAN_CLASSIFIER_MIN_CONFIDENCE", 0.6))
+
+
+def load_catalog(loaded_model, loaded_bundle):
+    """The catalog index for this bundle, memory-mapped; None if there is none or it does not fit."""
+    if not os.path.exists(os.path.join(CATALOG_INDEX_DIR, INDEX_FILE)):
+        return None
+    if getattr(loaded_model, "predict_with_embedding", None) is None:
+        print(f"Backend {MODEL_BACKEND} has no embedding output; catalog index not used")
+        return None
+    index = load_index(CATALOG_INDEX_DIR)
+    # Embeddings from another model's weights live in a different space
+    built_with = index.metadata.get("bundle_version")
+    if built_with != loaded_bundle.version:
+        print(f"Catalog index was built with bundle {built_with}, not {loaded_bundle.version}; "
+              f"rebuild it with catalog.py. Catalog index not used")
+        return None
+    print(f"Catalog index loaded: {len(index)} photos of {len(index.label_names)} products ({index.kind})")
+    return index
+
+
+def catalog_report():
+    """Index stats (or loaded: False) plus the thresholds scans are matched with."""
+    stats = dict(catalog.stats(), loaded=True) if catalog is not None else {"loaded": False}
+    return dict(stats, min_score=CATALOG_MIN_SCORE, classifier_min_confidence=CLASSIFIER_MIN_CONFIDENCE)
+
+
+def catalog_predict_fn(loaded_model, index):
+    """Batch function returning, per image, the class probabilities followed by the best
+    catalog (score, row id); a catalog without rows gives (-inf, -1)."""
+    def predict(batch):
+        probabilities, embeddings = loaded_model.predict_with_embedding(batch)
+        best = np.tile(np.array([-np.inf, -1.0]), (len(batch), 1))
+        if len(index):
+            scores, ids = index.search(embeddings, 1)
+            best[:, 0], best[:, 1] = scores[:, 0], ids[:, 0]
+        return np.hstack([probabilities, best])  # float64, so row ids stay exact
+    return predict
+
+
+# --- Startup ---
+# "background" (default) lets the server start accepting connections right away and
+# loads the model on a thread, so the backend runtime (TensorFlow, TFLite or ONNX
+# Runtime, imported inside backends.py) is imported off the startup path. /readyz
+# answers 503 until the model has also run its warm-up batches, so a load balancer
+# only sends scans to a warm worker. "eager" loads and warms the model during import,
+# before the server binds. Under prefork.py (PRODSCAN_PREFORK=1, set by the launcher)
+# nothing is loaded at import; each forked worker loads the model before it accepts connections.
+STARTUP_MODE = os.environ.get("PRODSCAN_STARTUP", "background")
+PREFORK = os.environ.get("PRODSCAN_PREFORK") == "1"
+
+model = None
+bundle = None
+catalog = None  # Set with the model when a catalog index for its bundle exists
+predictor = None
+preprocessor = None
+model_state = "loading"  # Then "ready" or "failed"
+boot_times = {"imports": IMPORT_SECONDS}  # Phase -> seconds, reported at boot, on /readyz and /metrics
+
+
+def warm_up(predict_fn, loaded_bundle, warm_predictor, warm_preprocessor):
+    """Runs the batch shapes serving will use, then one frame end to end, before traffic."""
+    # Graph tracing (Keras) and tensor reallocation (TFLite) happen on the first call per
+    # batch size; the largest and the single-image batch cover most scans
+    for batch_size in sorted({1, BATCH_MAX_SIZE}):
+        predict_fn(np.zeros((batch_size, *loaded_bundle.image_size, 3), dtype=np.float32))
+    frame = BytesIO()
+    Image.new("RGB", (640, 480), (128, 128, 128)).save(frame, "JPEG")
+    buffer = warm_preprocessor.buffers.acquire()
+    warm_preprocessor.run(frame.getvalue(), buffer)
+    warm_predictor.predict(buffer, timeout=PREDICT_TIMEOUT)
+    warm_preprocessor.buffers.release(buffer)
+    frame_hash(frame.getvalue())
+
+
+def preload_model():
+    """For prefork.py's master: (bundle, backend or None) to hand to every forked worker.
+
+    Fork-safe backends are loaded here, so the workers share their weights copy-on-write;
+    the others (their runtimes start threads while loading) are left to each worker.
+    """
+    loaded_bundle = load_model_bundle()
+    if weight_sharing(MODEL_BACKEND) != "fork":
+        return loaded_bundle, None
+    return loaded_bundle, load_backend(MODEL_BACKEND, loaded_bundle, num_threads=MODEL_THREADS)
+
+
+def load_model(preloaded=(None, None)):
+    """Loads the bundle and backend (unless preloaded) and warms them up; scans only see
+    the model once it is warm."""
+    global model, bundle, catalog, predictor, preprocessor, model_state
+    started = time.perf_counter()
+    try:
+        loaded_bundle, loaded_model = preloaded
+        if loaded_bundle is None:
+            loaded_bundle = load_model_bundle()
+        if loaded_model is None:
+            loaded_model = load_backend(MODEL_BACKEND, loaded_bundle, num_threads=MODEL_THREADS)
+        try:
+            loaded_catalog = load_catalog(loaded_model, loaded_bundle)
+        except (OSError, ValueError, KeyError) as e:  # A broken index must not keep the model down
+            print(f"Error loading catalog index: {e}")
+            loaded_catalog = None
+        predict_fn = (catalog_predict_fn(loaded_model, loaded_catalog) if loaded_catalog is not None
+                      else loaded_model.predict)
+        new_predictor = BatchingPredictor(predict_fn, max_batch_size=BATCH_MAX_SIZE,
+                                          max_wait_ms=BATCH_MAX_WAIT_MS)
+        new_preprocessor = Preprocessor(loaded_bundle.image_size, loaded_bundle.rescale,
+                                        workers=PREPROCESS_WORKERS)
+        boot_times["model_load"] = time.perf_counter() - started
+        print(f"Model loaded successfully! (bundle {loaded_bundle.version}, {len(loaded_bundle.class_labels)} "
+              f"classes, backend {MODEL_BACKEND})")
+
+        warm_started = time.perf_counter()
+        warm_up(predict_fn, loaded_bundle, new_predictor, new_preprocessor)
+        boot_times["warm_up"] = time.perf_counter() - warm_started
+        model, bundle, catalog = loaded_model, loaded_bundle, loaded_catalog
+        predictor, preprocessor = new_predictor, new_preprocessor
+        model_state = "ready"
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        model_state = "failed"
+    boot_times["ready"] = time.perf_counter() - BOOT_STARTED
+    mode = "prefork" if PREFORK else STARTUP_MODE
+    print(f"Boot ({mode}): imports {boot_times['imports']:.2f}s, "
+          + "".join(f"{phase.replace('_', ' ')} {boot_times[phase]:.2f}s, "
+                    for phase in ("model_load", "warm_up") if phase in boot_times)
+          + f"model {model_state} {boot_times['ready']:.2f}s after start")
+
 # --- Database Setup ---
 DB_NAME = "product_scans.db"
 
 def create_database():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_name TEXT,
-            brand TEXT,
-            brand_details TEXT,
-            release_date TEXT,
-            usage TEXT,
-            price TEXT,
-            scan_time TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """Creates the scans table, or migrates an older product_scans.db to the current schema."""
+    migrate_database(DB_NAME)
 
 create_database()
 
+# --- Scan History ---
+# Scans are queued in memory and inserted by a background writer in batched transactions,
+# so a scan never waits on the disk. The queue is bounded; see ScanWriter.
+SCAN_WRITER_QUEUE_SIZE = int(os.environ.get("PRODSCAN_SCAN_WRITER_QUEUE_SIZE", 10000))
+scan_writer = ScanWriter(DB_NAME, max_queue_size=SCAN_WRITER_QUEUE_SIZE)
+history_reader = ScanHistory(DB_NAME)  # Read-only connections behind /scans
+
 # --- API Keys and URLs (HARDCODED - FOR TESTING ONLY) ---
 GOOGLE_SEARCH_API_KEY =""  # YOUR GOOGLE SEARCH KEY
 GOOGLE_SEARCH_ENGINE_ID = ""  # YOUR GOOGLE SEARCH ENGINE ID
-GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+# PRODSCAN_GOOGLE_SEARCH_URL / PRODSCAN_GEMINI_API_URL point at the local fakes in bench/
+GOOGLE_SEARCH_URL = os.environ.get("PRODSCAN_GOOGLE_SEARCH_URL") or "https://www.googleapis.com/customsearch/v1"
 GEMINI_API_KEY = "" # YOUR GEMINI API KEY
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+GEMINI_API_URL = os.environ.get("PRODSCAN_GEMINI_API_URL") or f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+
+# --- HTTP Client ---
+# One keep-alive connection pool shared by every outbound Gemini/Google call, and a
+# thread pool so the independent enrichment calls of a scan run side by side.
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT = (3.05, 15)  # (connect, read) seconds for a single upstream call
+ENRICHMENT_DEADLINE = 20  # Seconds a scan waits for all of its enrichment calls together
+UPSTREAM_ERRORS = (requests.exceptions.RequestException, UpstreamUnavailable)
+
+# --- Upstream Resilience ---
+# Each scan gets SCAN_BUDGET seconds for all of its Gemini/Google calls; a call never
+# waits past what is left of it. After BREAKER_FAILURES failures in a row a service's
+# circuit opens and its calls fail fast for BREAKER_RESET seconds, so scans degrade to
+# fallback text instead of piling up on a dead upstream. With HEDGE_AFTER_MS set, a
+# text-only call still unanswered after that long is sent a second time.
+SCAN_BUDGET = float(os.environ.get("PRODSCAN_SCAN_BUDGET", 25))
+BREAKER_FAILURES = int(os.environ.get("PRODSCAN_BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.environ.get("PRODSCAN_BREAKER_RESET_S", 30))
+HEDGE_AFTER_MS = float(os.environ.get("PRODSCAN_HEDGE_AFTER_MS", 0))  # 0: no hedging
+
+upstreams = {name: Upstream(name, timeout=HTTP_TIMEOUT, failure_threshold=BREAKER_FAILURES,
+                            reset_timeout=BREAKER_RESET, hedge_after=HEDGE_AFTER_MS / 1000.0)
+             for name in ("gemini", "google_search")}
+
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+enrichment_pool = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="enrichment")
+
+
+def iter_enrichments(calls, deadline=ENRICHMENT_DEADLINE, budget=None):
+    """Runs {name: (function, args, fallback)} concurrently, yielding (name, result) as each finishes.
+
+    Every call shares one deadline, so the wait is bounded by the slowest call (or the
+    deadline) instead of the sum. Calls that miss it or raise get their fallback value.
+    With a budget, the deadline is also capped by what is left of it.
+    """
+    if budget is not None:
+        deadline = min(deadline, budget.remaining())
+        futures = {enrichment_pool.submit(budget.run, function, *args): name
+                   for name, (function, args, fallback) in calls.items()}
+    else:
+        futures = {enrichment_pool.submit(function, *args): name
+                   for name, (function, args, fallback) in calls.items()}
+    pending = set(futures.values())
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            name = futures[future]
+            pending.discard(name)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Enrichment '{name}' failed: {e}")
+                enrichment_results.inc(enrichment=name, outcome="failed")
+                yield name, calls[name][2]
+            else:
+                enrichment_results.inc(enrichment=name, outcome="ok")
+                yield name, result
+    except FutureTimeoutError:
+        for future, name in futures.items():
+            if name in pending:
+                print(f"Enrichment '{name}' missed its {deadline}s deadline")
+                enrichment_results.inc(enrichment=name, outcome="deadline")
+                future.cancel()
+                yield name, calls[name][2]
+
+
+def run_enrichments(calls, deadline=ENRICHMENT_DEADLINE, budget=None):
+    """Runs {name: (function, args, fallback)} concurrently and collects results by name."""
+    return dict(iter_enrichments(calls, deadline, budget))
+
+# --- Enrichment Cache ---
+# Usage and price answers change slowly, so they are cached per product name: in memory,
+# then in a SQLite file shared by local workers, then (optionally) in Redis shared by
+# every node. After the TTL an answer is served stale while it refreshes in the background.
+ENRICHMENT_TTLS = {"usage": 30 * 86400, "gemini_price": 12 * 3600, "cse_price": 6 * 3600}
+ENRICHMENT_STALE_TTLS = {"usage": 7 * 86400, "gemini_price": 24 * 3600, "cse_price": 24 * 3600}
+ENRICHMENT_CACHE_DB = os.environ.get("PRODSCAN_ENRICHMENT_CACHE_DB", "enrichment_cache.db")
+ENRICHMENT_REDIS_URL = os.environ.get("PRODSCAN_ENRICHMENT_REDIS_URL")
+
+
+def build_enrichment_cache():
+    """Memory -> SQLite -> (Redis) tiers for the Gemini/CSE enrichment answers."""
+    tiers = [MemoryTier()]
+    if ENRICHMENT_CACHE_DB:
+        tiers.append(SQLiteTier(ENRICHMENT_CACHE_DB))
+    if ENRICHMENT_REDIS_URL:
+        try:
+            tiers.append(RedisTier(ENRICHMENT_REDIS_URL))
+        except Exception as e:
+            print(f"Error connecting enrichment cache to Redis: {e}")
+    return TieredCache(tiers, ENRICHMENT_TTLS, ENRICHMENT_STALE_TTLS)
+
+
+enrichment_cache = build_enrichment_cache()
 
 # --- Utility Functions ---
 
@@ -87,63 +378,81 @@ def search_shopee_lazada_price(product_name, brand=None):
     shopee_url = f"https://shopee.co.th/search?keyword={product_name}"
     return  lazada_url, shopee_url
 
-def search_generic_price(product_name):
-    """Searches for a generic product's price (fallback)."""
+def generic_price_params(product_name):
+    """Custom Search query parameters for a generic price lookup."""
     query = f"{product_name} price"
-    params = {
+    return {
         "q": query,
         "cx": GOOGLE_SEARCH_ENGINE_ID,
         "key": GOOGLE_SEARCH_API_KEY,
         "num": 5
     }
+
+def generic_price_from_results(results):
+    """Formats the Custom Search hits that look like prices as links."""
+    price_results = []
+    for item in results.get("items", []):
+        if "price" in item["title"].lower() or any(
+                currency in item["snippet"] for currency in ["฿", "$", "€", "£"]):
+            price_results.append(
+                f"<a href='{item['link']}' target='_blank'>{item['title']}</a>: {item['snippet']}")
+    return "<br>".join(price_results) if price_results else ""
+
+@enrichment_cache.cached("cse_price", should_cache=is_cacheable_answer)
+def search_generic_price(product_name):
+    """Searches for a generic product's price (fallback)."""
+    def send(timeout):
+        with track_upstream(upstream_requests, upstream_seconds, "google_search", "price"):
+            response = http.get(GOOGLE_SEARCH_URL, params=generic_price_params(product_name), timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+
     try:
-        response = requests.get(GOOGLE_SEARCH_URL, params=params)
-        response.raise_for_status()
-        results = response.json()
-
-        price_results = []
-        for item in results.get("items", []):
-            if "price" in item["title"].lower() or any(
-                    currency in item["snippet"] for currency in ["฿", "$", "€", "£"]):
-                price_results.append(
-                    f"<a href='{item['link']}' target='_blank'>{item['title']}</a>: {item['snippet']}")
-        return "<br>".join(price_results) if price_results else ""
-    except requests.exceptions.RequestException as e:
+        return generic_price_from_results(upstreams["google_search"].call(send))
+    except UPSTREAM_ERRORS as e:
         print(f"Error fetching generic price: {e}")
         return "Error retrieving price data."
 
 
 
-def analyze_image_with_gemini(image_data):
-    """Sends image to Gemini API for analysis (non-phone products)."""
-    headers = {"Content-Type": "application/json"}
-    payload = {
+# --- Gemini Requests ---
+GEMINI_HEADERS = {"Content-Type": "application/json"}
+
+
+def gemini_post(payload, call, hedge=True):
+    """POSTs one generateContent request and returns the decoded answer, counted under call.
+
+    Goes through the "gemini" Upstream: capped by the scan's budget, refused while the
+    circuit is open, and hedged (if enabled) unless hedge is False.
+    """
+    def send(timeout):
+        with track_upstream(upstream_requests, upstream_seconds, "gemini", call):
+            response = http.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY}, json=payload,
+                                 headers=GEMINI_HEADERS, timeout=timeout)
+            response.raise_for_status()  # This will raise an exception for 4xx and 5xx errors
+            return response.json()
+    return upstreams["gemini"].call(send, hedge=hedge)
+
+
+def identify_payload(image_data, mime_type="image/jpeg"):
+    """Free-text product identification prompt for a base64 image."""
+    return {
         "contents": [
             {
                 "role": "user",
                 "parts": [
                     {
                         "text": "Identify the product and provide details including: Product Name, Brand, Release Date of product and company, Brand Details brand owner, and explain what this product is used for in short sentence."},
-                    {"inline_data": {"mime_type": "image/jpeg", "data": image_data}}
+                    {"inline_data": {"mime_type": mime_type, "data": image_data}}
                 ]
             }
         ]
     }
-    try:
-        # Pass API key as a parameter
-        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY}, json=payload, headers=headers)
-        response.raise_for_status()  # This will raise an exception for 4xx and 5xx errors
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print("Error calling Gemini API:", e)
-        return None
-
 
 
-def fetch_usage_with_gemini(product_name):
-    """Gets product usage from Gemini (fallback)."""
-    headers = {"Content-Type": "application/json"}
-    payload = {
+def usage_payload(product_name):
+    """One-sentence usage prompt for a product name."""
+    return {
         "contents": [
             {
                 "role": "user",
@@ -153,86 +462,464 @@ def fetch_usage_with_gemini(product_name):
             }
         ]
     }
+
+
+def price_payload(product_name):
+    """THB price prompt for a product name."""
+    return {
+        "contents": [
+            {
+                "role": "user",
+                "parts": [
+                    {"text": f"What is the price of {product_name} in Thailand, in THB?"}
+                ]
+            }
+        ]
+    }
+
+
+def response_text(result):
+    """Text of the first candidate in a generateContent response."""
+    return result["candidates"][0]["content"]["parts"][0]["text"]
+
+
+def price_from_response(result):
+    """Turns Gemini's price answer into the 'Estimate Price' line ('' if it names no THB price)."""
+    price_text = clean_text(response_text(result))
+
+    # Extract price
+    price_match = re.search(r'([\d,\.]+)\s*THB', price_text, re.IGNORECASE)
+    if price_match:
+        price_value = price_match.group(1).replace(",", "")
+        return f"Estimate Price (Approximate): ฿{price_value}"
+    else:
+        return ""
+
+
+
+def analyze_image_with_gemini(image_data, mime_type="image/jpeg"):
+    """Sends image to Gemini API for analysis (non-phone products)."""
     try:
-        #  Pass API key as a parameter
-        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY}, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        return clean_text(result["candidates"][0]["content"]["parts"][0]["text"])
-    except requests.exceptions.RequestException as e:
+        # Never hedged: a second copy of the image upload costs more than it saves
+        return gemini_post(identify_payload(image_data, mime_type), "identify", hedge=False)
+    except UPSTREAM_ERRORS as e:
+        print("Error calling Gemini API:", e)
+        return None
+
+
+
+@enrichment_cache.cached("usage", should_cache=is_cacheable_answer)
+def fetch_usage_with_gemini(product_name):
+    """Gets product usage from Gemini (fallback)."""
+    try:
+        return clean_text(response_text(gemini_post(usage_payload(product_name), "usage")))
+    except UPSTREAM_ERRORS as e:
         print(f"Error fetching product usage:", e)
         return "Not available."
 
+@enrichment_cache.cached("gemini_price", should_cache=is_cacheable_answer)
 def get_gemini_price(product_name):
     """
     Retrieves the price of a product from Gemini, given the product name.
     """
-    headers = {"Content-Type": "application/json"}
-    payload = {
+    try:
+        return price_from_response(gemini_post(price_payload(product_name), "price"))
+
+    except UPSTREAM_ERRORS as e:
+        print(f"Error fetching price from Gemini: {e}")
+        return "Error retrieving price from Gemini."
+    except Exception as e:
+        print(f"Error processing Gemini response: {e}")
+        return "Error processing Gemini's price response."
+
+
+# --- Structured Product Details ---
+# Gemini is asked once for a JSON object matching PRODUCT_SCHEMA. Follow-up calls are
+# only made for fields the answer leaves empty, so most scans take one round trip.
+GEMINI_STRUCTURED_OUTPUT = os.environ.get("PRODSCAN_GEMINI_STRUCTURED", "1") != "0"
+PRODUCT_TEXT_FIELDS = ("product_name", "brand", "brand_details", "release_date", "usage")
+PRODUCT_REQUIRED_FIELDS = ("product_name", "brand")
+PRODUCT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "product_name": {"type": "STRING", "description": "Full product name including model"},
+        "brand": {"type": "STRING"},
+        "brand_details": {"type": "STRING", "description": "Who owns the brand, in one short sentence"},
+        "release_date": {"type": "STRING", "description": "Release date, e.g. 'September 7, 2022'"},
+        "usage": {"type": "STRING", "description": "What the product is used for, in one short sentence"},
+        "price_thb": {"type": "NUMBER", "nullable": True,
+                      "description": "Typical retail price in Thailand in THB, null if unknown"},
+    },
+    "required": list(PRODUCT_REQUIRED_FIELDS),
+}
+
+
+def structured_identify_payload(image_data, mime_type="image/jpeg"):
+    """Identification prompt whose answer must be a PRODUCT_SCHEMA JSON object."""
+    return {
         "contents": [
             {
                 "role": "user",
                 "parts": [
-                    {"text": f"What is the price of {product_name} in Thailand, in THB?"}
+                    {"text": "Identify the product in this image. Give its product name, brand, brand details "
+                             "(brand owner), release date, what it is used for in one short sentence, and its "
+                             "typical retail price in Thailand in THB."},
+                    {"inline_data": {"mime_type": mime_type, "data": image_data}}
                 ]
             }
-        ]
+        ],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": PRODUCT_SCHEMA,
+        }
     }
+
+
+def analyze_image_structured(image_data, mime_type="image/jpeg"):
+    """Sends image to Gemini and asks for every product field as one JSON object."""
     try:
-        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY}, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        price_text = clean_text(result["candidates"][0]["content"]["parts"][0]["text"])
-
-        # Extract price
-        price_match = re.search(r'([\d,\.]+)\s*THB', price_text, re.IGNORECASE)
-        if price_match:
-            price_value = price_match.group(1).replace(",", "")
-            return f"Estimate Price (Approximate): ฿{price_value}"
-        else:
-            return ""
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching price from Gemini: {e}")
-        return "Error retrieving price from Gemini."
+        return gemini_post(structured_identify_payload(image_data, mime_type), "identify_structured", hedge=False)
+    except UPSTREAM_ERRORS as e:
+        print("Error calling Gemini API (structured):", e)
+        return None
+
+
+def parse_structured_product(response):
+    """Validates Gemini's JSON answer against PRODUCT_SCHEMA; raises ValueError if it doesn't fit."""
+    data = json.loads(response_text(response))
+    if not isinstance(data, dict):
+        raise ValueError("structured answer is not a JSON object")
+
+    details = {}
+    for field in PRODUCT_TEXT_FIELDS:
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"field '{field}' is not a string")
+        details[field] = clean_text(value) if value and value.strip() else None
+    for field in PRODUCT_REQUIRED_FIELDS:
+        if not details[field]:
+            raise ValueError(f"required field '{field}' is missing")
+
+    price = data.get("price_thb")
+    if isinstance(price, str):  # Tolerate "40,990" style strings
+        price_match = re.search(r'[\d,]+(?:\.\d+)?', price)
+        price = float(price_match.group(0).replace(",", "")) if price_match else None
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or price <= 0:
+        price = None
+    details["price_thb"] = price
+    return details
+
+
+def parse_product_text(detected_product):
+    """Scrapes the free-text Gemini answer into the same fields as parse_structured_product."""
+    details = {}
+    for field, label in (("product_name", "Product Name"), ("brand", "Brand"),
+                         ("brand_details", "Brand Details"), ("release_date", "Release Date"),
+                         ("usage", "Used for")):
+        match = re.search(label + r':\s*(.*?)\n', detected_product + '\n', re.DOTALL)
+        details[field] = clean_text(match.group(1)) if match else None
+    details["product_name"] = details["product_name"] or "Unknown"
+    details["brand"] = details["brand"] or "Unknown"
+    details["price_thb"] = None
+    return details
+
+
+def identify_product(image_data, mime_type="image/jpeg"):
+    """Returns product details for a base64 image, or None if Gemini gave no usable answer."""
+    if GEMINI_STRUCTURED_OUTPUT:
+        response = analyze_image_structured(image_data, mime_type)
+        if response:
+            try:
+                with stage_seconds.time(stage="parse"):
+                    return parse_structured_product(response)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Structured Gemini answer rejected, falling back to free text: {e}")
+
+    response = analyze_image_with_gemini(image_data, mime_type)
+    if not response:
+        return None
+    try:
+        with stage_seconds.time(stage="parse"):
+            return parse_product_text(response_text(response))
+    except (KeyError, IndexError, TypeError) as e:
+        print(f"Error extracting details (Gemini): {e}")
+        return None
+
+
+def format_release_date(raw_date):
+    """Formats 'September 7, 2022' as 09/07/2022, leaving other formats as cleaned text."""
+    if not raw_date:
+        return "Not available."
+    try:
+        return datetime.strptime(raw_date.strip(), "%B %d, %Y").strftime("%m/%d/%Y")
+    except ValueError:
+        return clean_text(raw_date)
+
+
+def format_gemini_price(price_thb):
+    """Same text get_gemini_price returns, built from a structured price."""
+    price_value = int(price_thb) if float(price_thb).is_integer() else price_thb
+    return f"Estimate Price (Approximate): ฿{price_value}"
+
+
+# --- Result Formatting ---
+PRICE_FALLBACK = "Error retrieving price from Gemini."
+USAGE_FALLBACK = "Not available."
+PENDING = "<i>Looking up...</i>"  # Placeholder for enrichments still in flight (streamed results)
+IDENTIFYING = "Not a phone. Identifying the product..."
+
+
+def marketplace_links(product_name, brand=None):
+    """Lazada and Shopee search links for the product."""
+    lazada_url, shopee_url = search_shopee_lazada_price(product_name, brand)
+    price_info = f"<a href='{lazada_url}' target='_blank'>Lazada - {product_name}</a>"
+    price_info += f"<br><a href='{shopee_url}' target='_blank'>Shopee - {product_name}</a>"
+    return price_info
+
+
+def product_scan(details, enrichments):
+    """Scan record of a product identified by Gemini, with any follow-up lookups filled in."""
+    if details["price_thb"] is not None:
+        gemini_price = format_gemini_price(details["price_thb"])
+    else:
+        gemini_price = enrichments["price"]
+    return {"product_name": details["product_name"], "brand": details["brand"],
+            "brand_details": details["brand_details"] or "Not available.",
+            "release_date": format_release_date(details["release_date"]),
+            "usage": details["usage"] or enrichments["usage"], "price": gemini_price}
+
+
+def phone_scan(brand, model_name, gemini_price):
+    """Scan record of a phone recognised by the local model."""
+    return {"product_name": model_name, "brand": brand, "price": gemini_price}
+
+
+def format_product_result(scan):
+    """HTML result card for a product identified by Gemini."""
+    price_info = marketplace_links(scan["product_name"]) + "<br>" + scan["price"]
+    return f"""
+                <b>Product Name:</b> {scan["product_name"]}<br>
+                <b>Brand:</b> {scan["brand"]}<br>
+                <b>Brand Details:</b> {scan["brand_details"]}<br>
+                <b>Release Date:</b> {scan["release_date"]}<br>
+                <b>What is it used for?</b> {scan["usage"]}<br>
+                <b>Price Information:</b><br>{price_info}
+                """
+
+
+def format_phone_result(brand, model_name, confidence, gemini_price):
+    """HTML result card for a phone recognised by the local model."""
+    price_info = marketplace_links(model_name, brand) + "<br>" + gemini_price
+    return f"""
+        <b>Product Name:</b> {model_name}<br>
+        <b>Brand:</b> {brand}<br>
+        <b>Confidence:</b> {confidence:.2f}<br>
+        <b>Price Information:</b><br>{price_info}
+        """
+
+
+def missing_enrichments(details):
+    """Which follow-up lookups ('price', 'usage') a Gemini product record still needs."""
+    needed = []
+    if details["price_thb"] is None:
+        needed.append("price")
+    if not details["usage"]:
+        needed.append("usage")
+    return needed
+
+
+# --- Scan Cache Helpers ---
+def frame_hash(image_data):
+    """Perceptual hash of the uploaded frame, or None if it cannot be decoded."""
+    try:
+        return perceptual_hash(image_data)
     except Exception as e:
-        print(f"Error processing Gemini response: {e}")
-        return "Error processing Gemini's price response."
+        print(f"Error hashing frame: {e}")
+        return None
+
+
+def cache_result(phash, message, scan):
+    """Records the scan and remembers its result for near-identical frames; returns the "done" event.
+
+    Degraded results (a lookup fell back to placeholder text) are not cached, so the next
+    scan of the item asks again once the upstream recovers.
+    """
+    scan_writer.record(scan)
+    if phash is not None and not is_degraded(scan):
+        scan_cache.put(phash, {"message": message, "scan": scan})
+    return {"event": "done", "message": message}
+
+
+def cached_event(cached):
+    """The "done" event for a scan-cache hit; the repeat scan still goes into the history."""
+    if cached.get("scan"):
+        scan_writer.record(cached["scan"])
+    return {"event": "done", "message": cached["message"]}
 
 
 # --- Prediction Function ---
+def catalog_label(label):
+    """(brand, model_name) of a catalog label; labels follow the 'brand_model' directory names."""
+    return split_class_label(label) if "_" in label else ("Unknown", label)
+
+
+def classify_prediction(predictions):
+    """Maps one predictor row (class probabilities, then the catalog match if there is a
+    catalog) to (product_type, brand, model_name, confidence)."""
+    num_classes = len(bundle.class_labels)
+    probabilities = predictions[:num_classes]
+    predicted_class_index = np.argmax(probabilities)
+
+    # Labels come from the bundle loaded at startup; no filesystem access per scan
+    brand, model_name = bundle.class_table[predicted_class_index]
+    confidence = np.max(probabilities)
+
+    if confidence > CLASSIFIER_MIN_CONFIDENCE:
+        return "phone", brand, model_name, confidence
+    if len(predictions) > num_classes:
+        score, row_id = predictions[num_classes], int(predictions[num_classes + 1])
+        if row_id >= 0 and score >= CATALOG_MIN_SCORE:
+            brand, model_name = catalog_label(catalog.labels_of([row_id])[0])
+            return "catalog", brand, model_name, float(score)
+    return "not_phone", "Unknown", "Unknown", 0.0
+
+
 def predict_product(image_data):
     """Predicts if the image is a phone, and if so, the brand and model."""
     try:
-        img = Image.open(BytesIO(image_data)).convert("RGB")
-        img = img.resize(IMAGE_SIZE)
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array /= 255.
-
-        predictions = model.predict(img_array)
-        predicted_class_index = np.argmax(predictions[0])
-
-        # --- CORRECTED: Use DATA_DIR to find the 'train' directory ---
-        train_data_dir = os.path.join(DATA_DIR, "train")  # Corrected path
-        class_labels = sorted([d for d in os.listdir(train_data_dir)
-                               if os.path.isdir(os.path.join(train_data_dir, d))])
-        predicted_class = class_labels[predicted_class_index]
-
-        brand, model_name = predicted_class.split("_", 1)
-        model_name = model_name.replace("_", " ")
-        confidence = np.max(predictions[0])
-
-        if confidence > 0.6:
-            return "phone", brand, model_name, confidence
-        else:
-            return "not_phone", "Unknown", "Unknown", 0.0
+        img_array = preprocessor.buffers.acquire()
+        try:
+            with stage_seconds.time(stage="preprocess"):
+                preprocessor.run(image_data, img_array)
+        except Exception:
+            preprocessor.buffers.release(img_array)
+            raise
 
+        # Queued and run together with any other scans arriving at the same time. The
+        # buffer only goes back to the pool once its batch has run (not after a timeout).
+        with stage_seconds.time(stage="predict"):
+            try:
+                predictions = predictor.predict(img_array, timeout=PREDICT_TIMEOUT)
+            except QueueFull:
+                preprocessor.buffers.release(img_array)  # Never queued, so no batch holds it
+                raise
+        preprocessor.buffers.release(img_array)
+        return classify_prediction(predictions)
+
+    except QueueFull as e:
+        print(f"Scan turned away: {e}")
+        return "busy", "Unknown", "Unknown", 0.0
     except Exception as e:
         print(f"Error during prediction: {e}")
         return "error", "Unknown", "Unknown", 0.0
 
 
+# Started here, after everything warm_up uses is defined
+if PREFORK:
+    pass  # prefork.py calls load_model() in each worker, before the worker accepts connections
+elif STARTUP_MODE == "eager":
+    load_model()
+else:
+    threading.Thread(target=load_model, name="model-loader", daemon=True).start()
+
+
+# --- Metrics Collectors ---
+# Rendered from each component's stats() at scrape time, so the hot paths pay nothing extra.
+def inference_metrics():
+    if predictor is None:
+        return []
+    stats = predictor.stats()
+    sizes = range(1, stats["max_batch_size"] + 1)
+    counts = [stats["batch_size_histogram"].get(str(size), 0) for size in sizes] + [0]
+    return (family("prodscan_batch_size", "histogram", "Images per inference batch.", [])
+            + histogram_samples("prodscan_batch_size", {}, sizes, counts, stats["items"])
+            + family("prodscan_inference_queue_depth", "gauge", "Images waiting for an inference batch.",
+                     [({}, stats["queue_depth"])])
+            + family("prodscan_inference_errors_total", "counter", "Inference batches that raised.",
+                     [({}, stats["errors"])])
+            + family("prodscan_inference_rejected_total", "counter", "Scans turned away by a full inference queue.",
+                     [({}, stats["rejected"])]))
+
+
+def cache_metrics():
+    scan_stats = scan_cache.stats()
+    field_stats = enrichment_cache.stats()
+    events, ratios = [], [({"cache": "scan", "field": ""}, scan_stats["hit_rate"])]
+    for name in sorted(scan_stats):
+        if name not in ("size", "hit_rate"):
+            events.append(({"cache": "scan", "field": "", "event": name}, scan_stats[name]))
+    for field, counters in sorted(field_stats.items()):
+        ratios.append(({"cache": "enrichment", "field": field}, counters.pop("hit_rate")))
+        events.extend(({"cache": "enrichment", "field": field, "event": name}, count)
+                      for name, count in sorted(counters.items()))
+    return (family("prodscan_cache_events_total", "counter", "Cache hits by tier, misses, evictions and refreshes.", events)
+            + family("prodscan_cache_hit_ratio", "gauge", "Hits over lookups since start.", ratios)
+            + family("prodscan_cache_entries", "gauge", "Entries held in memory.",
+                     [({"cache": "scan"}, scan_stats["size"])]))
+
+
+def coalescing_metrics():
+    stats = enrichment_cache.flights.stats()
+    waiters = []
+    for field, counters in sorted(stats.items()):
+        waiters.extend(histogram_samples("prodscan_coalesced_waiters", {"enrichment": field}, WAITER_BUCKETS,
+                                         counters["waiters"], counters["coalesced"]))
+    return (family("prodscan_coalesced_calls_total", "counter",
+                   "Enrichment lookups that went upstream, and those of them that raised.",
+                   [({"enrichment": field, "outcome": outcome}, counters[key]) for field, counters in sorted(stats.items())
+                    for outcome, key in (("made", "calls"), ("error", "errors"))])
+            + family("prodscan_coalesced_lookups_total", "counter",
+                     "Enrichment lookups that waited for an identical call in flight instead of making their own.",
+                     [({"enrichment": field}, counters["coalesced"]) for field, counters in sorted(stats.items())])
+            + family("prodscan_coalesced_in_flight", "gauge", "Enrichment calls in flight, and lookups waiting on them.",
+                     [({"enrichment": field, "kind": kind}, counters[kind]) for field, counters in sorted(stats.items())
+                      for kind in ("in_flight", "waiting")])
+            + family("prodscan_coalesced_waiters", "histogram", "Lookups that shared each upstream call.", [])
+            + waiters)
+
+
+def scan_writer_metrics():
+    stats = scan_writer.stats()
+    return (family("prodscan_scan_writer_events_total", "counter", "Scan history rows written or dropped, batches and errors.",
+                   [({"event": name}, stats[name]) for name in ("written", "batches", "dropped", "errors")])
+            + family("prodscan_scan_writer_queued", "gauge", "Scan rows waiting for the history writer.",
+                     [({}, stats["queued"])]))
+
+
+def boot_metrics():
+    return family("prodscan_boot_seconds", "gauge", "Seconds spent in each startup phase.",
+                  [({"phase": phase}, seconds) for phase, seconds in boot_times.items()])
+
+
+def upstream_metrics():
+    stats = {name: upstream.stats() for name, upstream in upstreams.items()}
+    states = [({"service": name, "state": state}, int(service["state"] == state))
+              for name, service in stats.items() for state in ("closed", "open", "half_open")]
+    return (family("prodscan_circuit_state", "gauge", "1 for the current circuit breaker state of each upstream.", states)
+            + family("prodscan_circuit_events_total", "counter", "Times each circuit opened, and calls it rejected.",
+                     [({"service": name, "event": event}, service[event])
+                      for name, service in stats.items() for event in ("opened", "rejected")])
+            + family("prodscan_upstream_hedges_total", "counter", "Hedged second attempts sent, and those that answered first.",
+                     [({"service": name, "outcome": outcome}, service[key])
+                      for name, service in stats.items() for outcome, key in (("sent", "hedged"), ("won", "hedge_wins"))]))
+
+
+def process_metrics():
+    memory = process_memory()
+    return family("prodscan_process_memory_bytes", "gauge",
+                  "Memory of this worker process: rss, pss (shared pages split among sharers), uss (private), shared.",
+                  [({"kind": kind}, value) for kind, value in memory.items()])
+
+
+metrics.add_collector(boot_metrics)
+metrics.add_collector(process_metrics)
+metrics.add_collector(inference_metrics)
+metrics.add_collector(cache_metrics)
+metrics.add_collector(scan_writer_metrics)
+metrics.add_collector(coalescing_metrics)
+metrics.add_collector(upstream_metrics)
+
+
 
 # --- Flask Routes ---
 @app.route('/')
@@ -241,89 +928,227 @@ def index():
 
 
 
-@app.route('/scan', methods=['POST'])
-def scan_product():
-    """Handles the image upload and prediction."""
-    data = request.get_json()
-    if not data or 'image' not in data:
-        return jsonify({"message": "Error: No image data received."}), 400
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"message": f"Error: Image larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}), 413
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok", "uptime_s": time.perf_counter() - BOOT_STARTED})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once the model is loaded and warmed up, 503 while loading or after a failure."""
+    body = {"status": model_state, "startup_mode": STARTUP_MODE, "boot_s": boot_times}
+    return jsonify(body), 200 if model_state == "ready" else 503
+
+
+def model_loading_response():
+    """503 for scans that arrive before the model is ready, as /readyz reports (None once it is)."""
+    if model_state == "ready":
+        return None
+    if model_state == "failed":
+        return jsonify({"message": "Error: Scanner model failed to load."}), 503
+    return jsonify({"message": "Error: Scanner is starting up, try again shortly."}), 503, {"Retry-After": "1"}
+
+
+def note_first_scan():
+    """Reports time from process start to the first scan response, once."""
+    if "first_scan" not in boot_times:
+        boot_times["first_scan"] = time.perf_counter() - BOOT_STARTED
+        print(f"First scan answered {boot_times['first_scan']:.2f}s after start")
+
+
+
+@app.route('/inference/stats')
+def inference_stats():
+    """Reports batch-size and queue-depth histograms of the inference scheduler."""
+    if predictor is None:
+        return jsonify({"message": "Error: Model not loaded."}), 503
+    return jsonify(predictor.stats())
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Reports hit/miss counters of the perceptual-hash scan cache."""
+    return jsonify(scan_cache.stats())
+
+
+@app.route('/enrichment/stats')
+def enrichment_stats():
+    """Reports per-field hit/miss counters of the enrichment answer cache."""
+    return jsonify(enrichment_cache.stats())
+
+
+@app.route('/coalescing/stats')
+def coalescing_stats():
+    """Reports, per enrichment, upstream calls made and how many lookups shared one instead."""
+    return jsonify(enrichment_cache.flights.stats())
+
+
+
+@app.route('/scans')
+def list_scans():
+    """Scan history, newest first. Filters: product_name, brand, since, until; paging: limit, cursor."""
+    try:
+        query = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+    return jsonify(history_reader.page(**query))
+
+
+@app.route('/scans/stats')
+def scans_stats():
+    """Reports written/dropped counters and queue depth of the scan history writer."""
+    return jsonify(scan_writer.stats())
+
+
+@app.route('/upstream/stats')
+def upstream_stats():
+    """Reports circuit breaker state and hedging counters of the Gemini and Google Search clients."""
+    return jsonify({name: upstream.stats() for name, upstream in upstreams.items()})
+
 
-    image_data = base64.b64decode(data['image'].split(',')[1])
+@app.route('/catalog/stats')
+def catalog_stats():
+    """Reports the size and kind of the catalog index, and the match thresholds."""
+    return jsonify(catalog_report())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latencies, upstream outcomes, batching, cache and in-flight metrics for Prometheus."""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+
+# --- Scan Events ---
+def error_event(message, status):
+    return {"event": "error", "message": message, "status": status}
+
+
+def identify_failed_event():
+    """Error event for a scan Gemini could not identify: 503 while its circuit is open."""
+    if upstreams["gemini"].breaker.state == "open":
+        return error_event("Error: Product lookup is temporarily unavailable. Try again shortly.", 503)
+    return error_event("Error: Could not get a response from Gemini API. Try again.", 500)
+
+
+def scan_events(upload, endpoint="scan"):
+    """Runs one scan, yielding {"event", "message"} dicts as each part of the answer is known.
+
+    Each message is the whole result card so far, with PENDING where a lookup is still
+    running. The last event is "done" (the final card, also cached and recorded) or
+    "error" (with the HTTP status /scan answers with).
+    """
+    started = time.perf_counter()
+    outcome = "aborted"  # Client went away before the last event
+    in_flight.inc(endpoint=endpoint)
+    try:
+        for event in _scan_events(upload, Budget(SCAN_BUDGET)):
+            outcome = event["event"]
+            yield event
+    finally:
+        in_flight.dec(endpoint=endpoint)
+        scan_seconds.observe(time.perf_counter() - started, endpoint=endpoint, outcome=outcome)
+
+
+def _scan_events(upload, budget):
+    image_data = upload.data
+
+    # Repeated scans of the same item skip inference and Gemini entirely
+    with stage_seconds.time(stage="hash"):
+        phash = frame_hash(image_data)
+    if phash is not None:
+        with stage_seconds.time(stage="cache"):
+            cached = scan_cache.get(phash)
+        if cached is not None:
+            yield cached_event(cached)
+            return
 
     product_type, brand, model_name, confidence = predict_product(image_data)
 
     if product_type == "error":
-        return jsonify({"message": "Error: Could not process the image."}), 500
+        yield error_event("Error: Could not process the image.", 500)
+    elif product_type == "busy":
+        yield error_event("Error: Scanner is busy, try again shortly.", 503)
     elif product_type == "not_phone":
-        response = analyze_image_with_gemini(base64.b64encode(image_data).decode('utf-8'))
-        if not response:
-            return jsonify({"message": "Error: Could not get a response from Gemini API. Try again."}), 500
+        yield {"event": "classified", "message": IDENTIFYING}
+        # JSON uploads hand Gemini their original base64 text; no decode/re-encode round trip
+        with stage_seconds.time(stage="identify"):
+            details = budget.run(identify_product, upload.b64, upload.mime_type)
+        if not details:
+            yield identify_failed_event()
+            return
 
         try:
-            detected_product = response["candidates"][0]["content"]["parts"][0]["text"]
-            product_name_match = re.search(r'Product Name:\s*(.*?)\n', detected_product, re.DOTALL)
-            product_name = clean_text(product_name_match.group(1)) if product_name_match else "Unknown"
-
-            brand_match = re.search(r'Brand:\s*(.*?)\n', detected_product, re.DOTALL)
-            brand = clean_text(brand_match.group(1)) if brand_match else "Unknown"
-
-            brand_details_match = re.search(r'Brand Details:\s*(.*?)\n', detected_product, re.DOTALL)
-            brand_details = clean_text(brand_details_match.group(1)) if brand_details_match else "Not available."
-
-            release_date_match = re.search(r'Release Date:\s*(.*?)\n', detected_product, re.DOTALL)
-
-            if release_date_match:
-                raw_date = release_date_match.group(1).strip()
-                try:
-                    # Attempt to parse the date
-                    formatted_date = datetime.strptime(raw_date, "%B %d, %Y").strftime("%m/%d/%Y")
-                except ValueError:
-                    # If parsing fails, just clean the text
-                    formatted_date = clean_text(raw_date)
-            else:
-                formatted_date = "Not available."
-            usage_match = re.search(r'Used for:\s*(.*?)\n', detected_product + '\n', re.DOTALL)
-            usage = clean_text(usage_match.group(1)) if usage_match else "Not available."
-
-            if usage == "Not available.":
-                usage = fetch_usage_with_gemini(product_name)
-
-            price_info = ""
-            lazada_url, shopee_url = search_shopee_lazada_price(product_name)
-            price_info += f"<a href='{lazada_url}' target='_blank'>Lazada - {product_name}</a>"
-            price_info += f"<br><a href='{shopee_url}' target='_blank'>Shopee - {product_name}</a>"
-            gemini_price = get_gemini_price(product_name)
-            price_info += "<br>" + gemini_price
-
-            formatted_result = f"""
-                <b>Product Name:</b> {product_name}<br>
-                <b>Brand:</b> {brand}<br>
-                <b>Brand Details:</b> {brand_details}<br>
-                <b>Release Date:</b> {formatted_date}<br>
-                <b>What is it used for?</b> {usage}<br>
-                <b>Price Information:</b><br>{price_info}
-                """
-            return jsonify({"message": formatted_result})
-
+            # Follow up only on what the first answer left out; usage and price concurrently
+            lookups = {"price": (get_gemini_price, (details["product_name"],), PRICE_FALLBACK),
+                       "usage": (fetch_usage_with_gemini, (details["product_name"],), USAGE_FALLBACK)}
+            enrichments = {name: PENDING for name in missing_enrichments(details)}
+            yield {"event": "identified", "message": format_product_result(product_scan(details, enrichments))}
+            enrich_started = time.perf_counter()
+            for name, value in iter_enrichments({name: lookups[name] for name in enrichments}, budget=budget):
+                enrichments[name] = value
+                yield {"event": name, "message": format_product_result(product_scan(details, enrichments))}
+            stage_seconds.observe(time.perf_counter() - enrich_started, stage="enrich")
+            scan = product_scan(details, enrichments)
+            message = format_product_result(scan)
         except Exception as e:
             print(f"Error extracting details (Gemini): {e}")
-            return jsonify({"message": "Error: Could not extract product details."}), 500
+            yield error_event("Error: Could not extract product details.", 500)
+            return
+        yield cache_result(phash, message, scan)
 
-    else:  # It's a phone
-        price_info = ""
-        lazada_url, shopee_url = search_shopee_lazada_price(model_name, brand)
-        price_info += f"<a href='{lazada_url}' target='_blank'>Lazada - {model_name}</a>"
-        price_info += f"<br><a href='{shopee_url}' target='_blank'>Shopee - {model_name}</a>"
-        gemini_price = get_gemini_price(model_name)
-        price_info += "<br>" + gemini_price
+    else:  # A phone or catalog product: the local result goes out before the price lookup finishes
+        yield {"event": "identified", "message": format_phone_result(brand, model_name, confidence, PENDING)}
+        with stage_seconds.time(stage="enrich"):
+            gemini_price = run_enrichments({"price": (get_gemini_price, (model_name,), PRICE_FALLBACK)},
+                                           budget=budget)["price"]
+        yield cache_result(phash, format_phone_result(brand, model_name, confidence, gemini_price),
+                           phone_scan(brand, model_name, gemini_price))
 
-        formatted_result = f"""
-        <b>Product Name:</b> {model_name}<br>
-        <b>Brand:</b> {brand}<br>
-        <b>Confidence:</b> {confidence:.2f}<br>
-        <b>Price Information:</b><br>{price_info}
-        """
-        return jsonify({"message": formatted_result})
+
+@app.route('/scan', methods=['POST'])
+def scan_product():
+    """Handles the image upload (raw image, multipart or JSON data URL) and prediction."""
+    loading = model_loading_response()
+    if loading:
+        return loading
+    try:
+        with stage_seconds.time(stage="upload"):
+            upload = read_scan_upload(request)
+            upload.data  # Decode base64 uploads here, so bad input is a 400 before any event
+    except UploadError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+
+    for event in scan_events(upload):
+        pass  # Only the final card is returned
+    note_first_scan()
+    if event["event"] == "error":
+        return jsonify({"message": event["message"]}), event["status"]
+    return jsonify({"message": event["message"]})
+
+
+@app.route('/scan/stream', methods=['POST'])
+def scan_product_stream():
+    """Streaming /scan: newline-delimited JSON events, each sent as soon as it is known."""
+    loading = model_loading_response()
+    if loading:
+        return loading
+    try:
+        with stage_seconds.time(stage="upload"):
+            upload = read_scan_upload(request)
+            upload.data  # Decode base64 uploads here, so bad input is a 400 before any event
+    except UploadError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+
+    note_first_scan()
+    return Response((json.dumps(event) + "\n" for event in scan_events(upload, "scan_stream")),
+                    mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=2502, debug=True)
@@ -0,0 +1,453 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from quart import Quart, Response, render_template, request, jsonify
+
+import web  # predictor and preprocessor appear once web.py's model loader has warmed them up
+from web import (GEMINI_API_KEY, GEMINI_API_URL, GEMINI_HEADERS, GEMINI_STRUCTURED_OUTPUT,
+                 ENRICHMENT_DEADLINE, PREDICT_TIMEOUT, PRICE_FALLBACK, USAGE_FALLBACK, PENDING, IDENTIFYING,
+                 BOOT_STARTED, STARTUP_MODE, boot_times, note_first_scan, scan_cache, scan_writer, history_reader, enrichment_cache,
+                 clean_text, response_text, identify_payload, structured_identify_payload,
+                 usage_payload, price_payload, price_from_response, parse_structured_product,
+                 parse_product_text, classify_prediction, frame_hash, missing_enrichments,
+                 product_scan, phone_scan, format_product_result, format_phone_result, error_event,
+                 identify_failed_event, upstreams, SCAN_BUDGET,
+                 metrics, stage_seconds, scan_seconds, upstream_requests, upstream_seconds, enrichment_results,
+                 in_flight)
+from inference import QueueFull
+from metrics import CONTENT_TYPE, track_upstream
+from prodscan_common.resilience import Budget, UpstreamUnavailable, is_cacheable_answer, is_degraded
+from prodscan_common.scan_history import parse_history_args
+from prodscan_common.uploads import MAX_UPLOAD_BYTES, UploadError, read_scan_upload_async
+
+# Async serving mode of web.py: same '/' and '/scan' contract, one event loop per process.
+# Outbound Gemini calls are awaited on a shared httpx client, frame decoding/hashing runs on
+# a small thread pool, and inference waits on the batching predictor without holding a
+# thread. Model, caches and result formatting are imported from web.py (loaded once).
+#
+#     hypercorn web_async:app --bind 0.0.0.0:2502
+
+app = Quart(__name__, static_folder="static")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES  # Larger uploads get a 413
+
+# --- Concurrency ---
+# Scans beyond MAX_IN_FLIGHT wait up to ADMISSION_TIMEOUT seconds for a slot, then get a 503.
+MAX_IN_FLIGHT = int(os.environ.get("PRODSCAN_MAX_IN_FLIGHT", 256))
+ADMISSION_TIMEOUT = float(os.environ.get("PRODSCAN_ADMISSION_TIMEOUT", 10))
+CPU_WORKERS = int(os.environ.get("PRODSCAN_CPU_WORKERS", 0)) or min(8, os.cpu_count() or 1)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("PRODSCAN_HTTP_MAX_CONNECTIONS", 100))
+
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="scan-cpu")
+client = None  # httpx.AsyncClient, opened with the event loop
+admission = None  # asyncio.Semaphore(MAX_IN_FLIGHT)
+admission_rejections = metrics.counter(
+    "prodscan_admission_rejections_total", "Scans turned away with a 503 after waiting ADMISSION_TIMEOUT.")
+
+
+@app.before_serving
+async def open_client():
+    global client, admission
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(15.0, connect=3.05),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_CONNECTIONS))
+    admission = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+
+
+async def run_in_cpu_pool(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, function, *args)
+
+
+# --- Gemini Requests ---
+UPSTREAM_ERRORS = (httpx.HTTPError, UpstreamUnavailable)
+
+
+async def gemini_post(payload, call, hedge=True):
+    """Async web.gemini_post, through the same "gemini" Upstream (budget, breaker, hedging)."""
+    async def send(timeout):
+        connect, read = timeout
+        with track_upstream(upstream_requests, upstream_seconds, "gemini", call):
+            response = await client.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY}, json=payload,
+                                         headers=GEMINI_HEADERS, timeout=httpx.Timeout(read, connect=connect))
+            response.raise_for_status()
+            return response.json()
+    return await upstreams["gemini"].acall(send, hedge=hedge)
+
+
+async def identify_product(image_data, mime_type="image/jpeg"):
+    """Async web.identify_product: structured answer first, free text as the fallback."""
+    if GEMINI_STRUCTURED_OUTPUT:
+        try:
+            response = await gemini_post(structured_identify_payload(image_data, mime_type), "identify_structured",
+                                         hedge=False)
+            with stage_seconds.time(stage="parse"):
+                return parse_structured_product(response)
+        except UPSTREAM_ERRORS as e:
+            print("Error calling Gemini API (structured):", e)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            print(f"Structured Gemini answer rejected, falling back to free text: {e}")
+
+    try:
+        response = await gemini_post(identify_payload(image_data, mime_type), "identify", hedge=False)
+    except UPSTREAM_ERRORS + (ValueError,) as e:  # ValueError: body was not JSON
+        print("Error calling Gemini API:", e)
+        return None
+    try:
+        with stage_seconds.time(stage="parse"):
+            return parse_product_text(response_text(response))
+    except (KeyError, IndexError, TypeError) as e:
+        print(f"Error extracting details (Gemini): {e}")
+        return None
+
+
+async def fetch_usage_with_gemini(product_name):
+    """Gets product usage from Gemini (fallback), through the enrichment cache."""
+    async def fetch():
+        try:
+            return clean_text(response_text(await gemini_post(usage_payload(product_name), "usage")))
+        except UPSTREAM_ERRORS + (ValueError,) as e:
+            print(f"Error fetching product usage:", e)
+            return USAGE_FALLBACK
+    return await enrichment_cache.aget_or_fetch("usage", product_name, fetch, is_cacheable_answer)
+
+
+async def get_gemini_price(product_name):
+    """Gets the THB price estimate from Gemini, through the enrichment cache."""
+    async def fetch():
+        try:
+            return price_from_response(await gemini_post(price_payload(product_name), "price"))
+        except UPSTREAM_ERRORS + (ValueError,) as e:
+            print(f"Error fetching price from Gemini: {e}")
+            return PRICE_FALLBACK
+        except Exception as e:
+            print(f"Error processing Gemini response: {e}")
+            return "Error processing Gemini's price response."
+    return await enrichment_cache.aget_or_fetch("gemini_price", product_name, fetch, is_cacheable_answer)
+
+
+async def iter_enrichments(calls, deadline=ENRICHMENT_DEADLINE, budget=None):
+    """Awaits {name: (coroutine, fallback)} together, yielding (name, result) as each finishes."""
+    loop = asyncio.get_running_loop()
+    if budget is not None:
+        deadline = min(deadline, budget.remaining())
+        calls = {name: (budget.arun(coroutine), fallback) for name, (coroutine, fallback) in calls.items()}
+    tasks = {asyncio.ensure_future(coroutine): name for name, (coroutine, fallback) in calls.items()}
+    end = loop.time() + deadline
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=max(0.0, end - loop.time()),
+                                           return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            break
+        for task in done:
+            name = tasks[task]
+            if task.exception() is not None:
+                print(f"Enrichment '{name}' failed: {task.exception()}")
+                enrichment_results.inc(enrichment=name, outcome="failed")
+                yield name, calls[name][1]
+            else:
+                enrichment_results.inc(enrichment=name, outcome="ok")
+                yield name, task.result()
+    for task in pending:
+        print(f"Enrichment '{tasks[task]}' missed its {deadline}s deadline")
+        enrichment_results.inc(enrichment=tasks[task], outcome="deadline")
+        task.cancel()
+        yield tasks[task], calls[tasks[task]][1]
+
+
+async def run_enrichments(calls, deadline=ENRICHMENT_DEADLINE, budget=None):
+    """Awaits {name: (coroutine, fallback)} together under one shared deadline."""
+    return {name: value async for name, value in iter_enrichments(calls, deadline, budget)}
+
+
+# --- Prediction Function ---
+async def predict_product(image_data):
+    """Async web.predict_product: decode on the CPU pool, then await the batched forward pass."""
+    try:
+        predictor, preprocessor = web.predictor, web.preprocessor
+        img_array = preprocessor.buffers.acquire()
+        try:
+            with stage_seconds.time(stage="preprocess"):
+                await run_in_cpu_pool(preprocessor.preprocess_into, image_data, img_array)
+        except Exception:
+            preprocessor.buffers.release(img_array)
+            raise
+
+        # shield: a timed-out or disconnected scan must not cancel the batcher's future.
+        # As in web.py, the buffer is only released once its batch has actually run.
+        with stage_seconds.time(stage="predict"):
+            try:
+                future = predictor.submit(img_array)  # Never blocks: a full queue raises QueueFull
+            except QueueFull:
+                preprocessor.buffers.release(img_array)
+                raise
+            predictions = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), PREDICT_TIMEOUT)
+        preprocessor.buffers.release(img_array)
+        return classify_prediction(predictions)
+
+    except QueueFull as e:
+        print(f"Scan turned away: {e}")
+        return "busy", "Unknown", "Unknown", 0.0
+    except Exception as e:
+        print(f"Error during prediction: {e!r}")
+        return "error", "Unknown", "Unknown", 0.0
+
+
+async def cache_result(phash, message, scan):
+    """Records the scan and remembers its result for near-identical frames; returns the "done" event."""
+    scan_writer.record(scan, block=False)  # Never stall the event loop on a full queue
+    if phash is not None and not is_degraded(scan):
+        await run_in_cpu_pool(scan_cache.put, phash, {"message": message, "scan": scan})
+    return {"event": "done", "message": message}
+
+
+def cached_event(cached):
+    """The "done" event for a scan-cache hit; the repeat scan still goes into the history."""
+    if cached.get("scan"):
+        scan_writer.record(cached["scan"], block=False)
+    return {"event": "done", "message": cached["message"]}
+
+
+# --- Scan Events ---
+async def scan_events(upload, endpoint="scan"):
+    """Async web.scan_events: the scan's result card, re-sent as each part of it is known."""
+    started = asyncio.get_running_loop().time()
+    outcome = "aborted"  # Client went away before the last event
+    in_flight.inc(endpoint=endpoint)
+    try:
+        async for event in _scan_events(upload, Budget(SCAN_BUDGET)):
+            outcome = event["event"]
+            yield event
+    finally:
+        in_flight.dec(endpoint=endpoint)
+        scan_seconds.observe(asyncio.get_running_loop().time() - started, endpoint=endpoint, outcome=outcome)
+
+
+async def _scan_events(upload, budget):
+    image_data = upload.data
+
+    # Repeated scans of the same item skip inference and Gemini entirely
+    with stage_seconds.time(stage="hash"):
+        phash = await run_in_cpu_pool(frame_hash, image_data)
+    if phash is not None:
+        with stage_seconds.time(stage="cache"):
+            cached = await run_in_cpu_pool(scan_cache.get, phash)
+        if cached is not None:
+            yield cached_event(cached)
+            return
+
+    product_type, brand, model_name, confidence = await predict_product(image_data)
+
+    if product_type == "error":
+        yield error_event("Error: Could not process the image.", 500)
+    elif product_type == "busy":
+        yield error_event("Error: Scanner is busy, try again shortly.", 503)
+    elif product_type == "not_phone":
+        yield {"event": "classified", "message": IDENTIFYING}
+        with stage_seconds.time(stage="identify"):
+            details = await budget.arun(identify_product(upload.b64, upload.mime_type))
+        if not details:
+            yield identify_failed_event()
+            return
+
+        try:
+            lookups = {"price": (get_gemini_price, PRICE_FALLBACK), "usage": (fetch_usage_with_gemini, USAGE_FALLBACK)}
+            enrichments = {name: PENDING for name in missing_enrichments(details)}
+            yield {"event": "identified", "message": format_product_result(product_scan(details, enrichments))}
+            calls = {name: (lookups[name][0](details["product_name"]), lookups[name][1]) for name in enrichments}
+            enrich_started = asyncio.get_running_loop().time()
+            async for name, value in iter_enrichments(calls, budget=budget):
+                enrichments[name] = value
+                yield {"event": name, "message": format_product_result(product_scan(details, enrichments))}
+            stage_seconds.observe(asyncio.get_running_loop().time() - enrich_started, stage="enrich")
+            scan = product_scan(details, enrichments)
+            message = format_product_result(scan)
+        except Exception as e:
+            print(f"Error extracting details (Gemini): {e}")
+            yield error_event("Error: Could not extract product details.", 500)
+            return
+        yield await cache_result(phash, message, scan)
+
+    else:  # A phone or catalog product: the local result goes out before the price lookup finishes
+        yield {"event": "identified", "message": format_phone_result(brand, model_name, confidence, PENDING)}
+        with stage_seconds.time(stage="enrich"):
+            gemini_price = (await run_enrichments({"price": (get_gemini_price(model_name), PRICE_FALLBACK)},
+                                                  budget=budget))["price"]
+        yield await cache_result(phash, format_phone_result(brand, model_name, confidence, gemini_price),
+                                 phone_scan(brand, model_name, gemini_price))
+
+
+# --- Quart Routes ---
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+
+@app.errorhandler(413)
+async def upload_too_large(e):
+    return jsonify({"message": f"Error: Image larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}), 413
+
+
+@app.route('/healthz')
+async def healthz():
+    """Liveness: the event loop is up and serving requests."""
+    return jsonify({"status": "ok", "uptime_s": time.perf_counter() - BOOT_STARTED})
+
+
+@app.route('/readyz')
+async def readyz():
+    """Readiness: 200 once web.py's model is loaded and warmed up."""
+    body = {"status": web.model_state, "startup_mode": STARTUP_MODE, "boot_s": boot_times}
+    return jsonify(body), 200 if web.model_state == "ready" else 503
+
+
+def model_loading_response():
+    if web.model_state == "ready":
+        return None
+    if web.model_state == "failed":
+        return jsonify({"message": "Error: Scanner model failed to load."}), 503
+    return jsonify({"message": "Error: Scanner is starting up, try again shortly."}), 503, {"Retry-After": "1"}
+
+
+@app.route('/inference/stats')
+async def inference_stats():
+    """Reports batch-size and queue-depth histograms of the inference scheduler."""
+    if web.predictor is None:
+        return jsonify({"message": "Error: Model not loaded."}), 503
+    return jsonify(web.predictor.stats())
+
+
+@app.route('/cache/stats')
+async def cache_stats():
+    """Reports hit/miss counters of the perceptual-hash scan cache."""
+    return jsonify(scan_cache.stats())
+
+
+@app.route('/enrichment/stats')
+async def enrichment_stats():
+    """Reports per-field hit/miss counters of the enrichment answer cache."""
+    return jsonify(enrichment_cache.stats())
+
+
+@app.route('/coalescing/stats')
+async def coalescing_stats():
+    """Reports, per enrichment, upstream calls made and how many lookups shared one instead."""
+    return jsonify(enrichment_cache.flights.stats())
+
+
+@app.route('/scans')
+async def list_scans():
+    """Scan history, newest first. Filters: product_name, brand, since, until; paging: limit, cursor."""
+    try:
+        query = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+    page = await asyncio.get_running_loop().run_in_executor(None, lambda: history_reader.page(**query))
+    return jsonify(page)
+
+
+@app.route('/scans/stats')
+async def scans_stats():
+    """Reports written/dropped counters and queue depth of the scan history writer."""
+    return jsonify(scan_writer.stats())
+
+
+@app.route('/upstream/stats')
+async def upstream_stats():
+    """Reports circuit breaker state and hedging counters of the Gemini client."""
+    return jsonify({name: upstream.stats() for name, upstream in upstreams.items()})
+
+
+@app.route('/catalog/stats')
+async def catalog_stats():
+    """Reports the size and kind of the catalog index, and the match thresholds."""
+    return jsonify(web.catalog_report())
+
+
+@app.route('/metrics')
+async def prometheus_metrics():
+    """Stage latencies, upstream outcomes, batching, cache and in-flight metrics for Prometheus."""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+async def admit():
+    """Takes one of the MAX_IN_FLIGHT scan slots; False if none frees up in time."""
+    try:
+        await asyncio.wait_for(admission.acquire(), ADMISSION_TIMEOUT)
+        return True
+    except asyncio.TimeoutError:
+        admission_rejections.inc()
+        return False
+
+
+async def read_upload():
+    """(upload, None), or (None, 400 response) when the request carries no usable image."""
+    try:
+        with stage_seconds.time(stage="upload"):
+            upload = await read_scan_upload_async(request)
+            upload.data  # Decode base64 uploads here, so bad input is a 400 before any event
+        return upload, None
+    except UploadError as e:
+        return None, (jsonify({"message": f"Error: {e}"}), 400)
+
+
+@app.route('/scan', methods=['POST'])
+async def scan_product():
+    """Same contract as web.scan_product, limited to MAX_IN_FLIGHT concurrent scans."""
+    loading = model_loading_response()
+    if loading:
+        return loading
+    if not await admit():
+        return jsonify({"message": "Error: Server busy, try again."}), 503
+    try:
+        upload, error = await read_upload()
+        if error:
+            return error
+        async for event in scan_events(upload):
+            pass  # Only the final card is returned
+        note_first_scan()
+        if event["event"] == "error":
+            return jsonify({"message": event["message"]}), event["status"]
+        return jsonify({"message": event["message"]})
+    finally:
+        admission.release()
+
+
+@app.route('/scan/stream', methods=['POST'])
+async def scan_product_stream():
+    """Streaming /scan: newline-delimited JSON events, each sent as soon as it is known."""
+    loading = model_loading_response()
+    if loading:
+        return loading
+    if not await admit():
+        return jsonify({"message": "Error: Server busy, try again."}), 503
+    try:
+        upload, error = await read_upload()
+    except BaseException:
+        admission.release()
+        raise
+    if error:
+        admission.release()
+        return error
+
+    async def lines():
+        try:  # The slot is held until the last event is sent (or the client goes away)
+            async for event in scan_events(upload, "scan_stream"):
+                yield json.dumps(event) + "\n"
+        finally:
+            admission.release()
+
+    note_first_scan()
+    return lines(), 200, {"Content-Type": "application/x-ndjson", "X-Accel-Buffering": "no"}
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=2502)
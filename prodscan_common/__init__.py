@@ -0,0 +1,5 @@
+"""Modules shared by the ML web app (Ml_ws/ML_ws) and the product apps (product_ws, Colab_ws).
+
+The apps are run from their own directories, so each entry point puts the repository
+root on sys.path before importing from here.
+"""
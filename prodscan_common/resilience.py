@@ -0,0 +1,261 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# --- Upstream Calls ---
+# Outbound Gemini / Google Search calls go through an Upstream, which adds three things
+# to the HTTP client underneath it (requests or httpx; the Upstream never sees which):
+#   - deadlines: each call's timeout is capped by what is left of the scan's Budget
+#   - a circuit breaker: after repeated failures calls fail fast instead of waiting
+#   - hedging (optional): a call still unanswered after hedge_after seconds, or one that
+#     failed quickly, gets one more attempt and the first good answer wins
+MIN_CALL_SECONDS = 0.25  # Not worth sending a call with less than this left in the budget
+
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """A call that was not sent: its circuit is open or the request budget is spent."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+def is_upstream_failure(error):
+    """True if error says the upstream is unhealthy: no answer, a 5xx or a 429.
+
+    Other HTTP errors (a 400 for a bad prompt) and undecodable bodies mean the upstream
+    did answer, so they do not count against its circuit.
+    """
+    if error is None or isinstance(error, (UpstreamUnavailable, ValueError)):
+        return False
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500 or status == 429
+
+
+class Budget:
+    """Time left for one request; every upstream call made under it gets at most what remains."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, connect, read):
+        """(connect, read) timeouts capped by the time left; DeadlineExceeded if too little is."""
+        remaining = self.remaining()
+        if remaining < MIN_CALL_SECONDS:
+            raise DeadlineExceeded(f"Request budget of {self.seconds}s is spent")
+        return min(connect, remaining), min(read, remaining)
+
+    def run(self, function, *args):
+        """Calls function(*args) with this budget applied to the upstream calls it makes."""
+        token = current_budget.set(self)
+        try:
+            return function(*args)
+        finally:
+            current_budget.reset(token)
+
+    async def arun(self, coroutine):
+        """Awaits coroutine with this budget applied (tasks it starts inherit the budget)."""
+        token = current_budget.set(self)
+        try:
+            return await coroutine
+        finally:
+            current_budget.reset(token)
+
+
+class CircuitBreaker:
+    """closed -> open after failure_threshold failures in a row; open -> half_open after
+    reset_timeout seconds; a single trial call in half_open closes or reopens it."""
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0  # In a row
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._counts = {"opened": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns if a call may go out now, else raises CircuitOpenError."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self._counts["rejected"] += 1
+        raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def release(self):
+        """Frees the half-open trial slot of a call that ended without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                print(f"Circuit for {self.name} closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                and self._failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._counts["opened"] += 1
+                print(f"Circuit for {self.name} opened after {self._failures} failures; "
+                      f"failing fast for {self.reset_timeout}s")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, state=self.state, consecutive_failures=self._failures)
+
+
+class Upstream:
+    """One remote service: its circuit breaker, per-call timeout cap and optional hedging.
+
+    send(timeout) performs one attempt (timeout is a (connect, read) pair) and returns the
+    decoded answer or raises; call() runs it for threads and acall() for coroutines.
+    """
+
+    def __init__(self, name, timeout=(3.05, 15), failure_threshold=5, reset_timeout=30.0,
+                 hedge_after=None, hedge_workers=16):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_after = hedge_after or None  # Seconds; None or 0 turns hedging off
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix=f"hedge-{name}")
+        self._counts = {"hedged": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+
+    def _call_timeout(self):
+        budget = current_budget.get()
+        return budget.timeout(*self.timeout) if budget is not None else self.timeout
+
+    def _record(self, error):
+        if is_upstream_failure(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _attempt(self, send):
+        timeout = self._call_timeout()
+        self.breaker.allow()
+        try:
+            result = send(timeout)
+        except Exception as e:
+            self._record(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    def call(self, send, hedge=True):
+        """Runs send under the breaker and the current budget, hedged if enabled and hedge is set."""
+        if self.hedge_after is None or not hedge:
+            return self._attempt(send)
+        # Attempts run on the hedge pool (in a copy of the caller's context, for the budget)
+        # so the caller can stop waiting on a slow one; a losing attempt is left to finish.
+        first = self._hedge_pool.submit(contextvars.copy_context().run, self._attempt, send)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done and not is_upstream_failure(first.exception()):
+            return first.result()
+        self._count("hedged")
+        second = self._hedge_pool.submit(contextvars.copy_context().run, self._attempt, send)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_wins")
+                    return future.result()
+        return first.result()  # Both failed: raise the original attempt's error
+
+    async def acall(self, send, hedge=True):
+        """call() for a coroutine function send; the losing attempt is cancelled."""
+        if self.hedge_after is None or not hedge:
+            return await self._aattempt(send)
+        first = asyncio.ensure_future(self._aattempt(send))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done and not is_upstream_failure(first.exception()):
+            return first.result()
+        self._count("hedged")
+        second = asyncio.ensure_future(self._aattempt(send))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _aattempt(self, send):
+        timeout = self._call_timeout()
+        self.breaker.allow()
+        try:
+            result = await send(timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()  # A cancelled hedge says nothing about the upstream
+            raise
+        except Exception as e:
+            self._record(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    def stats(self):
+        """Breaker state and counters plus hedging counters."""
+        with self._lock:
+            counts = dict(self._counts)
+        return dict(self.breaker.stats(), **counts, hedge_after_s=self.hedge_after)
+
+
+# --- Degraded Answers ---
+# A lookup whose upstream failed answers with placeholder text ("Error ...", "Not
+# available.") or nothing at all. Those answers and the scans holding them are not
+# cached, so the next scan of the item asks again once the upstream recovers.
+PLACEHOLDER_ANSWERS = ("Not available.",)
+ENRICHED_FIELDS = ("price", "usage")
+
+
+def is_cacheable_answer(value):
+    """Only real answers are cached; error, placeholder and empty strings are retried next time."""
+    return bool(value) and not value.startswith("Error") and value not in PLACEHOLDER_ANSWERS
+
+
+def is_degraded(scan):
+    """True if one of the scan's lookups fell back to an error, placeholder or empty answer."""
+    return any(not is_cacheable_answer(scan[field]) for field in ENRICHED_FIELDS if field in scan)
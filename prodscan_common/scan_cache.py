@@ -0,0 +1,245 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# --- Perceptual Hash ---
+HASH_SIZE = 8  # 8x8 low-frequency DCT coefficients -> 64-bit hash
+HASH_SAMPLE = 32  # Frames are shrunk to 32x32 greyscale before the DCT
+HASH_BITS = HASH_SIZE * HASH_SIZE
+SPILL_PRUNE_EVERY = 256  # Evictions between sweeps of expired rows out of the spill file
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, computed once at import."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SAMPLE)
+_DCT_T = _DCT.T.copy()
+
+
+def perceptual_hash(image_data):
+    """Returns the 64-bit DCT perceptual hash (pHash) of an encoded image as an int."""
+    img = Image.open(BytesIO(image_data))
+    img.draft("L", (HASH_SAMPLE * 2, HASH_SAMPLE * 2))  # JPEG: decode at 1/2..1/8 scale directly
+    img = img.convert("L").resize((HASH_SAMPLE, HASH_SAMPLE), Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.float32)
+
+    coefficients = (_DCT @ pixels @ _DCT_T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    median = np.median(coefficients[1:])  # Skip the DC term, it only encodes brightness
+    value = 0
+    for bit in coefficients > median:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+def to_sqlite_int(value):
+    """SQLite integers are signed 64-bit; store a 64-bit hash (or band) with its top bit as the sign."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_sqlite_int(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+# --- Result Cache ---
+
+class PerceptualCache:
+    """LRU cache of scan results keyed by perceptual hash, with near-match lookups.
+
+    Two hashes within max_distance bits must agree exactly on at least one of
+    max_distance + 1 bit bands (pigeonhole), so near matches are found through a
+    band index instead of comparing against every entry. Evicted entries can be
+    spilled to SQLite and are looked up there on a memory miss.
+    """
+
+    def __init__(self, max_entries=1024, ttl=600, max_distance=4, spill_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max(0, min(int(max_distance), HASH_BITS - 1))
+        self._band_count = self.max_distance + 1
+        self._band_width = -(-HASH_BITS // self._band_count)  # Ceiling division
+        self._entries = OrderedDict()  # hash -> (record, created_at)
+        self._bands = {}  # (band number, band value) -> set of hashes
+        self._lock = threading.Lock()
+        self._counters = {"exact_hits": 0, "near_hits": 0, "spill_hits": 0, "misses": 0,
+                          "evictions": 0, "expirations": 0}
+
+        self.spill_path = spill_path
+        self._spill = None
+        if spill_path:
+            self._open_spill()
+            # A forked worker opens its own connection; SQLite ones must not cross a fork
+            os.register_at_fork(after_in_child=self._open_spill)
+
+    def _open_spill(self):
+        self._spill = sqlite3.connect(self.spill_path, check_same_thread=False)
+        self._spill.executescript('''
+            CREATE TABLE IF NOT EXISTS phash_cache (
+                phash TEXT PRIMARY KEY,
+                record TEXT,
+                created REAL
+            );
+            CREATE TABLE IF NOT EXISTS phash_bands (
+                band INTEGER,
+                value INTEGER,
+                phash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_phash_bands ON phash_bands (band, value);
+        ''')
+
+    def _band_keys(self, phash):
+        """Splits a hash into (band number, band value) pairs."""
+        mask = (1 << self._band_width) - 1
+        return [(band, (phash >> (band * self._band_width)) & mask)
+                for band in range(self._band_count)]
+
+    def _stored_band_keys(self, phash):
+        """_band_keys as stored in the spill file (one 64-bit band when max_distance is 0)."""
+        return [(band, to_sqlite_int(value)) for band, value in self._band_keys(phash)]
+
+    def _index(self, phash):
+        for key in self._band_keys(phash):
+            self._bands.setdefault(key, set()).add(phash)
+
+    def _unindex(self, phash):
+        for key in self._band_keys(phash):
+            members = self._bands.get(key)
+            if members is not None:
+                members.discard(phash)
+                if not members:
+                    del self._bands[key]
+
+    def _drop(self, phash):
+        self._entries.pop(phash, None)
+        self._unindex(phash)
+
+    def _nearest_in_memory(self, phash, now):
+        """Finds the closest live entry within max_distance, expiring stale ones on the way."""
+        if phash in self._entries:
+            candidates = {phash}
+        else:
+            candidates = set()
+            for key in self._band_keys(phash):
+                candidates |= self._bands.get(key, set())
+
+        best, best_distance = None, self.max_distance + 1
+        for candidate in candidates:
+            if now - self._entries[candidate][1] > self.ttl:
+                self._drop(candidate)
+                self._counters["expirations"] += 1
+                continue
+            distance = hamming_distance(phash, candidate)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return best, best_distance
+
+    def get(self, phash):
+        """Returns the cached record for this hash or a near-identical one, else None."""
+        now = time.time()
+        with self._lock:
+            match, distance = self._nearest_in_memory(phash, now)
+            if match is not None:
+                self._entries.move_to_end(match)
+                self._counters["exact_hits" if distance == 0 else "near_hits"] += 1
+                return self._entries[match][0]
+
+            spilled = self._get_spilled(phash, now)
+            if spilled is not None:
+                match, record, created = spilled
+                self._counters["spill_hits"] += 1
+                # Promote back into memory under the stored hash, keeping its age: a
+                # fresh timestamp would let an entry cycle through the spill forever
+                self._insert(match, record, created)
+                return record
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, phash, record):
+        """Stores a scan result under its hash."""
+        with self._lock:
+            self._insert(phash, record, time.time())
+
+    def _insert(self, phash, record, created):
+        if phash in self._entries:
+            self._entries.move_to_end(phash)
+        else:
+            self._index(phash)
+        self._entries[phash] = (record, created)
+        while len(self._entries) > self.max_entries:
+            old_hash, (old_record, old_created) = self._entries.popitem(last=False)
+            self._unindex(old_hash)
+            self._counters["evictions"] += 1
+            self._spill_entry(old_hash, old_record, old_created)
+
+    def _spill_entry(self, phash, record, created):
+        """Writes an evicted entry to SQLite (if a spill file is configured)."""
+        if self._spill is None or time.time() - created > self.ttl:
+            return
+        key = format(phash, "016x")
+        try:
+            with self._spill:
+                if self._counters["evictions"] % SPILL_PRUNE_EVERY == 0:
+                    cutoff = time.time() - self.ttl
+                    self._spill.execute("DELETE FROM phash_bands WHERE phash IN "
+                                        "(SELECT phash FROM phash_cache WHERE created < ?)", (cutoff,))
+                    self._spill.execute("DELETE FROM phash_cache WHERE created < ?", (cutoff,))
+                self._spill.execute("DELETE FROM phash_bands WHERE phash = ?", (key,))
+                self._spill.execute("INSERT OR REPLACE INTO phash_cache VALUES (?, ?, ?)",
+                                    (key, json.dumps(record), created))
+                self._spill.executemany("INSERT INTO phash_bands VALUES (?, ?, ?)",
+                                        [(band, value, key) for band, value in self._stored_band_keys(phash)])
+        except (sqlite3.Error, OverflowError) as e:
+            print(f"Error spilling scan cache entry: {e}")
+
+    def _get_spilled(self, phash, now):
+        """(hash, record, created) of the closest live spilled entry, found via the band
+        index table, or None."""
+        if self._spill is None:
+            return None
+        clauses = " OR ".join(["(b.band = ? AND b.value = ?)"] * self._band_count)
+        params = [item for key in self._stored_band_keys(phash) for item in key]
+        try:
+            rows = self._spill.execute(
+                f"SELECT DISTINCT c.phash, c.record, c.created FROM phash_bands b "
+                f"JOIN phash_cache c ON c.phash = b.phash "
+                f"WHERE ({clauses}) AND c.created >= ?", params + [now - self.ttl]).fetchall()
+        except (sqlite3.Error, OverflowError) as e:
+            print(f"Error reading scan cache spill: {e}")
+            return None
+
+        best, best_distance = None, self.max_distance + 1
+        for key, record, created in rows:
+            distance = hamming_distance(phash, int(key, 16))
+            if distance < best_distance:
+                best, best_distance = (int(key, 16), record, created), distance
+        if best is None:
+            return None
+        return best[0], json.loads(best[1]), best[2]
+
+    def stats(self):
+        """Hit/miss counters and the overall hit rate."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        hits = stats["exact_hits"] + stats["near_hits"] + stats["spill_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = (hits / lookups) if lookups else 0.0
+        return stats
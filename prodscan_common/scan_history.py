@@ -0,0 +1,311 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+# --- Scan Records ---
+# scan_time is stored as integer milliseconds since the epoch (UTC), so it sorts and
+# range-filters through an index; the API shows it as ISO-8601.
+SCAN_COLUMNS = ("product_name", "brand", "brand_details", "release_date", "usage", "price", "scan_time")
+WRITE_BATCH_SIZE = 256  # Most rows inserted per transaction
+FLUSH_INTERVAL = 0.5  # Seconds the writer waits for more rows before committing a partial batch
+_STOP = object()
+
+
+def scan_row(record, scan_time=None):
+    """Orders a {column: value} scan record as a scans row, stamping scan_time if absent."""
+    record = dict(record)
+    record.setdefault("scan_time", scan_time or int(time.time() * 1000))
+    return tuple(record.get(column) for column in SCAN_COLUMNS)
+
+
+# --- Schema ---
+# PRAGMA user_version holds the schema version. Version 0 is the original table: no
+# indexes and free-form TEXT scan_time. Each entry migrates from the version before it.
+SCANS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_name TEXT COLLATE NOCASE,
+        brand TEXT COLLATE NOCASE,
+        brand_details TEXT,
+        release_date TEXT,
+        usage TEXT,
+        price TEXT,
+        scan_time INTEGER NOT NULL
+    )
+'''
+SCANS_INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_scans_time ON scans (scan_time, id);
+    CREATE INDEX IF NOT EXISTS idx_scans_product_time ON scans (product_name, scan_time, id);
+    CREATE INDEX IF NOT EXISTS idx_scans_brand_time ON scans (brand, scan_time, id);
+'''
+MIGRATIONS = [
+    # 0 -> 1: rebuild with an INTEGER scan_time (old text read as local time) plus indexes
+    SCANS_TABLE.replace("scans (", "scans_v1 (", 1) + ''';
+    INSERT INTO scans_v1 (id, product_name, brand, brand_details, release_date, usage, price, scan_time)
+        SELECT id, product_name, brand, brand_details, release_date, usage, price,
+               CASE WHEN typeof(scan_time) = 'integer' THEN scan_time
+                    ELSE COALESCE(CAST(strftime('%s', scan_time, 'utc') AS INTEGER) * 1000, 0) END
+        FROM scans;
+    DROP TABLE scans;
+    ALTER TABLE scans_v1 RENAME TO scans;
+    ''' + SCANS_INDEXES,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _execute_all(conn, script):
+    """Runs ;-separated statements inside the caller's transaction (executescript would commit)."""
+    for statement in script.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def migrate_database(db_path):
+    """Creates the scans table or brings an existing product_scans.db up to SCHEMA_VERSION."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")  # Other workers starting at the same time wait here
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scans'").fetchone()
+        if not exists:
+            _execute_all(conn, SCANS_TABLE + ";" + SCANS_INDEXES)
+            version = SCHEMA_VERSION
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            print(f"Migrating {db_path} scans table to schema version {target}")
+            _execute_all(conn, MIGRATIONS[target - 1])
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+class ScanWriter:
+    """Appends scan records to the scans table from one background thread.
+
+    Request threads only put rows on a bounded in-memory queue. The writer drains
+    it in batches of up to WRITE_BATCH_SIZE rows, one executemany transaction per
+    batch, on a WAL connection with synchronous=NORMAL (no fsync per commit). When
+    the queue is full, record() waits up to put_timeout seconds and then drops the
+    row, so a slow disk can never hold a scan for longer than that.
+    """
+
+    def __init__(self, db_path, max_queue_size=10000, put_timeout=0.05,
+                 batch_size=WRITE_BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.put_timeout = put_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._start()
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._start)  # The writer thread does not survive a fork
+
+    def _start(self):
+        """Fresh queue, counters and writer thread (at startup, and again in a forked worker)."""
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._counters = {"written": 0, "batches": 0, "dropped": 0, "errors": 0}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="scan-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def record(self, record, block=True):
+        """Queues one scan record; returns False if it was dropped because the queue stayed full."""
+        if self._closed:
+            return False
+        try:
+            self._queue.put(scan_row(record), block=block, timeout=self.put_timeout if block else None)
+            return True
+        except queue.Full:
+            self._count("dropped")
+            return False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; only the last commits can be lost on power failure
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        return conn
+
+    def _run(self):
+        """Writer loop: block for the first row, then take whatever else is queued."""
+        conn = self._connect()
+        insert = (f"INSERT INTO scans ({', '.join(SCAN_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(SCAN_COLUMNS))})")
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(conn, insert, batch)
+        conn.close()
+
+    def _write(self, conn, insert, batch):
+        try:
+            with conn:  # One transaction per batch
+                conn.executemany(insert, batch)
+            self._count("written", len(batch))
+            self._count("batches")
+        except sqlite3.Error as e:
+            print(f"Error writing {len(batch)} scans to {self.db_path}: {e}")
+            self._count("errors")
+
+    def close(self, timeout=10):
+        """Flushes every queued row and stops the writer (also run at interpreter exit)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)  # Unbounded wait: shutdown must not drop queued scans
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        stats["mean_batch_size"] = (stats["written"] / stats["batches"]) if stats["batches"] else 0.0
+        return stats
+
+
+# --- History Queries ---
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+SQLITE_MAX_INT = 2 ** 63 - 1  # scan_time and id are SQLite INTEGERs (signed 64-bit)
+
+
+def _in_sqlite_range(value):
+    return -SQLITE_MAX_INT - 1 <= value <= SQLITE_MAX_INT
+
+
+def parse_time(value):
+    """Epoch milliseconds from epoch seconds or an ISO-8601 string (naive = local time)."""
+    try:
+        milliseconds = int(float(value) * 1000)
+    except OverflowError:  # inf
+        raise ValueError(f"Time '{value}' is out of range.")
+    except ValueError:
+        try:
+            milliseconds = int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+        except (ValueError, OverflowError, OSError):
+            raise ValueError(f"Unrecognised time '{value}'; use ISO-8601 or epoch seconds.")
+    if not _in_sqlite_range(milliseconds):
+        raise ValueError(f"Time '{value}' is out of range.")
+    return milliseconds
+
+
+def format_time(scan_time):
+    return datetime.fromtimestamp(scan_time / 1000.0, timezone.utc).isoformat(timespec="milliseconds")
+
+
+def parse_history_args(args):
+    """Validates /scans query-string arguments into ScanHistory.page keyword arguments."""
+    query = {"product_name": args.get("product_name") or None, "brand": args.get("brand") or None}
+    for name in ("since", "until"):
+        query[name] = parse_time(args[name]) if args.get(name) else None
+    try:
+        query["limit"] = max(1, min(int(args.get("limit", HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer.")
+    query["cursor"] = None
+    if args.get("cursor"):
+        try:
+            scan_time, scan_id = args["cursor"].split("_")
+            query["cursor"] = (int(scan_time), int(scan_id))
+        except ValueError:
+            raise ValueError("Invalid cursor.")
+        if not all(_in_sqlite_range(part) for part in query["cursor"]):
+            raise ValueError("Invalid cursor.")
+    return query
+
+
+class ScanHistory:
+    """Newest-first scan history pages, served from a pool of read-only connections.
+
+    Pages use keyset pagination: the cursor is the (scan_time, id) of the last row
+    returned, and the next page starts strictly below it. Together with the
+    (column, scan_time, id) indexes every page is one index range scan, however
+    deep into the history it is.
+    """
+
+    def __init__(self, db_path, pool_size=4):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._open_pool()
+        os.register_at_fork(after_in_child=self._open_pool)  # SQLite connections must not cross a fork
+
+    def _open_pool(self):
+        self._pool = queue.LifoQueue()
+        for _ in range(self.pool_size):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA cache_size=-8192")  # 8 MiB page cache per connection
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def page(self, product_name=None, brand=None, since=None, until=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Returns {"scans": [...], "next_cursor": str or None} for one page of matching scans."""
+        where, params = [], []
+        for column, value in (("product_name", product_name), ("brand", brand)):
+            if value is not None:
+                where.append(f"{column} = ?")  # NOCASE column: case-insensitive, still indexed
+                params.append(value)
+        if since is not None:
+            where.append("scan_time >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("scan_time < ?")
+            params.append(until)
+        if cursor is not None:
+            where.append("(scan_time, id) < (?, ?)")
+            params.extend(cursor)
+        # A product name narrows far more than a brand; without ANALYZE statistics the
+        # planner may pick the brand index when both filters are given
+        hint = " INDEXED BY idx_scans_product_time" if product_name is not None else ""
+        sql = (f"SELECT id, {', '.join(SCAN_COLUMNS)} FROM scans{hint}"
+               f"{' WHERE ' + ' AND '.join(where) if where else ''}"
+               f" ORDER BY scan_time DESC, id DESC LIMIT ?")
+        params.append(limit + 1)  # One extra row tells whether another page exists
+
+        conn = self._pool.get()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            self._pool.put(conn)
+
+        scans = [dict(row, scan_time=format_time(row["scan_time"])) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last['scan_time']}_{last['id']}"
+        return {"scans": scans, "next_cursor": next_cursor}
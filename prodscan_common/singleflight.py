@@ -0,0 +1,123 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future
+
+# --- Request Coalescing ---
+# When many scans of the same product arrive together, their usage and price lookups
+# would each call Gemini with the same question. A SingleFlight lets the first caller
+# for a key (the leader) make the call while later callers for that key wait for it
+# and share its result, or its exception. Nothing is cached: once the call returns, the
+# next caller starts a new one.
+WAITER_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)  # Callers that shared one call, for the histogram
+
+
+def _bucket_index(value):
+    for i, bound in enumerate(WAITER_BUCKETS):
+        if value <= bound:
+            return i
+    return len(WAITER_BUCKETS)  # The +Inf bucket
+
+
+class _Flight:
+    """One call in progress and the callers waiting for it."""
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one, per group (e.g. "usage").
+
+    do() is for threads: the leader runs the function on its own thread. ado() is for
+    coroutines: the call runs as a task that every caller awaits through a shield, so
+    a caller that is cancelled (a client hanging up) stops waiting without cancelling
+    the call the others share.
+    """
+
+    def __init__(self):
+        self._flights = {}  # (group, key, is_async) -> _Flight
+        self._lock = threading.Lock()
+        self._counters = {}  # group -> {"calls", "coalesced", "errors", "waiters" histogram}
+
+    def _join(self, flight_key, start):
+        """(flight, is_leader); start() makes the future of a new flight."""
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                flight.waiters += 1
+                return flight, False
+            flight = self._flights[flight_key] = _Flight(start())
+            return flight, True
+
+    def _finish(self, flight_key, flight, failed):
+        group = flight_key[0]
+        with self._lock:
+            if self._flights.get(flight_key) is flight:
+                del self._flights[flight_key]
+            counters = self._counters.setdefault(
+                group, {"calls": 0, "coalesced": 0, "errors": 0, "waiters": [0] * (len(WAITER_BUCKETS) + 1)})
+            counters["calls"] += 1
+            counters["coalesced"] += flight.waiters
+            counters["errors"] += int(failed)
+            counters["waiters"][_bucket_index(flight.waiters)] += 1
+
+    def do(self, group, key, function):
+        """function(), or the result of the call already running for (group, key)."""
+        flight_key = (group, key, False)
+        flight, leader = self._join(flight_key, Future)
+        if not leader:
+            return flight.future.result()  # Re-raises the leader's exception
+        try:
+            result = function()
+        except BaseException as e:
+            flight.future.set_exception(e)
+            self._finish(flight_key, flight, failed=True)
+            raise
+        flight.future.set_result(result)
+        self._finish(flight_key, flight, failed=False)
+        return result
+
+    async def ado(self, group, key, function):
+        """await function(), or the result of the call already running for (group, key)."""
+        # Thread and coroutine flights never mix: their futures cannot be awaited across
+        flight_key = (group, key, True)
+        flight, leader = self._join(flight_key, lambda: asyncio.ensure_future(function()))
+        if leader:
+            flight.future.add_done_callback(
+                lambda task: self._finish(flight_key, flight, failed=task.cancelled() or task.exception() is not None))
+        return await asyncio.shield(flight.future)
+
+    def coalesced(self, group, key=str):
+        """Decorator for single-argument lookups such as get_gemini_price(product_name)."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(name):
+                return self.do(group, key(name), lambda: function(name))
+            return wrapper
+        return decorator
+
+    def acoalesced(self, group, key=str):
+        """coalesced() for a coroutine function."""
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(name):
+                return await self.ado(group, key(name), lambda: function(name))
+            return wrapper
+        return decorator
+
+    def stats(self):
+        """Per group: calls made, callers that shared one (coalesced), calls that raised,
+        calls and callers in flight now, and the waiters-per-call histogram."""
+        with self._lock:
+            stats = {group: dict(counters, waiters=list(counters["waiters"]), in_flight=0, waiting=0)
+                     for group, counters in self._counters.items()}
+            for (group, _, _), flight in self._flights.items():
+                group_stats = stats.setdefault(group, {"calls": 0, "coalesced": 0, "errors": 0,
+                                                       "waiters": [0] * (len(WAITER_BUCKETS) + 1),
+                                                       "in_flight": 0, "waiting": 0})
+                group_stats["in_flight"] += 1
+                group_stats["waiting"] += flight.waiters
+        return stats
@@ -0,0 +1,93 @@
+import base64
+import binascii
+
+# --- Upload Limits ---
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024  # Applied as Flask's MAX_CONTENT_LENGTH (413 above it)
+ALLOWED_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+
+class UploadError(ValueError):
+    """Raised when a /scan request carries no usable image."""
+
+
+class ScanUpload:
+    """An uploaded frame that converts between bytes and base64 text only when asked.
+
+    A JSON data-URL upload keeps its original base64 text, so it can be sent to
+    Gemini as-is. A binary upload keeps its raw bytes for local decoding. The
+    other form is only built (once) if some code path actually needs it.
+    """
+
+    def __init__(self, mime_type, data=None, b64=None):
+        self.mime_type = mime_type
+        self._data = data
+        self._b64 = b64
+
+    @property
+    def data(self):
+        """Raw encoded image bytes."""
+        if self._data is None:
+            try:
+                self._data = base64.b64decode(self._b64, validate=True)
+            except (binascii.Error, ValueError):
+                raise UploadError("Image data is not valid base64.")
+        return self._data
+
+    @property
+    def b64(self):
+        """Base64 text of the image, as Gemini's inline_data expects."""
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self._data).decode("ascii")
+        return self._b64
+
+
+def _check_type(mime_type):
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    if mime_type == "image/jpg":
+        mime_type = "image/jpeg"
+    if mime_type not in ALLOWED_IMAGE_TYPES:
+        raise UploadError(f"Unsupported image type '{mime_type or 'unknown'}'.")
+    return mime_type
+
+
+def _from_body(content_type, data):
+    if not data:
+        raise UploadError("No image data received.")
+    return ScanUpload(_check_type(content_type), data=data)
+
+
+def _from_file(upload):
+    data = upload.read() if upload is not None else None
+    if not data:
+        raise UploadError("No image data received.")
+    return ScanUpload(_check_type(upload.mimetype or "image/jpeg"), data=data)
+
+
+def _from_json(payload):
+    if not isinstance(payload, dict) or not isinstance(payload.get("image"), str):
+        raise UploadError("No image data received.")
+    header, separator, b64 = payload["image"].partition(",")
+    if not separator:  # Bare base64 without a data: prefix
+        header, b64 = "data:image/jpeg;base64", header
+    mime_type = header[len("data:"):].split(";")[0] if header.startswith("data:") else "image/jpeg"
+    return ScanUpload(_check_type(mime_type), b64=b64)
+
+
+def read_scan_upload(request):
+    """Reads the frame from a raw image body, a multipart 'image' field or a JSON data URL."""
+    content_type = (request.mimetype or "").lower()
+    if content_type.startswith("image/"):
+        return _from_body(content_type, request.get_data(cache=False))
+    if content_type == "multipart/form-data":
+        return _from_file(request.files.get("image"))
+    return _from_json(request.get_json(silent=True))
+
+
+async def read_scan_upload_async(request):
+    """read_scan_upload for Quart, whose request body is awaited instead of read."""
+    content_type = (request.mimetype or "").lower()
+    if content_type.startswith("image/"):
+        return _from_body(content_type, await request.get_data(cache=False))
+    if content_type == "multipart/form-data":
+        return _from_file((await request.files).get("image"))
+    return _from_json(await request.get_json(silent=True))
@@ -1,50 +1,86 @@
 from flask import Flask, render_template, request, jsonify
-import base64
 import requests
 import re
-import sqlite3
 from io import BytesIO
 import os
+import sys
 from PIL import Image
 from datetime import datetime
 from bs4 import BeautifulSoup
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # For prodscan_common
+from prodscan_common.scan_cache import PerceptualCache, perceptual_hash
+from prodscan_common.uploads import MAX_UPLOAD_BYTES, UploadError, read_scan_upload
+from prodscan_common.scan_history import ScanWriter, ScanHistory, migrate_database, parse_history_args
+from prodscan_common.resilience import Budget, Upstream, UpstreamUnavailable, is_degraded
+from prodscan_common.singleflight import SingleFlight
 
 app = Flask(__name__, static_folder="static")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES  # Larger uploads get a 413
 
 # --- Constants ---
 IMAGE_SIZE = (224, 224)
 DATA_DIR = "image_data_serpapi"  # Use the correct data directory
 EXCHANGE_RATE = 35  # THB to USD
 
+# --- Scan Result Cache ---
+# Frames whose perceptual hashes differ by at most SCAN_CACHE_MAX_DISTANCE bits reuse
+# the earlier result. Set PRODSCAN_SCAN_CACHE_SPILL_DB to keep evicted entries in SQLite.
+SCAN_CACHE_SIZE = int(os.environ.get("PRODSCAN_SCAN_CACHE_SIZE", 1024))
+SCAN_CACHE_TTL = int(os.environ.get("PRODSCAN_SCAN_CACHE_TTL", 600))  # Seconds
+SCAN_CACHE_MAX_DISTANCE = int(os.environ.get("PRODSCAN_SCAN_CACHE_MAX_DISTANCE", 4))
+SCAN_CACHE_SPILL_DB = os.environ.get("PRODSCAN_SCAN_CACHE_SPILL_DB") or None
+
+scan_cache = PerceptualCache(max_entries=SCAN_CACHE_SIZE, ttl=SCAN_CACHE_TTL,
+                             max_distance=SCAN_CACHE_MAX_DISTANCE, spill_path=SCAN_CACHE_SPILL_DB)
+
 # --- Database Setup ---
 DB_NAME = "product_scans.db"
 
 def create_database():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_name TEXT,
-            brand TEXT,
-            brand_details TEXT,
-            release_date TEXT,
-            usage TEXT,
-            price TEXT,
-            scan_time TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """Creates the scans table, or migrates an older product_scans.db to the current schema."""
+    migrate_database(DB_NAME)
 
 create_database()
 
+# --- Scan History ---
+# Scans are queued in memory and inserted by a background writer in batched transactions,
+# so a scan never waits on the disk. The queue is bounded; see ScanWriter.
+SCAN_WRITER_QUEUE_SIZE = int(os.environ.get("PRODSCAN_SCAN_WRITER_QUEUE_SIZE", 10000))
+scan_writer = ScanWriter(DB_NAME, max_queue_size=SCAN_WRITER_QUEUE_SIZE)
+history_reader = ScanHistory(DB_NAME)  # Read-only connections behind /scans
+
 # --- API Keys and URLs (HARDCODED - FOR TESTING ONLY) ---
 GOOGLE_SEARCH_API_KEY = "----"  # YOUR GOOGLE SEARCH KEY
 GOOGLE_SEARCH_ENGINE_ID = "---"  # YOUR GOOGLE SEARCH ENGINE ID
-GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+# PRODSCAN_GOOGLE_SEARCH_URL / PRODSCAN_GEMINI_API_URL point at the local fakes in bench/
+GOOGLE_SEARCH_URL = os.environ.get("PRODSCAN_GOOGLE_SEARCH_URL") or "https://www.googleapis.com/customsearch/v1"
 GEMINI_API_KEY = "A---" # YOUR GEMINI API KEY
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+GEMINI_API_URL = os.environ.get("PRODSCAN_GEMINI_API_URL") or f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+
+# --- Upstream Resilience ---
+# Every Gemini/Google call has a timeout, capped by what is left of the scan's SCAN_BUDGET
+# seconds. After BREAKER_FAILURES failures in a row a service's circuit opens and calls
+# fail fast for BREAKER_RESET seconds. With HEDGE_AFTER_MS set, a text-only call still
+# unanswered after that long is sent a second time and the first answer wins.
+HTTP_TIMEOUT = (3.05, 15)  # (connect, read) seconds for a single upstream call
+SCAN_BUDGET = float(os.environ.get("PRODSCAN_SCAN_BUDGET", 25))
+BREAKER_FAILURES = int(os.environ.get("PRODSCAN_BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.environ.get("PRODSCAN_BREAKER_RESET_S", 30))
+HEDGE_AFTER_MS = float(os.environ.get("PRODSCAN_HEDGE_AFTER_MS", 0))  # 0: no hedging
+UPSTREAM_ERRORS = (requests.exceptions.RequestException, UpstreamUnavailable)
+
+upstreams = {name: Upstream(name, timeout=HTTP_TIMEOUT, failure_threshold=BREAKER_FAILURES,
+                            reset_timeout=BREAKER_RESET, hedge_after=HEDGE_AFTER_MS / 1000.0)
+             for name in ("gemini", "google_search")}
+
+# --- Request Coalescing ---
+# Concurrent usage/price lookups for the same product share one Gemini call.
+lookups = SingleFlight()
+
+
+def product_key(product_name):
+    """Case- and whitespace-insensitive key, so 'Galaxy S24' and 'galaxy  s24' share a call."""
+    return " ".join(str(product_name).split()).lower()
 
 # --- Utility Functions ---
 
@@ -81,10 +117,13 @@ def search_generic_price(product_name):
         "key": GOOGLE_SEARCH_API_KEY,
         "num": 5
     }
-    try:
-        response = requests.get(GOOGLE_SEARCH_URL, params=params)
+    def send(timeout):
+        response = requests.get(GOOGLE_SEARCH_URL, params=params, timeout=timeout)
         response.raise_for_status()
-        results = response.json()
+        return response.json()
+
+    try:
+        results = upstreams["google_search"].call(send)
 
         price_results = []
         for item in results.get("items", []):
@@ -93,39 +132,40 @@ def search_generic_price(product_name):
                 price_results.append(
                     f"<a href='{item['link']}' target='_blank'>{item['title']}</a>: {item['snippet']}")
         return "<br>".join(price_results) if price_results else ""
-    except requests.exceptions.RequestException as e:
+    except UPSTREAM_ERRORS as e:
         print(f"Error fetching generic price: {e}")
         return "Error retrieving price data."
 
-def analyze_image_with_gemini(image_data):
-    """Sends image to Gemini API for analysis (non-phone products)."""
-    headers = {"Content-Type": "application/json"}
-    payload = {
+# --- Gemini Requests ---
+GEMINI_HEADERS = {"Content-Type": "application/json"}
+
+def gemini_post(payload, hedge=True):
+    """POSTs one generateContent request through the "gemini" Upstream; returns the decoded answer."""
+    def send(timeout):
+        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY},
+                                 json=payload, headers=GEMINI_HEADERS, timeout=timeout)
+        response.raise_for_status()  # This will raise an exception for 4xx and 5xx errors
+        return response.json()
+    return upstreams["gemini"].call(send, hedge=hedge)
+
+def identify_payload(image_data, mime_type="image/jpeg"):
+    """Free-text product identification prompt for a base64 image."""
+    return {
         "contents": [
             {
                 "role": "user",
                 "parts": [
                     {
                         "text": "Identify the product and provide details including: Product Name, Brand, Release Date of product and company, Brand Details brand owner, and explain what this product is used for in short sentence."},
-                    {"inline_data": {"mime_type": "image/jpeg", "data": image_data}}
+                    {"inline_data": {"mime_type": mime_type, "data": image_data}}
                 ]
             }
         ]
     }
-    try:
-        # Pass API key as a parameter
-        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY},
-                                 json=payload, headers=headers)
-        response.raise_for_status()  # This will raise an exception for 4xx and 5xx errors
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print("Error calling Gemini API:", e)
-        return None
 
-def fetch_usage_with_gemini(product_name):
-    """Gets product usage from Gemini (fallback)."""
-    headers = {"Content-Type": "application/json"}
-    payload = {
+def usage_payload(product_name):
+    """One-sentence usage prompt for a product name."""
+    return {
         "contents": [
             {
                 "role": "user",
@@ -135,23 +175,10 @@ def fetch_usage_with_gemini(product_name):
             }
         ]
     }
-    try:
-        # Pass API key as a parameter
-        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY},
-                                 json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        return clean_text(result["candidates"][0]["content"]["parts"][0]["text"])
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching product usage:", e)
-        return "Not available."
 
-def get_gemini_price(product_name):
-    """
-    Retrieves the price of a product from Gemini, given the product name.
-    """
-    headers = {"Content-Type": "application/json"}
-    payload = {
+def price_payload(product_name):
+    """THB price prompt for a product name."""
+    return {
         "contents": [
             {
                 "role": "user",
@@ -161,99 +188,196 @@ def get_gemini_price(product_name):
             }
         ]
     }
+
+def response_text(result):
+    """Text of the first candidate in a generateContent response."""
+    return result["candidates"][0]["content"]["parts"][0]["text"]
+
+def price_from_response(result):
+    """Turns Gemini's price answer into the 'Estimate Price' line ('' if it names no THB price)."""
+    price_text = clean_text(response_text(result))
+
+    # Extract price
+    price_match = re.search(r'([\d,\.]+)\s*THB', price_text, re.IGNORECASE)
+    if price_match:
+        price_value = price_match.group(1).replace(",", "")
+        return f"Estimate Price (Approximate): ฿{price_value}"
+    else:
+        return ""
+
+def analyze_image_with_gemini(image_data, mime_type="image/jpeg"):
+    """Sends image to Gemini API for analysis (non-phone products)."""
     try:
-        response = requests.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY},
-                                 json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        price_text = clean_text(
-            result["candidates"][0]["content"]["parts"][0]["text"])
-
-        # Extract price
-        price_match = re.search(r'([\d,\.]+)\s*THB', price_text, re.IGNORECASE)
-        if price_match:
-            price_value = price_match.group(1).replace(",", "")
-            return f"Estimate Price (Approximate): ฿{price_value}"
-        else:
-            return ""
-
-    except requests.exceptions.RequestException as e:
+        # Never hedged: a second copy of the image upload costs more than it saves
+        return gemini_post(identify_payload(image_data, mime_type), hedge=False)
+    except UPSTREAM_ERRORS as e:
+        print("Error calling Gemini API:", e)
+        return None
+
+@lookups.coalesced("usage", key=product_key)
+def fetch_usage_with_gemini(product_name):
+    """Gets product usage from Gemini (fallback)."""
+    try:
+        return clean_text(response_text(gemini_post(usage_payload(product_name))))
+    except UPSTREAM_ERRORS as e:
+        print(f"Error fetching product usage:", e)
+        return "Not available."
+
+@lookups.coalesced("gemini_price", key=product_key)
+def get_gemini_price(product_name):
+    """
+    Retrieves the price of a product from Gemini, given the product name.
+    """
+    try:
+        return price_from_response(gemini_post(price_payload(product_name)))
+
+    except UPSTREAM_ERRORS as e:
         print(f"Error fetching price from Gemini: {e}")
         return "Error retrieving price from Gemini."
     except Exception as e:
         print(f"Error processing Gemini response: {e}")
         return "Error processing Gemini's price response."
 
+# --- Result Formatting ---
+def parse_product_details(detected_product):
+    """Scrapes Gemini's free-text answer into the fields shown on the result card."""
+    product_name_match = re.search(r'Product Name:\s*(.*?)\n', detected_product,
+                                   re.DOTALL)
+    product_name = clean_text(
+        product_name_match.group(1)) if product_name_match else "Unknown"
+
+    brand_match = re.search(r'Brand:\s*(.*?)\n', detected_product, re.DOTALL)
+    brand = clean_text(brand_match.group(1)) if brand_match else "Unknown"
+
+    brand_details_match = re.search(r'Brand Details:\s*(.*?)\n', detected_product,
+                                       re.DOTALL)
+    brand_details = clean_text(
+        brand_details_match.group(1)) if brand_details_match else "Not available."
+
+    release_date_match = re.search(r'Release Date:\s*(.*?)\n', detected_product,
+                                   re.DOTALL)
+
+    if release_date_match:
+        raw_date = release_date_match.group(1).strip()
+        try:
+            # Attempt to parse the date
+            formatted_date = datetime.strptime(raw_date,
+                                               "%B %d, %Y").strftime("%m/%d/%Y")
+        except ValueError:
+            # If parsing fails, just clean the text
+            formatted_date = clean_text(raw_date)
+    else:
+        formatted_date = "Not available."
+    usage_match = re.search(r'Used for:\s*(.*?)\n', detected_product + '\n',
+                           re.DOTALL)
+    usage = clean_text(usage_match.group(1)) if usage_match else "Not available."
+    return {"product_name": product_name, "brand": brand, "brand_details": brand_details,
+            "release_date": formatted_date, "usage": usage}
+
+def format_product_result(details, gemini_price):
+    """HTML result card: product fields, marketplace links and Gemini's price estimate."""
+    product_name = details["product_name"]
+    price_info = ""
+    lazada_url, shopee_url = search_shopee_lazada_price(product_name)
+    price_info += f"<a href='{lazada_url}' target='_blank'>Lazada - {product_name}</a>"
+    price_info += f"<br><a href='{shopee_url}' target='_blank'>Shopee - {product_name}</a>"
+    price_info += "<br>" + gemini_price
+
+    return f"""
+            <b>Product Name:</b> {product_name}<br>
+            <b>Brand:</b> {details["brand"]}<br>
+            <b>Brand Details:</b> {details["brand_details"]}<br>
+            <b>Release Date:</b> {details["release_date"]}<br>
+            <b>What is it used for?</b> {details["usage"]}<br>
+            <b>Price Information:</b><br>{price_info}
+            """
+
+# --- Scan Cache Helpers ---
+def identify_failure():
+    """Message and status for a scan Gemini could not identify: 503 while its circuit is open."""
+    if upstreams["gemini"].breaker.state == "open":
+        return "Error: Product lookup is temporarily unavailable. Try again shortly.", 503
+    return "Error: Could not get a response from Gemini API. Try again.", 500
+
+def frame_hash(image_data):
+    """Perceptual hash of the uploaded frame, or None if it cannot be decoded."""
+    try:
+        return perceptual_hash(image_data)
+    except Exception as e:
+        print(f"Error hashing frame: {e}")
+        return None
+
 # --- Flask Routes ---
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/scan', methods=['POST'])
-def scan_product():
-    """Handles the image upload and product information retrieval."""
-    data = request.get_json()
-    if not data or 'image' not in data:
-        return jsonify({"message": "Error: No image data received."}), 400
-
-    image_data = base64.b64decode(data['image'].split(',')[1])
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"message": f"Error: Image larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}), 413
 
-    response = analyze_image_with_gemini(base64.b64encode(image_data).decode('utf-8'))
-    if not response:
-        return jsonify(
-            {"message": "Error: Could not get a response from Gemini API. Try again."}), 500
+@app.route('/cache/stats')
+def cache_stats():
+    """Reports hit/miss counters of the perceptual-hash scan cache."""
+    return jsonify(scan_cache.stats())
 
+@app.route('/scans')
+def list_scans():
+    """Scan history, newest first. Filters: product_name, brand, since, until; paging: limit, cursor."""
     try:
-        detected_product = response["candidates"][0]["content"]["parts"][0]["text"]
-        product_name_match = re.search(r'Product Name:\s*(.*?)\n', detected_product,
-                                       re.DOTALL)
-        product_name = clean_text(
-            product_name_match.group(1)) if product_name_match else "Unknown"
+        query = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+    return jsonify(history_reader.page(**query))
 
-        brand_match = re.search(r'Brand:\s*(.*?)\n', detected_product, re.DOTALL)
-        brand = clean_text(brand_match.group(1)) if brand_match else "Unknown"
+@app.route('/scans/stats')
+def scans_stats():
+    """Reports written/dropped counters and queue depth of the scan history writer."""
+    return jsonify(scan_writer.stats())
 
-        brand_details_match = re.search(r'Brand Details:\s*(.*?)\n', detected_product,
-                                           re.DOTALL)
-        brand_details = clean_text(
-            brand_details_match.group(1)) if brand_details_match else "Not available."
+@app.route('/upstream/stats')
+def upstream_stats():
+    """Reports circuit breaker state and hedging counters of the Gemini and Google Search clients."""
+    return jsonify({name: upstream.stats() for name, upstream in upstreams.items()})
 
-        release_date_match = re.search(r'Release Date:\s*(.*?)\n', detected_product,
-                                       re.DOTALL)
+@app.route('/coalescing/stats')
+def coalescing_stats():
+    """Reports, per lookup, Gemini calls made and how many lookups shared one instead."""
+    return jsonify(lookups.stats())
 
-        if release_date_match:
-            raw_date = release_date_match.group(1).strip()
-            try:
-                # Attempt to parse the date
-                formatted_date = datetime.strptime(raw_date,
-                                                   "%B %d, %Y").strftime("%m/%d/%Y")
-            except ValueError:
-                # If parsing fails, just clean the text
-                formatted_date = clean_text(raw_date)
-        else:
-            formatted_date = "Not available."
-        usage_match = re.search(r'Used for:\s*(.*?)\n', detected_product + '\n',
-                               re.DOTALL)
-        usage = clean_text(usage_match.group(1)) if usage_match else "Not available."
-
-        if usage == "Not available.":
-            usage = fetch_usage_with_gemini(product_name)
-
-        price_info = ""
-        lazada_url, shopee_url = search_shopee_lazada_price(product_name)
-        price_info += f"<a href='{lazada_url}' target='_blank'>Lazada - {product_name}</a>"
-        price_info += f"<br><a href='{shopee_url}' target='_blank'>Shopee - {product_name}</a>"
-        gemini_price = get_gemini_price(product_name)
-        price_info += "<br>" + gemini_price
-
-        formatted_result = f"""
-            <b>Product Name:</b> {product_name}<br>
-            <b>Brand:</b> {brand}<br>
-            <b>Brand Details:</b> {brand_details}<br>
-            <b>Release Date:</b> {formatted_date}<br>
-            <b>What is it used for?</b> {usage}<br>
-            <b>Price Information:</b><br>{price_info}
-            """
+@app.route('/scan', methods=['POST'])
+def scan_product():
+    """Handles the image upload (raw image, multipart or JSON data URL) and product information retrieval."""
+    try:
+        upload = read_scan_upload(request)
+        # Repeated scans of the same item skip the Gemini calls entirely. With the cache
+        # disabled nothing here decodes the image: the base64 text goes to Gemini as sent.
+        phash = frame_hash(upload.data) if SCAN_CACHE_SIZE else None
+    except UploadError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+
+    if phash is not None:
+        cached = scan_cache.get(phash)
+        if cached is not None:
+            if cached.get("scan"):  # A repeat scan still goes into the history
+                scan_writer.record(cached["scan"])
+            return jsonify({"message": cached["message"]})
+
+    budget = Budget(SCAN_BUDGET)  # Shared by every upstream call of this scan
+    response = budget.run(analyze_image_with_gemini, upload.b64, upload.mime_type)
+    if not response:
+        message, status = identify_failure()
+        return jsonify({"message": message}), status
+
+    try:
+        details = parse_product_details(response_text(response))
+        if details["usage"] == "Not available.":
+            details["usage"] = budget.run(fetch_usage_with_gemini, details["product_name"])
+        scan = dict(details, price=budget.run(get_gemini_price, details["product_name"]))
+        formatted_result = format_product_result(details, scan["price"])
+        scan_writer.record(scan)
+        if phash is not None and not is_degraded(scan):
+            scan_cache.put(phash, {"message": formatted_result, "scan": scan})
         return jsonify({"message": formatted_result})
 
     except Exception as e:
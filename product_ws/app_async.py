@@ -0,0 +1,204 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from quart import Quart, render_template, request, jsonify
+
+from app import (GEMINI_API_KEY, GEMINI_API_URL, GEMINI_HEADERS, SCAN_CACHE_SIZE, SCAN_BUDGET, scan_cache,
+                 scan_writer, history_reader, upstreams, clean_text, response_text, identify_payload, usage_payload,
+                 price_payload, price_from_response, parse_product_details, format_product_result, frame_hash,
+                 identify_failure, lookups, product_key)
+from prodscan_common.resilience import Budget, UpstreamUnavailable, is_degraded
+from prodscan_common.scan_history import parse_history_args
+from prodscan_common.uploads import MAX_UPLOAD_BYTES, UploadError, read_scan_upload_async
+
+# Async serving mode of app.py: same '/' and '/scan' contract, one event loop per process.
+# Gemini calls are awaited on a shared httpx client (usage and price concurrently) and
+# frame hashing runs on a small thread pool, so a waiting scan holds no thread.
+#
+#     hypercorn app_async:app --bind 0.0.0.0:2502
+
+app = Quart(__name__, static_folder="static")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES  # Larger uploads get a 413
+
+# --- Concurrency ---
+# Scans beyond MAX_IN_FLIGHT wait up to ADMISSION_TIMEOUT seconds for a slot, then get a 503.
+MAX_IN_FLIGHT = int(os.environ.get("PRODSCAN_MAX_IN_FLIGHT", 256))
+ADMISSION_TIMEOUT = float(os.environ.get("PRODSCAN_ADMISSION_TIMEOUT", 10))
+CPU_WORKERS = int(os.environ.get("PRODSCAN_CPU_WORKERS", 0)) or min(8, os.cpu_count() or 1)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("PRODSCAN_HTTP_MAX_CONNECTIONS", 100))
+
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="scan-cpu")
+client = None  # httpx.AsyncClient, opened with the event loop
+admission = None  # asyncio.Semaphore(MAX_IN_FLIGHT)
+
+
+@app.before_serving
+async def open_client():
+    global client, admission
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(15.0, connect=3.05),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_CONNECTIONS))
+    admission = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+
+
+async def run_in_cpu_pool(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, function, *args)
+
+
+# --- Gemini Requests ---
+UPSTREAM_ERRORS = (httpx.HTTPError, UpstreamUnavailable)
+
+
+async def gemini_post(payload, hedge=True):
+    """Async app.gemini_post, through the same "gemini" Upstream (budget, breaker, hedging)."""
+    async def send(timeout):
+        connect, read = timeout
+        response = await client.post(GEMINI_API_URL, params={"key": GEMINI_API_KEY}, json=payload,
+                                     headers=GEMINI_HEADERS, timeout=httpx.Timeout(read, connect=connect))
+        response.raise_for_status()
+        return response.json()
+    return await upstreams["gemini"].acall(send, hedge=hedge)
+
+
+async def analyze_image_with_gemini(image_data, mime_type="image/jpeg"):
+    """Sends image to Gemini API for analysis."""
+    try:
+        return await gemini_post(identify_payload(image_data, mime_type), hedge=False)
+    except UPSTREAM_ERRORS + (ValueError,) as e:  # ValueError: body was not JSON
+        print("Error calling Gemini API:", e)
+        return None
+
+
+@lookups.acoalesced("usage", key=product_key)
+async def fetch_usage_with_gemini(product_name):
+    """Gets product usage from Gemini (fallback)."""
+    try:
+        return clean_text(response_text(await gemini_post(usage_payload(product_name))))
+    except UPSTREAM_ERRORS + (ValueError,) as e:
+        print(f"Error fetching product usage:", e)
+        return "Not available."
+
+
+@lookups.acoalesced("gemini_price", key=product_key)
+async def get_gemini_price(product_name):
+    """Retrieves the price of a product from Gemini, given the product name."""
+    try:
+        return price_from_response(await gemini_post(price_payload(product_name)))
+    except UPSTREAM_ERRORS + (ValueError,) as e:
+        print(f"Error fetching price from Gemini: {e}")
+        return "Error retrieving price from Gemini."
+    except Exception as e:
+        print(f"Error processing Gemini response: {e}")
+        return "Error processing Gemini's price response."
+
+
+# --- Quart Routes ---
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+
+@app.errorhandler(413)
+async def upload_too_large(e):
+    return jsonify({"message": f"Error: Image larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}), 413
+
+
+@app.route('/cache/stats')
+async def cache_stats():
+    """Reports hit/miss counters of the perceptual-hash scan cache."""
+    return jsonify(scan_cache.stats())
+
+
+@app.route('/scans')
+async def list_scans():
+    """Scan history, newest first. Filters: product_name, brand, since, until; paging: limit, cursor."""
+    try:
+        query = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+    page = await asyncio.get_running_loop().run_in_executor(None, lambda: history_reader.page(**query))
+    return jsonify(page)
+
+
+@app.route('/scans/stats')
+async def scans_stats():
+    """Reports written/dropped counters and queue depth of the scan history writer."""
+    return jsonify(scan_writer.stats())
+
+
+@app.route('/upstream/stats')
+async def upstream_stats():
+    """Reports circuit breaker state and hedging counters of the Gemini client."""
+    return jsonify({name: upstream.stats() for name, upstream in upstreams.items()})
+
+
+@app.route('/coalescing/stats')
+async def coalescing_stats():
+    """Reports, per lookup, Gemini calls made and how many lookups shared one instead."""
+    return jsonify(lookups.stats())
+
+
+@app.route('/scan', methods=['POST'])
+async def scan_product():
+    """Same contract as app.scan_product, limited to MAX_IN_FLIGHT concurrent scans."""
+    try:
+        await asyncio.wait_for(admission.acquire(), ADMISSION_TIMEOUT)
+    except asyncio.TimeoutError:
+        return jsonify({"message": "Error: Server busy, try again."}), 503
+    try:
+        # Every Gemini call of the scan, including the concurrent lookups, shares one budget
+        return await Budget(SCAN_BUDGET).arun(handle_scan())
+    finally:
+        admission.release()
+
+
+async def handle_scan():
+    try:
+        upload = await read_scan_upload_async(request)
+        # With the cache disabled the base64 text goes to Gemini as sent, never decoded
+        phash = await run_in_cpu_pool(frame_hash, upload.data) if SCAN_CACHE_SIZE else None
+    except UploadError as e:
+        return jsonify({"message": f"Error: {e}"}), 400
+
+    if phash is not None:
+        cached = await run_in_cpu_pool(scan_cache.get, phash)
+        if cached is not None:
+            if cached.get("scan"):  # A repeat scan still goes into the history
+                scan_writer.record(cached["scan"], block=False)
+            return jsonify({"message": cached["message"]})
+
+    response = await analyze_image_with_gemini(upload.b64, upload.mime_type)
+    if not response:
+        message, status = identify_failure()
+        return jsonify({"message": message}), status
+
+    try:
+        details = parse_product_details(response_text(response))
+        # The usage follow-up (only when the answer had none) and the price lookup run together
+        lookups = [get_gemini_price(details["product_name"])]
+        if details["usage"] == "Not available.":
+            lookups.append(fetch_usage_with_gemini(details["product_name"]))
+        gemini_price, *usage = await asyncio.gather(*lookups)
+        if usage:
+            details["usage"] = usage[0]
+        scan = dict(details, price=gemini_price)
+        formatted_result = format_product_result(details, gemini_price)
+        scan_writer.record(scan, block=False)  # Never stall the event loop on a full queue
+        if phash is not None and not is_degraded(scan):
+            await run_in_cpu_pool(scan_cache.put, phash, {"message": formatted_result, "scan": scan})
+        return jsonify({"message": formatted_result})
+
+    except Exception as e:
+        print(f"Error extracting details (Gemini): {e}")
+        return jsonify({"message": "Error: Could not extract product details."}), 500
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=2502)
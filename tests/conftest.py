@@ -0,0 +1,94 @@
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # prodscan_common
+sys.path.insert(0, os.path.join(ROOT, "Ml_ws", "ML_ws"))
+
+
+class FakeClock:
+    """Stands in for a module's time import: time() returns now, which tests move by hand."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    advance = sleep
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class BrightnessModel:
+    """Test backend: a bright frame is confidently the first class (a phone), any other
+    frame gets a flat answer (not a phone, so the scan asks Gemini)."""
+    fork_safe = True
+
+    def __init__(self, model_path, num_threads=None):
+        pass
+
+    def predict(self, batch):
+        bright = batch.reshape(len(batch), -1).mean(axis=1) > 0.5
+        return np.where(bright[:, None], [[0.9, 0.1]], [[0.5, 0.5]]).astype(np.float32)
+
+
+def frame(seed, bright=True):
+    """A JPEG of coloured noise; different seeds give frames the scan cache tells apart."""
+    pixels = np.random.default_rng(seed).integers(0, 96, (240, 320, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels + 160 if bright else pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def web(tmp_path_factory):
+    """web.py serving BrightnessModel, with Gemini and Custom Search answered at once by
+    bench/fake_upstreams.py. The fake Gemini leaves usage and price out of every
+    identification, so not-phone scans also make both follow-up calls.
+
+    web.py opens its databases and model_bundle/ relative to the working directory, so
+    the session stays in a temporary one from the first test that uses the app.
+    """
+    import backends
+    from bench import fake_upstreams
+    from model_bundle import write_manifest
+
+    workdir = tmp_path_factory.mktemp("web")
+    write_manifest(str(workdir / "model_bundle"), ["apple_iphone_15", "samsung_galaxy_a54"], (64, 64), None,
+                   artifacts={"brightness": "brightness.model"})
+    profile = fake_upstreams.UpstreamProfile(latency_ms=0, latency_sigma=0, partial_ratio=1.0, malformed_ratio=0.0)
+    gemini = fake_upstreams.start_gemini(0, profile)
+    search = fake_upstreams.start_search(0, profile)
+    env = {"PRODSCAN_MODEL_BACKEND": "brightness", "PRODSCAN_STARTUP": "eager",
+           "PRODSCAN_GEMINI_API_URL": f"http://127.0.0.1:{gemini.server_port}/generateContent",
+           "PRODSCAN_GOOGLE_SEARCH_URL": f"http://127.0.0.1:{search.server_port}/customsearch/v1"}
+    saved_env, saved_cwd = {name: os.environ.get(name) for name in env}, os.getcwd()
+    os.environ.update(env)
+    os.chdir(workdir)
+    backends.BACKENDS["brightness"] = BrightnessModel
+    import web
+    assert web.model_state == "ready"
+    yield web
+
+    gemini.stop()
+    search.stop()
+    os.chdir(saved_cwd)
+    for name, value in saved_env.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
@@ -0,0 +1,152 @@
+import sys
+from types import ModuleType, SimpleNamespace
+
+import numpy as np
+import pytest
+
+from backends import BACKENDS, OnnxBackend, TFLiteBackend, load_backend, pooling_layer, weight_sharing
+from model_bundle import legacy_bundle
+
+
+class FakeInterpreter:
+    """The slice of the TFLite interpreter API TFLiteBackend uses, for an int8 model
+    whose output is its input, dequantized."""
+
+    def __init__(self, batch_size=1):
+        self.shape = [batch_size, 2, 2, 3]
+        self.allocations = 0
+        self.tensor = None
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array(self.shape), "dtype": np.int8, "quantization": (0.5, -1)}]
+
+    def get_output_details(self):
+        return [{"index": 1, "dtype": np.int8, "quantization": (0.5, -1)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = list(shape)
+
+    def allocate_tensors(self):
+        self.allocations += 1
+
+    def set_tensor(self, index, value):
+        assert value.dtype == np.int8 and list(value.shape) == self.shape
+        self.tensor = value
+
+    def invoke(self):
+        pass
+
+    def get_tensor(self, index):
+        return self.tensor
+
+
+def tflite_backend(interpreter):
+    backend = TFLiteBackend.__new__(TFLiteBackend)  # Skips importing a TFLite runtime
+    backend.interpreter = interpreter
+    backend.input_detail = interpreter.get_input_details()[0]
+    backend.output_detail = interpreter.get_output_details()[0]
+    backend._batch_size = interpreter.shape[0]
+    return backend
+
+
+class FakeSession:
+    """An ONNX Runtime session whose outputs are slices of its input."""
+    outputs = ("probabilities", "embedding")
+
+    def __init__(self, path, sess_options=None, providers=None):
+        self.path = path
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input")]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name=name) for name in self.outputs]
+
+    def run(self, names, feeds):
+        batch = feeds["input"]
+        outputs = {"probabilities": batch.reshape(len(batch), -1)[:, :2], "embedding": batch.reshape(len(batch), -1)}
+        return [outputs[name] for name in names]
+
+
+@pytest.fixture
+def onnxruntime(monkeypatch):
+    """Lets OnnxBackend import an onnxruntime that builds FakeSessions."""
+    module = ModuleType("onnxruntime")
+    module.SessionOptions = SimpleNamespace
+    module.InferenceSession = FakeSession
+    monkeypatch.setitem(sys.modules, "onnxruntime", module)
+    return module
+
+
+def test_tflite_workers_share_memory_mapped_weights():
+    assert weight_sharing("tflite_float16") == "mmap"
+    assert weight_sharing("tflite_int8") == "mmap"
+
+
+def test_keras_and_onnx_weights_are_private_to_each_worker():
+    assert weight_sharing("keras") is None
+    assert weight_sharing("onnx") is None
+
+
+def test_fork_safe_backend_is_shared_from_the_master(monkeypatch):
+    class NumpyBackend:
+        fork_safe = True
+
+    monkeypatch.setitem(BACKENDS, "numpy", NumpyBackend)
+    assert weight_sharing("numpy") == "fork"
+    assert weight_sharing("missing") is None
+
+
+def test_load_backend_checks_the_name_and_the_bundle_artifacts(tmp_path):
+    bundle = legacy_bundle("model.h5", str(tmp_path), (224, 224))
+    with pytest.raises(ValueError):
+        load_backend("tensorrt", bundle)
+    with pytest.raises(FileNotFoundError):
+        load_backend("tflite_int8", bundle)
+
+
+def test_int8_tflite_quantizes_inputs_and_dequantizes_outputs():
+    backend = tflite_backend(FakeInterpreter())
+    batch = np.array([[[[0.0, 0.5, 1.0], [-1.0, 100.0, -100.0]]] * 2], dtype=np.float32)
+    output = backend.predict(batch)
+    # Quantized as round(x / 0.5) - 1 and clipped to int8, then mapped back
+    expected = np.clip(np.round(batch / 0.5) - 1, -128, 127)
+    np.testing.assert_array_equal(output, (expected + 1) * 0.5)
+
+
+def test_tflite_reallocates_only_when_the_batch_size_changes():
+    interpreter = FakeInterpreter()
+    backend = tflite_backend(interpreter)
+    for size in (1, 4, 4, 4, 1):
+        backend.predict(np.zeros((size, 2, 2, 3), dtype=np.float32))
+    assert interpreter.allocations == 2
+
+
+def test_onnx_embedding_output_is_optional(onnxruntime, monkeypatch):
+    backend = OnnxBackend("model.onnx")
+    batch = np.arange(24, dtype=np.float64).reshape(2, 2, 2, 3)
+    probabilities, embeddings = backend.predict_with_embedding(batch)
+    assert probabilities.shape == (2, 2) and embeddings.shape == (2, 12)
+    assert embeddings.dtype == np.float32
+
+    monkeypatch.setattr(FakeSession, "outputs", ("probabilities",))  # An export without the embedding output
+    backend = OnnxBackend("model.onnx")
+    assert backend.predict_with_embedding is None
+    assert backend.predict(batch).shape == (2, 2)
+
+
+def test_load_backend_builds_onnx_from_its_artifact(onnxruntime, tmp_path):
+    bundle = legacy_bundle("model.h5", str(tmp_path), (224, 224))._replace(artifacts={"onnx": "bundle/model.onnx"})
+    backend = load_backend("onnx", bundle, num_threads=2)
+    assert backend.session.path == "bundle/model.onnx"
+
+
+def test_embeddings_come_from_the_global_pooling_layer():
+    class GlobalAveragePooling2D:
+        pass
+
+    pooling = GlobalAveragePooling2D()
+    model = SimpleNamespace(layers=[object(), pooling, object()])
+    assert pooling_layer(model) is pooling
+    with pytest.raises(ValueError):
+        pooling_layer(SimpleNamespace(layers=[object()]))
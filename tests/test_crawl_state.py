@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+from crawl_state import CrawlState
+from crawler import ModelCrawl
+
+
+def model_crawl(tmp_path):
+    return ModelCrawl("Samsung", "Galaxy A55", str(tmp_path / "samsung_galaxy_a55"), max_images=10, min_images=5)
+
+
+def finished(url, outcome, http_status=None, saved_path=None, error=None):
+    """What the Downloader hands its on_finished hook."""
+    return SimpleNamespace(url=url, outcome=outcome, http_status=http_status, saved_path=saved_path, error=error)
+
+
+def test_resume_continues_from_the_saved_cursor(tmp_path):
+    path = str(tmp_path / "crawl_state.db")
+    state = CrawlState(path)
+    crawl = model_crawl(tmp_path)
+    urls = [f"https://img.example/{i}.jpg" for i in range(6)]
+    assert state.record_page(crawl, "Samsung Galaxy A55", urls, {"ijn": "1"}) == urls
+    state.record_download(finished(urls[0], "succeeded", 200, "samsung_galaxy_a55/abc.jpg"))
+    state.record_download(finished(urls[1], "rejected", 200, error="too_small"))
+    state.record_download(finished(urls[2], "failed", 404))
+    state.record_download(finished(urls[3], "failed", 503))
+    state.record_download(finished(urls[4], "cancelled"))
+    state.record_price(crawl, "฿12,990")
+    state.close()
+
+    resumed = model_crawl(tmp_path)
+    state = CrawlState(path)
+    state.resume(resumed)
+
+    assert (resumed.pages, resumed.cursor, resumed.more_pages) == (1, {"ijn": "1"}, True)
+    assert list(resumed.urls) == urls[3:]  # The 5xx, the cancelled and the untried URL
+    assert resumed.price == "฿12,990"
+    assert state.stats() == {"pending": 2, "stored": 1, "rejected": 1, "gone": 1, "failed": 1, "pages": 1}
+
+
+def test_last_page_stops_the_search(tmp_path):
+    state = CrawlState(str(tmp_path / "crawl_state.db"))
+    crawl = model_crawl(tmp_path)
+    state.record_page(crawl, "Samsung Galaxy A55", ["https://img.example/1.jpg"], None)
+    resumed = model_crawl(tmp_path)
+    state.resume(resumed)
+    assert (resumed.pages, resumed.more_pages) == (1, False)
+
+
+def test_urls_already_seen_on_an_earlier_page_are_not_new(tmp_path):
+    state = CrawlState(str(tmp_path / "crawl_state.db"))
+    crawl = model_crawl(tmp_path)
+    state.record_page(crawl, "q", ["https://img.example/1.jpg", "https://img.example/2.jpg"], {"ijn": "1"})
+    crawl.pages = 1
+    new = state.record_page(crawl, "q", ["https://img.example/2.jpg", "https://img.example/3.jpg"], {"ijn": "2"})
+    assert new == ["https://img.example/3.jpg"]
+
+
+def test_transient_failures_are_given_up_after_max_attempts(tmp_path):
+    state = CrawlState(str(tmp_path / "crawl_state.db"), max_url_attempts=2)
+    url = "https://img.example/1.jpg"
+    state.record_page(model_crawl(tmp_path), "q", [url], None)
+    for attempt in range(2):
+        resumed = model_crawl(tmp_path)
+        state.resume(resumed)
+        assert list(resumed.urls) == [url]
+        state.record_download(finished(url, "failed", 503))
+    resumed = model_crawl(tmp_path)
+    state.resume(resumed)
+    assert list(resumed.urls) == []
+
+
+def test_stale_pages_and_prices_are_fetched_again(tmp_path):
+    state = CrawlState(str(tmp_path / "crawl_state.db"), search_max_age=-1, price_max_age=-1)
+    crawl = model_crawl(tmp_path)
+    state.record_page(crawl, "q", ["https://img.example/1.jpg"], {"ijn": "1"})
+    state.record_price(crawl, "฿12,990")
+
+    resumed = model_crawl(tmp_path)
+    state.resume(resumed)
+    assert (resumed.pages, resumed.cursor, resumed.more_pages, resumed.price) == (0, None, True, None)
+    assert state.stats()["pages"] == 0
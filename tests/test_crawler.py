@@ -0,0 +1,142 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import crawler
+from crawler import CrawlScheduler, ModelCrawl
+
+
+class FakeDownloader:
+    """Downloads "succeed" unless the URL contains "broken"; records what was asked for."""
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(4)
+        self.submitted = []
+        self.cancelled = threading.Event()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, url, path):
+        with self.lock:
+            self.submitted.append((url, path))
+        return self.pool.submit(lambda: "broken" not in url and not self.cancelled.is_set())
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def close(self):
+        self.pool.shutdown()
+        self.closed = True
+
+    def stats(self):
+        return {"succeeded": len(self.submitted), "images_per_second": 0.0, "bytes_per_second": 0.0}
+
+    def report(self):
+        return "Downloads: fake"
+
+
+def crawl(model, max_images=4, min_images=2):
+    return ModelCrawl("Acme", model, f"/data/acme_{model}", max_images, min_images)
+
+
+def paged_search(pages):
+    """search() serving pages[model] one page per call; the last page clears more_pages."""
+    calls = []
+    lock = threading.Lock()
+
+    def search(crawl):
+        with lock:
+            calls.append(crawl.model)
+            page = crawl.pages
+        model_pages = pages[crawl.model]
+        if page + 1 >= len(model_pages):
+            crawl.more_pages = False
+        return model_pages[page]
+    search.calls = calls
+    return search
+
+
+def urls(model, count, start=0, broken=()):
+    return [f"https://img.example/{model}/{'broken' if i in broken else 'ok'}/{i}.jpg"
+            for i in range(start, start + count)]
+
+
+def scheduler(downloader, search, price=lambda crawl: "฿1,000"):
+    return CrawlScheduler(downloader, search, lambda crawl, url: f"{crawl.product_dir}/{url.rsplit('/', 1)[1]}",
+                          price, search_workers=2, price_workers=1, progress_interval=0.05)
+
+
+def test_every_model_is_searched_downloaded_and_priced():
+    downloader = FakeDownloader()
+    search = paged_search({"one": [urls("one", 6)], "two": [urls("two", 3), urls("two", 3, start=3)]})
+    crawls = [crawl("one"), crawl("two")]
+    assert scheduler(downloader, search).run(crawls) is True
+    assert [(c.stage, c.downloaded, c.price) for c in crawls] == [("done", 4, "฿1,000")] * 2
+    assert sorted(search.calls) == ["one", "two", "two"]  # "two" ran out of URLs on its first page
+    assert len(downloader.submitted) == 8  # Never more downloads than max_images needs
+    assert downloader.closed
+
+
+def test_failed_downloads_are_replaced_from_the_next_page():
+    downloader = FakeDownloader()
+    search = paged_search({"one": [urls("one", 4, broken={1, 2}), urls("one", 4, start=4)]})
+    crawls = [crawl("one")]
+    scheduler(downloader, search).run(crawls)
+    assert (crawls[0].downloaded, crawls[0].failed, crawls[0].pages) == (4, 2, 2)
+
+
+def test_short_or_failing_searches_still_finish_the_crawl(capsys):
+    def search(crawl):
+        if crawl.model == "down":
+            raise RuntimeError("SerpAPI said no")
+        crawl.more_pages = False
+        return urls(crawl.model, 1)
+
+    crawls = [crawl("down"), crawl("rare")]
+    assert scheduler(FakeDownloader(), search).run(crawls) is True
+    assert [(c.stage, c.downloaded) for c in crawls] == [("done", 0), ("done", 1)]
+    out = capsys.readouterr().out
+    assert "Error during image search for Acme down" in out
+    assert "WARNING: Only 1 images for Acme rare (min: 2)." in out
+
+
+def test_resumed_crawl_uses_its_saved_urls_and_price():
+    downloader = FakeDownloader()
+    resumed = crawl("one")
+    resumed.urls.extend(urls("one", 4))
+    resumed.price = "฿999"
+
+    def nothing_to_look_up(crawl):
+        raise AssertionError(f"looked up {crawl.name}")
+
+    scheduler(downloader, nothing_to_look_up, price=nothing_to_look_up).run([resumed])
+    assert (resumed.stage, resumed.downloaded, resumed.price) == ("done", 4, "฿999")
+
+
+def test_price_errors_are_recorded_as_the_price():
+    def price(crawl):
+        raise RuntimeError("Gemini down")
+
+    crawls = [crawl("one")]
+    scheduler(FakeDownloader(), paged_search({"one": [urls("one", 4)]}), price).run(crawls)
+    assert crawls[0].price == "Error retrieving price: Gemini down"
+
+
+def test_ctrl_c_cancels_downloads_and_reports_unfinished_models(monkeypatch, capsys):
+    monkeypatch.setattr(crawler, "STOP_TIMEOUT", 1.0)
+    downloader = FakeDownloader()
+
+    def search(crawl):
+        downloader.cancelled.wait(5)  # Still searching when Ctrl-C comes
+        return urls(crawl.model, 4)
+
+    pipeline = scheduler(downloader, search)
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pipeline, "progress", interrupt)
+    crawls = [crawl("one")]
+    assert pipeline.run(crawls) is False
+    assert downloader.cancelled.is_set() and downloader.closed
+    assert crawls[0].stage != "done" and downloader.submitted == []  # No downloads after the stop
+    assert "not finished: Acme one" in capsys.readouterr().out
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloader
+from downloader import Downloader, RateLimiter
+
+BODY = b"\xff\xd8\xff" + b"\0" * 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """/flaky/<n>: 503 for the first n requests, then an image. /gone: 404. /down: always 503.
+    /slow: a 4 MiB body sent in small pieces."""
+    hits = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            hits = self.hits[self.path]
+        if self.path.startswith("/flaky/") and hits > int(self.path.rsplit("/", 1)[1]):
+            self.reply(200, BODY)
+        elif self.path.startswith("/flaky/") or self.path == "/down":
+            self.reply(503, b"busy")
+        elif self.path == "/slow":
+            self.send_response(200)
+            self.send_header("Content-Length", str(4 << 20))
+            self.end_headers()
+            try:
+                for _ in range(64):
+                    self.wfile.write(b"\0" * (64 << 10))
+                    time.sleep(0.05)
+            except OSError:
+                pass  # The client hung up
+        else:
+            self.reply(404, b"not found")
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.hits = {}
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_transient_failures_are_retried(server, tmp_path):
+    finished = []
+    downloader = Downloader(workers=2, retry_base=0.01, max_retries=3, on_finished=finished.append)
+    path = str(tmp_path / "a.jpg")
+
+    assert downloader.submit(f"{server}/flaky/2", path).result(timeout=10) is True
+    downloader.close()
+
+    with open(path, "rb") as f:
+        assert f.read() == BODY
+    assert downloader.stats()["retried"] == 2
+    assert (finished[0].outcome, finished[0].http_status) == ("succeeded", 200)
+
+
+def test_retries_stop_at_max_retries(server, tmp_path):
+    downloader = Downloader(workers=2, retry_base=0.01, max_retries=2)
+    assert downloader.submit(f"{server}/down", str(tmp_path / "a.jpg")).result(timeout=10) is False
+    downloader.close()
+    stats = downloader.stats()
+    assert (stats["failed"], stats["retried"]) == (1, 1)
+    assert Handler.hits["/down"] == 2
+
+
+def test_client_errors_are_not_retried(server, tmp_path):
+    finished = []
+    downloader = Downloader(workers=2, retry_base=0.01, on_finished=finished.append)
+    assert downloader.submit(f"{server}/gone", str(tmp_path / "a.jpg")).result(timeout=10) is False
+    downloader.close()
+    assert downloader.stats()["retried"] == 0
+    assert (finished[0].outcome, finished[0].http_status) == ("failed", 404)
+
+
+def test_cancel_settles_running_and_queued_downloads(server, tmp_path):
+    finished = []
+    downloader = Downloader(workers=2, per_host=1, on_finished=finished.append)
+    futures = [downloader.submit(f"{server}/slow", str(tmp_path / f"{i}.jpg")) for i in range(3)]
+    deadline = time.monotonic() + 5
+    while downloader.stats()["bytes"] == 0:
+        assert time.monotonic() < deadline, "the first download never started"
+        time.sleep(0.01)
+
+    downloader.cancel()
+
+    assert [future.result(timeout=5) for future in futures] == [False] * 3
+    assert [download.outcome for download in finished] == ["cancelled"] * 3
+    downloader.close()
+    assert os.listdir(tmp_path) == []  # No .part file left behind
+
+
+def release_times(limiter, clock, count):
+    started = clock.now
+    times = []
+    for _ in range(count):
+        limiter.acquire()
+        times.append(round(clock.now - started, 3))
+    return times
+
+
+def test_rate_limiter_allows_one_burst(monkeypatch, clock):
+    monkeypatch.setattr(downloader, "time", clock)
+    limiter = RateLimiter(2)  # 2 per second, bursts of 1 second's worth
+    assert release_times(limiter, clock, 5) == [0, 0, 0.5, 1.0, 1.5]
+
+
+def test_rate_limiter_burst_does_not_grow_while_idle(monkeypatch, clock):
+    monkeypatch.setattr(downloader, "time", clock)
+    limiter = RateLimiter(2)
+    release_times(limiter, clock, 3)
+    clock.advance(60)
+    assert release_times(limiter, clock, 4) == [0, 0, 0.5, 1.0]
@@ -0,0 +1,111 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from embedding_index import INDEX_FILE, FlatIndex, IVFPQIndex, load_index
+
+DIM = 32
+
+
+def clusters(count, per_cluster, seed=0, noise=0.05):
+    """per_cluster noisy copies of count random directions, labelled product_<n>."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((count, DIM)).astype(np.float32)
+    vectors = np.repeat(centers, per_cluster, axis=0)
+    vectors += noise * rng.standard_normal(vectors.shape).astype(np.float32)
+    labels = [f"product_{n}" for n in range(count) for _ in range(per_cluster)]
+    return centers, vectors, labels
+
+
+def test_flat_search_is_exact_cosine():
+    index = FlatIndex(3)
+    index.add([[1, 0, 0], [0, 2, 0], [1, 1, 0]], ["a", "b", "a"])
+    scores, ids = index.search([[2, 0, 0]], k=2)
+    assert ids.tolist() == [[0, 2]]
+    np.testing.assert_allclose(scores, [[1.0, np.sqrt(0.5)]], rtol=1e-6)
+    assert index.match([[0, 1, 0]], k=3) == [[("b", pytest.approx(1.0)), ("a", pytest.approx(np.sqrt(0.5)))]]
+    assert index.stats() == {"kind": "flat", "dim": 3, "size": 3, "labels": 2}
+
+
+def test_add_checks_one_label_per_vector():
+    with pytest.raises(ValueError):
+        FlatIndex(3).add([[1, 0, 0], [0, 1, 0]], ["a"])
+    with pytest.raises(RuntimeError):
+        IVFPQIndex(DIM, m=8).add(np.ones((1, DIM)), ["a"])  # Not trained
+
+
+def test_flat_round_trip_is_memory_mapped_and_still_grows(tmp_path):
+    centers, vectors, labels = clusters(4, 5)
+    index = FlatIndex(DIM)
+    index.add(vectors, labels)
+    index.metadata = {"model_version": "7"}
+    index.save(str(tmp_path))
+
+    loaded = load_index(str(tmp_path))
+    assert isinstance(loaded._vectors.base, np.memmap)
+    assert (loaded.kind, len(loaded), loaded.metadata) == ("flat", 20, {"model_version": "7"})
+    np.testing.assert_allclose(loaded.vectors(), index.vectors())
+
+    # Adds after the load go to the in-memory tail; the mapped file is never written
+    loaded.add(-centers[:1], ["product_new"])
+    scores, ids = loaded.search(-centers[:1], k=1)
+    assert ids.tolist() == [[20]] and loaded.labels_of(ids[0]) == ["product_new"]
+    assert [label for label, _ in loaded.match(centers[2:3], k=3)[0]] == ["product_2"]
+    assert json.loads((tmp_path / INDEX_FILE).read_text())["count"] == 20
+
+    loaded.save(str(tmp_path))
+    again = load_index(str(tmp_path), mmap=False)
+    assert len(again) == 21 and again.label_names[-1] == "product_new"
+
+
+def test_ivfpq_finds_the_right_product():
+    centers, vectors, labels = clusters(16, 20)
+    index = IVFPQIndex(DIM, nlist=8, m=8, nprobe=4)
+    index.train(vectors)
+    index.add(vectors, labels)
+    assert index.stats()["bytes_per_vector"] == 8
+    best = [matches[0][0] for matches in index.match(centers, k=5)]
+    assert best == [f"product_{n}" for n in range(16)]
+
+
+def test_ivfpq_pads_short_results():
+    _, vectors, labels = clusters(2, 4)
+    index = IVFPQIndex(DIM, nlist=2, m=8, nprobe=1)
+    index.train(vectors)
+    index.add(vectors, labels)
+    scores, ids = index.search(vectors[:1], k=8)  # Only 4 rows in the probed cluster
+    assert (ids[0] == -1).sum() == 4 and np.isneginf(scores[0][ids[0] == -1]).all()
+    assert index.labels_of(ids[0])[-1] is None
+
+
+def test_ivfpq_round_trip_then_add(tmp_path):
+    centers, vectors, labels = clusters(8, 10)
+    index = IVFPQIndex(DIM, nlist=4, m=8, nprobe=4)
+    index.train(vectors)
+    index.add(vectors, labels)
+    index.save(str(tmp_path))
+    before = index.search(centers, k=5)
+
+    loaded = load_index(str(tmp_path))
+    assert isinstance(loaded._codes.base, np.memmap)
+    assert (loaded.nlist, loaded.m, loaded.nprobe) == (4, 8, 4)
+    for expected, found in zip(before, loaded.search(centers, k=5)):
+        np.testing.assert_array_equal(expected, found)
+
+    loaded.add(centers[:1], ["product_0_new_photo"])  # Invalidates the inverted lists
+    assert 80 in loaded.search(centers[:1], k=3)[1][0]
+
+
+def test_load_refuses_other_format_versions(tmp_path):
+    index = FlatIndex(3)
+    index.add([[1, 0, 0]], ["a"])
+    index.save(str(tmp_path))
+    manifest = json.loads((tmp_path / INDEX_FILE).read_text())
+    manifest["format_version"] += 1
+    with open(tmp_path / INDEX_FILE, "w") as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        load_index(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == [INDEX_FILE, "label_ids.npy", "vectors.npy"]
@@ -0,0 +1,69 @@
+import enrichment_cache
+from enrichment_cache import LocalNetworkTier, MemoryTier, TieredCache
+
+
+class Fetcher:
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.answers.pop(0)
+
+
+def make_cache(monkeypatch, clock, tiers=None):
+    monkeypatch.setattr(enrichment_cache, "time", clock)
+    return TieredCache(tiers or [MemoryTier()], {"usage": 10}, {"usage": 20})
+
+
+def test_fresh_answer_is_served_without_fetching(monkeypatch, clock):
+    cache = make_cache(monkeypatch, clock)
+    fetch = Fetcher("first")
+    assert cache.get_or_fetch("usage", "Galaxy A55", fetch) == "first"
+    clock.advance(9)
+    assert cache.get_or_fetch("usage", "  galaxy   a55 ", fetch) == "first"
+    assert fetch.calls == 1
+    assert cache.stats()["usage"]["memory_hits"] == 1
+
+
+def test_stale_answer_is_served_while_it_refreshes(monkeypatch, clock):
+    cache = make_cache(monkeypatch, clock)
+    fetch = Fetcher("first", "second")
+    cache.get_or_fetch("usage", "Galaxy A55", fetch)
+    clock.advance(15)  # Past the ttl, within the stale window
+
+    assert cache.get_or_fetch("usage", "Galaxy A55", fetch) == "first"
+    cache._refresh_pool.shutdown(wait=True)
+    assert fetch.calls == 2
+    assert cache.stats()["usage"]["stale_hits"] == 1
+    assert cache.stats()["usage"]["refreshes"] == 1
+    assert cache.get_or_fetch("usage", "Galaxy A55", fetch) == "second"
+
+
+def test_answer_past_the_stale_window_is_fetched_again(monkeypatch, clock):
+    cache = make_cache(monkeypatch, clock)
+    fetch = Fetcher("first", "second")
+    cache.get_or_fetch("usage", "Galaxy A55", fetch)
+    clock.advance(31)
+    assert cache.get_or_fetch("usage", "Galaxy A55", fetch) == "second"
+    assert cache.stats()["usage"]["misses"] == 2
+
+
+def test_uncacheable_answers_are_not_stored(monkeypatch, clock):
+    cache = make_cache(monkeypatch, clock)
+    fetch = Fetcher("Not available.", "real answer")
+    should_cache = lambda value: value != "Not available."
+    assert cache.get_or_fetch("usage", "Galaxy A55", fetch, should_cache) == "Not available."
+    assert cache.get_or_fetch("usage", "Galaxy A55", fetch, should_cache) == "real answer"
+    assert fetch.calls == 2
+
+
+def test_slower_tier_hit_is_promoted_with_its_age(monkeypatch, clock):
+    memory, network = MemoryTier(), LocalNetworkTier()
+    cache = make_cache(monkeypatch, clock, [memory, network])
+    network.set("usage:galaxy a55", "shared", clock.now - 5, 30)
+
+    assert cache.get_or_fetch("usage", "Galaxy A55", Fetcher()) == "shared"
+    assert memory.get("usage:galaxy a55") == ("shared", clock.now - 5)
+    assert cache.stats()["usage"]["network_hits"] == 1
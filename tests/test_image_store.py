@@ -0,0 +1,97 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from downloader import Rejected
+from image_store import ImageStore
+
+
+def photo(seed, size=(256, 256), quality=90):
+    """A smooth product-shot stand-in; resizes and re-encodes of one seed share its pHash."""
+    blocks = np.random.default_rng(seed).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    image = Image.fromarray(blocks).resize((256, 256), Image.BILINEAR).resize(size)
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ImageStore(str(tmp_path / "data"))
+    yield store
+    store.close()
+
+
+def download(store, label, data, name="download.jpg"):
+    """What the Downloader does: write a .part file in the label directory, then add() it."""
+    label_dir = os.path.join(store.data_dir, label)
+    os.makedirs(label_dir, exist_ok=True)
+    partial_path = os.path.join(label_dir, name + ".part")
+    with open(partial_path, "wb") as f:
+        f.write(data)
+    return store.add(partial_path, os.path.join(label_dir, name))
+
+
+def rejection(store, label, data):
+    with pytest.raises(Rejected) as raised:
+        download(store, label, data)
+    return raised.value.reason
+
+
+def test_images_are_stored_under_their_sha256(store):
+    path = download(store, "acme_one", photo(1))
+    name = os.path.basename(path)
+    assert len(name) == len("0" * 64 + ".jpg") and os.listdir(os.path.dirname(path)) == [name]
+    assert rejection(store, "acme_one", photo(1)) == "duplicate"
+    assert rejection(store, "acme_two", photo(1)) == "duplicate"  # Exact copies anywhere in the store
+
+
+def test_near_duplicates_are_dropped_within_and_across_labels(store):
+    download(store, "acme_one", photo(1))
+    assert rejection(store, "acme_one", photo(1, size=(200, 200), quality=60)) == "near_duplicate"
+    assert rejection(store, "acme_two", photo(1, size=(320, 320), quality=75)) == "cross_class_duplicate"
+    download(store, "acme_two", photo(2))
+    assert rejection(store, "acme_one", b"<html>not an image</html>") == "undecodable"
+    assert store.counts() == {"acme_one": 1, "acme_two": 1}
+    assert store.stats() == {"stored": 2, "duplicate": 0, "near_duplicate": 1, "cross_class_duplicate": 1,
+                             "undecodable": 1, "images": 2}
+    assert "2 new images stored, 2 duplicates dropped" in store.report()
+
+
+def test_index_survives_a_reopen(tmp_path):
+    store = ImageStore(str(tmp_path / "data"))
+    download(store, "acme_one", photo(1))
+    store.close()
+    reopened = ImageStore(str(tmp_path / "data"))
+    try:
+        assert rejection(reopened, "acme_one", photo(1, quality=70)) == "near_duplicate"
+        assert reopened.stats()["images"] == 1
+    finally:
+        reopened.close()
+
+
+def test_sync_indexes_existing_files_and_prunes_their_duplicates(store, capsys):
+    def existing(label, name, data):
+        os.makedirs(os.path.join(store.data_dir, label), exist_ok=True)
+        with open(os.path.join(store.data_dir, label, name), "wb") as f:
+            f.write(data)
+
+    gone = download(store, "acme_one", photo(3))
+    os.remove(gone)
+    existing("acme_one", "a.jpg", photo(1))
+    existing("acme_one", "b.jpg", photo(1, quality=70))
+    existing("acme_two", "c.jpg", photo(2))
+    existing("acme_two", "notes.txt", b"not an image")
+    existing("train", "d.jpg", photo(1))  # A split made by train.py, not a label
+
+    store.sync()
+    assert store.counts() == {"acme_one": 1, "acme_two": 1}
+    assert os.path.exists(os.path.join(store.data_dir, "acme_one", "b.jpg"))
+    assert "1 deleted images forgotten, 1 existing duplicates kept" in capsys.readouterr().out
+
+    store.sync(prune=True)
+    assert sorted(os.listdir(os.path.join(store.data_dir, "acme_one"))) == ["a.jpg"]
+    assert download(store, "acme_one", photo(3))  # Its deleted copy no longer blocks it
@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+import pytest
+
+from inference import BatchingPredictor, QueueFull
+
+
+class RecordingModel:
+    def __init__(self, delay=0.0):
+        self.batch_sizes = []
+        self.delay = delay
+
+    def __call__(self, inputs):
+        self.batch_sizes.append(len(inputs))
+        time.sleep(self.delay)
+        return inputs.reshape(len(inputs), -1).sum(axis=1, keepdims=True)
+
+
+def test_concurrent_requests_share_one_forward_pass():
+    model = RecordingModel()
+    predictor = BatchingPredictor(model, max_batch_size=4, max_wait_ms=1000)
+    started = time.monotonic()
+    futures = [predictor.submit(np.full((2, 2, 1), i, dtype=np.float32)) for i in range(4)]
+
+    assert [future.result(timeout=5)[0] for future in futures] == [0, 4, 8, 12]
+    assert model.batch_sizes == [4]
+    assert time.monotonic() - started < 1.0  # A full batch does not wait out max_wait_ms
+    assert predictor.stats()["batch_size_histogram"]["4"] == 1
+
+
+def test_lone_request_runs_after_max_wait():
+    model = RecordingModel()
+    predictor = BatchingPredictor(model, max_batch_size=8, max_wait_ms=50)
+    started = time.monotonic()
+    assert predictor.predict(np.ones((2, 2, 1), dtype=np.float32), timeout=5)[0] == 4
+    assert time.monotonic() - started >= 0.045
+    assert model.batch_sizes == [1]
+
+
+def test_batches_never_exceed_max_batch_size():
+    model = RecordingModel(delay=0.02)
+    predictor = BatchingPredictor(model, max_batch_size=3, max_wait_ms=20)
+    futures = [predictor.submit(np.zeros((1, 1, 1), dtype=np.float32)) for _ in range(10)]
+    for future in futures:
+        future.result(timeout=5)
+    assert sum(model.batch_sizes) == 10
+    assert max(model.batch_sizes) <= 3
+
+
+def test_predict_times_out_on_a_slow_model():
+    release = threading.Event()
+    predictor = BatchingPredictor(lambda inputs: release.wait(5) and inputs, max_batch_size=1, max_wait_ms=0)
+    with pytest.raises(FutureTimeoutError):
+        predictor.predict(np.zeros((1, 1, 1), dtype=np.float32), timeout=0.05)
+    release.set()
+
+
+def test_model_error_fails_every_request_in_the_batch():
+    def broken(inputs):
+        raise RuntimeError("out of memory")
+
+    predictor = BatchingPredictor(broken, max_batch_size=2, max_wait_ms=1000)
+    futures = [predictor.submit(np.zeros((1, 1, 1), dtype=np.float32)) for _ in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert predictor.stats()["errors"] == 1
+
+
+def test_full_queue_raises_instead_of_blocking():
+    release = threading.Event()
+    predictor = BatchingPredictor(lambda inputs: release.wait(5) and inputs, max_batch_size=1,
+                                  max_wait_ms=0, max_queue_size=1)
+    image = np.zeros((1, 1, 1), dtype=np.float32)
+    running = predictor.submit(image)
+    while predictor.stats()["queue_depth"]:  # Wait for the worker to take it off the queue
+        time.sleep(0.001)
+    waiting = predictor.submit(image)
+
+    with pytest.raises(QueueFull):
+        predictor.submit(image)
+    started = time.monotonic()
+    with pytest.raises(QueueFull):
+        predictor.predict(image, timeout=0.05)  # Its timeout also bounds the wait for room
+    assert time.monotonic() - started < 1.0
+    assert predictor.stats()["rejected"] == 2
+
+    release.set()
+    running.result(timeout=5)
+    waiting.result(timeout=5)
@@ -0,0 +1,90 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import ingest
+from downloader import Rejected
+from image_store import ImageStore
+from ingest import Ingest, rejection_report, sniff_image_type
+
+
+def encoded(image, image_format="JPEG"):
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def source(tmp_path, data):
+    path = tmp_path / "download.part"
+    path.write_bytes(data)
+    return str(path)
+
+
+def normalize(tmp_path, data, **options):
+    """The image Ingest(**options) writes for data."""
+    target = str(tmp_path / "normalized")
+    Ingest(None, **options).normalize(source(tmp_path, data), target)
+    return Image.open(target)
+
+
+def reason(tmp_path, data, **options):
+    with pytest.raises(Rejected) as raised:
+        normalize(tmp_path, data, **options)
+    return raised.value.reason
+
+
+def test_large_jpeg_is_scaled_to_max_edge(tmp_path):
+    image = normalize(tmp_path, encoded(Image.new("RGB", (3000, 2000), (200, 30, 30))), max_edge=640)
+    assert (image.format, image.mode, image.size) == ("JPEG", "RGB", (640, 427))
+    assert normalize(tmp_path, encoded(Image.new("RGB", (300, 200)))).size == (300, 200)  # Never scaled up
+
+
+def test_transparent_png_is_flattened_onto_white(tmp_path):
+    image = normalize(tmp_path, encoded(Image.new("RGBA", (200, 200), (0, 0, 0, 0)), "PNG"), image_format="WEBP")
+    assert (image.format, image.mode) == ("WEBP", "RGB")
+    assert all(channel > 245 for channel in image.getpixel((100, 100)))
+
+
+def test_images_failing_a_check_are_rejected_by_reason(tmp_path, monkeypatch):
+    jpeg = encoded(Image.new("RGB", (400, 300), (10, 120, 200)))
+    assert reason(tmp_path, encoded(Image.new("RGB", (300, 100))), min_edge=128) == "too_small"
+    assert reason(tmp_path, b"<html>Access denied</html>") == "undecodable"
+    assert reason(tmp_path, jpeg[:len(jpeg) // 2]) == "undecodable"  # Truncated: the header still opens
+    monkeypatch.setattr(ingest, "MAX_PIXELS", 400 * 300 - 1)
+    assert reason(tmp_path, jpeg) == "too_many_pixels"
+
+
+def test_unknown_output_format_is_refused():
+    with pytest.raises(ValueError):
+        Ingest(None, image_format="TIFF")
+
+
+def test_call_stores_the_normalized_copy_and_cleans_up(tmp_path):
+    store = ImageStore(str(tmp_path / "data"))
+    label_dir = tmp_path / "data" / "acme_one"
+    label_dir.mkdir()
+    partial_path = str(label_dir / "photo.png.part")
+    with open(partial_path, "wb") as f:
+        f.write(encoded(Image.new("RGB", (800, 800), (90, 200, 90)), "PNG"))
+    try:
+        stored = Ingest(store, max_edge=256)(partial_path, str(label_dir / "photo.png"))
+        assert stored.endswith(".jpg") and Image.open(stored).size == (256, 256)
+        assert sorted(os.listdir(label_dir)) == sorted(["photo.png.part", os.path.basename(stored)])
+    finally:
+        store.close()
+
+
+def test_sniffing_trusts_the_bytes_not_the_url():
+    assert sniff_image_type(encoded(Image.new("RGB", (8, 8)))) == "jpeg"
+    assert sniff_image_type(encoded(Image.new("RGB", (8, 8)), "PNG")) == "png"
+    assert sniff_image_type(b"GIF89a...") == "gif"
+    assert sniff_image_type(b"RIFF\0\0\0\0WEBPVP8 ") == "webp"
+    assert sniff_image_type(b"<!DOCTYPE html>") is None
+
+
+def test_rejection_report_groups_reasons_by_stage():
+    assert rejection_report({"not_image": 2, "too_small": 1, "near_duplicate": 3}) == (
+        "Ingest rejections: stream 2 (2 not_image); decode 0; resolution 1 (1 too_small); "
+        "dedup 3 (3 near_duplicate)")
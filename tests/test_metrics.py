@@ -0,0 +1,91 @@
+import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+import metrics
+from conftest import frame
+from metrics import Registry, process_memory, track_upstream
+
+
+def lines(registry):
+    return registry.render().splitlines()
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    registry = Registry()
+    latency = registry.histogram("stage_seconds", "Stage time.", ["stage"], buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 3.0):
+        latency.observe(value, stage="hash")
+    assert lines(registry) == [
+        "# HELP stage_seconds Stage time.",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="hash",le="0.01"} 1',
+        'stage_seconds_bucket{stage="hash",le="0.1"} 3',
+        'stage_seconds_bucket{stage="hash",le="+Inf"} 4',
+        'stage_seconds_sum{stage="hash"} 3.105',
+        'stage_seconds_count{stage="hash"} 4',
+    ]
+
+
+def test_counter_and_gauge_series_per_label_set():
+    registry = Registry()
+    scans = registry.counter("scans_total", "Scans.", ["outcome"])
+    in_flight = registry.gauge("in_flight", "In flight.")
+    scans.inc(outcome="done")
+    scans.inc(2, outcome="error")
+    with in_flight.track():
+        assert lines(registry)[-1] == "in_flight 1"
+    assert lines(registry)[2:4] == ['scans_total{outcome="done"} 1', 'scans_total{outcome="error"} 2']
+    assert lines(registry)[-1] == "in_flight 0"
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("calls_total", "Calls.", ["call"]).inc(call='say "hi"\n')
+    assert lines(registry)[-1] == r'calls_total{call="say \"hi\"\n"} 1'
+
+
+def test_upstream_calls_are_counted_by_outcome():
+    registry = Registry()
+    requests_total = registry.counter("upstream_requests_total", "Calls.", ["service", "call", "outcome"])
+    latency = registry.histogram("upstream_seconds", "Call time.", ["service", "call"])
+    with track_upstream(requests_total, latency, "gemini", "price"):
+        pass
+    for error in (FutureTimeoutError(), RuntimeError("500")):
+        with pytest.raises(type(error)):
+            with track_upstream(requests_total, latency, "gemini", "price"):
+                raise error
+    rendered = registry.render()
+    for outcome in ("ok", "timeout", "error"):
+        assert f'upstream_requests_total{{service="gemini",call="price",outcome="{outcome}"}} 1' in rendered
+    assert 'upstream_seconds_count{service="gemini",call="price"} 3' in rendered
+
+
+def test_a_failing_collector_does_not_break_the_scrape():
+    registry = Registry()
+    registry.counter("ok_total", "Fine.").inc()
+    registry.add_collector(lambda: 1 / 0)
+    registry.add_collector(lambda: ["# TYPE extra gauge", "extra 2"])
+    assert lines(registry)[-3:] == ["ok_total 1", "# TYPE extra gauge", "extra 2"]
+
+
+def test_process_memory_splits_private_from_shared_pages():
+    memory = process_memory(os.getpid())
+    if not memory:
+        pytest.skip("needs /proc/<pid>/smaps_rollup")
+    assert memory["rss"] == memory["uss"] + memory["shared"] and memory["uss"] > 0
+
+
+def test_scan_pipeline_is_on_the_metrics_route(web):
+    client = web.app.test_client()
+    client.post("/scan", data=frame(21), headers={"Content-Type": "image/jpeg"})
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.content_type == metrics.CONTENT_TYPE
+    body = response.get_data(as_text=True)
+    for stage in ("upload", "hash", "cache", "preprocess", "predict", "enrich"):
+        assert f'prodscan_stage_seconds_count{{stage="{stage}"}}' in body
+    for family in ("prodscan_scan_seconds", "prodscan_upstream_requests_total", "prodscan_batch_size",
+                   "prodscan_inference_queue_depth", "prodscan_cache_hit_ratio", "prodscan_in_flight_scans"):
+        assert f"# TYPE {family} " in body
+    assert 'prodscan_scan_seconds_count{endpoint="scan",outcome="done"}' in body
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from model_bundle import (MANIFEST_NAME, hash_training_data, legacy_bundle, load_bundle, update_manifest,
+                          write_manifest)
+
+LABELS = ["apple_iphone_15_pro", "samsung_galaxy_a54"]
+
+
+def test_manifest_round_trips_into_a_bundle(tmp_path):
+    bundle_dir = str(tmp_path / "model_bundle")
+    write_manifest(bundle_dir, LABELS, (224, 224), "abc123", artifacts={"onnx": "model.onnx"})
+    bundle = load_bundle(bundle_dir)
+
+    assert bundle.class_labels == tuple(LABELS)
+    assert bundle.class_table == (("apple", "iphone 15 pro"), ("samsung", "galaxy a54"))
+    assert (bundle.image_size, bundle.rescale, bundle.data_hash) == ((224, 224), 1. / 255, "abc123")
+    assert bundle.weights_path == str(tmp_path / "model_bundle" / "efficientnet_phone_model.h5")
+    assert bundle.artifacts == {"onnx": str(tmp_path / "model_bundle" / "model.onnx")}
+
+
+def test_update_merges_artifacts_into_the_manifest(tmp_path):
+    bundle_dir = str(tmp_path)
+    write_manifest(bundle_dir, LABELS, (224, 224), None, artifacts={"onnx": "model.onnx"})
+    update_manifest(bundle_dir, artifacts={"tflite_int8": "model_int8.tflite"}, catalog={"rows": 3})
+
+    assert set(load_bundle(bundle_dir).artifacts) == {"onnx", "tflite_int8"}
+    with open(tmp_path / MANIFEST_NAME) as f:
+        assert json.load(f)["catalog"] == {"rows": 3}
+    assert not (tmp_path / (MANIFEST_NAME + ".tmp")).exists()
+
+
+def test_unknown_format_version_is_refused(tmp_path):
+    manifest_path = write_manifest(str(tmp_path), LABELS, (224, 224), None)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["format_version"] = 99
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        load_bundle(str(tmp_path))
+
+
+def test_training_data_hash_follows_names_and_bytes(tmp_path):
+    train = tmp_path / "train" / "apple_iphone_15"
+    train.mkdir(parents=True)
+    (train / "1.jpg").write_bytes(b"one")
+    first = hash_training_data(str(tmp_path / "train"))
+    assert hash_training_data(str(tmp_path / "train")) == first
+
+    (train / "1.jpg").write_bytes(b"changed")
+    changed = hash_training_data(str(tmp_path / "train"))
+    (train / "1.jpg").rename(train / "2.jpg")
+    assert len({first, changed, hash_training_data(str(tmp_path / "train"))}) == 3
+
+
+def test_legacy_bundle_lists_the_train_directory(tmp_path):
+    for label in reversed(LABELS):
+        (tmp_path / label).mkdir()
+    (tmp_path / "notes.txt").write_text("not a class")
+    bundle = legacy_bundle("model.h5", str(tmp_path), [224, 224])
+    assert bundle.class_labels == tuple(LABELS)
+    assert (bundle.version, bundle.image_size, bundle.artifacts) == ("legacy", (224, 224), {})
@@ -0,0 +1,75 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from preprocessing import Preprocessor
+
+SIZE = (224, 224)
+
+
+def encode(img, image_format, **params):
+    buffer = BytesIO()
+    img.save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+
+def noise(size, mode="RGB"):
+    bands = [Image.effect_noise(size, sigma).convert("L") for sigma in (30, 50, 70)]
+    return Image.merge("RGB", bands).convert(mode)
+
+
+def reference(image_data):
+    """What the model should see: a plain decode, convert, resize and rescale."""
+    img = Image.open(BytesIO(image_data)).convert("RGB")
+    if img.size != SIZE:
+        img = img.resize(SIZE, Image.BICUBIC)
+    return np.asarray(img, dtype=np.float32) / 255.
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+def test_rgb_frame_already_at_the_target_size(image_format):
+    # Neither converted nor resized, so nothing else loads the image before it is copied
+    image_data = encode(noise(SIZE), image_format)
+    preprocessor = Preprocessor(SIZE)
+    out = preprocessor.preprocess_into(image_data, preprocessor.buffers.acquire())
+    np.testing.assert_allclose(out, reference(image_data), atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "RGBA", "P"])
+def test_png_modes_match_a_plain_decode(mode):
+    image_data = encode(noise((320, 240), mode), "PNG")
+    preprocessor = Preprocessor(SIZE)
+    out = preprocessor.preprocess_into(image_data, preprocessor.buffers.acquire())
+    np.testing.assert_allclose(out, reference(image_data), atol=1e-6)
+
+
+def test_large_jpeg_is_drafted_down_before_the_resize():
+    image_data = encode(noise((1280, 960)), "JPEG", quality=95)
+    preprocessor = Preprocessor(SIZE)
+    out = preprocessor.preprocess_into(image_data, preprocessor.buffers.acquire())
+    assert preprocessor.stats() == {"frames": 1, "draft_decodes": 1}
+    # DCT scaling is not a bicubic resize, but it is the same picture
+    assert np.abs(out - reference(image_data)).mean() < 0.05
+
+    preprocessor.preprocess_into(encode(noise((1280, 960)), "PNG"), preprocessor.buffers.acquire())
+    assert preprocessor.stats() == {"frames": 2, "draft_decodes": 1}  # Only JPEG has a draft mode
+
+
+def test_buffers_are_height_by_width_and_reused_last_in_first_out():
+    preprocessor = Preprocessor((320, 240), pool_size=2)
+    first, second = preprocessor.buffers.acquire(), preprocessor.buffers.acquire()
+    extra = preprocessor.buffers.acquire()  # Pool empty: a fresh buffer rather than a wait
+    assert first.shape == second.shape == extra.shape == (240, 320, 3)
+    assert len({id(first), id(second), id(extra)}) == 3
+    preprocessor.buffers.release(second)
+    assert preprocessor.buffers.acquire() is second
+
+
+def test_worker_pool_writes_into_the_callers_buffer():
+    image_data = encode(noise((320, 240)), "PNG")
+    preprocessor = Preprocessor(SIZE, workers=2)
+    out = preprocessor.buffers.acquire()
+    assert preprocessor.run(image_data, out) is out
+    np.testing.assert_allclose(out, reference(image_data), atol=1e-6)
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from prodscan_common import resilience
+from prodscan_common.resilience import (Budget, CircuitBreaker, CircuitOpenError, DeadlineExceeded, Upstream,
+                                        is_degraded)
+
+
+class HTTPError(Exception):
+    """Shaped like requests' and httpx's errors: the answer, if any, is on .response."""
+
+    def __init__(self, status_code=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code) if status_code else None
+
+
+def failing(status_code=None):
+    def send(timeout):
+        raise HTTPError(status_code)
+    return send
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def test_breaker_opens_after_failures_in_a_row_and_fails_fast(clock):
+    upstream = Upstream("gemini", failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        with pytest.raises(HTTPError):
+            upstream.call(failing(503))
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        upstream.call(lambda timeout: calls.append(timeout))
+    assert calls == []
+    assert upstream.stats()["state"] == "open" and upstream.stats()["rejected"] == 1
+
+
+def test_answered_errors_do_not_count_against_the_circuit(clock):
+    upstream = Upstream("gemini", failure_threshold=2)
+    for error in (HTTPError(400), HTTPError(404), ValueError("not JSON")):
+        def send(timeout):
+            raise error
+        with pytest.raises(type(error)):
+            upstream.call(send)
+    assert upstream.stats()["state"] == "closed"
+    for send in (failing(429), failing()):  # Too many requests, then no answer at all
+        with pytest.raises(HTTPError):
+            upstream.call(send)
+    assert upstream.stats()["state"] == "open"
+
+
+def test_half_open_circuit_lets_one_trial_call_through(clock):
+    breaker = CircuitBreaker("gemini", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    clock.advance(1)
+    breaker.allow()  # The trial
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()  # Anything else while the trial is out
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def test_failed_trial_reopens_the_circuit(clock):
+    breaker = CircuitBreaker("gemini", failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.advance(30)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.stats() == {"opened": 2, "rejected": 0, "state": "open", "consecutive_failures": 6}
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_budget_caps_each_calls_timeout(clock):
+    upstream = Upstream("google_search", timeout=(3.05, 15))
+    budget = Budget(10)
+    clock.advance(8)
+    assert budget.run(upstream.call, lambda timeout: timeout) == (2, 2)
+    assert upstream.call(lambda timeout: timeout) == (3.05, 15)  # No budget outside run()
+    clock.advance(1.9)
+    with pytest.raises(DeadlineExceeded):
+        budget.run(upstream.call, lambda timeout: timeout)
+    assert upstream.stats()["consecutive_failures"] == 0  # A call never sent is no failure
+
+
+def test_slow_call_is_hedged_and_the_first_good_answer_wins():
+    upstream = Upstream("gemini", hedge_after=0.05)
+    first_started, release = threading.Event(), threading.Event()
+
+    def send(timeout):
+        if not first_started.is_set():
+            first_started.set()
+            release.wait(5)  # The slow first attempt
+            return "slow"
+        return "fast"
+
+    try:
+        assert upstream.call(send) == "fast"
+    finally:
+        release.set()
+    assert upstream.call(lambda timeout: "quick") == "quick"  # Answered before hedge_after: no hedge
+    assert upstream.call(send, hedge=False) == "fast"
+    assert (upstream.stats()["hedged"], upstream.stats()["hedge_wins"]) == (1, 1)
+
+
+def test_cancelled_async_trial_frees_its_half_open_slot(clock):
+    upstream = Upstream("gemini", failure_threshold=1, reset_timeout=30, hedge_after=0.05)
+    upstream.breaker.record_failure()
+    clock.advance(30)  # Half open: the next call is the trial
+    attempts = []
+
+    async def send(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            await asyncio.sleep(5)
+        return "answer"
+
+    # The hedge finds the trial slot taken and is refused without being sent; the scan
+    # then gives up on the slow trial, which is cancelled
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(upstream.acall(send), 0.2))
+    assert len(attempts) == 1 and upstream.stats()["hedged"] == 1
+    assert upstream.stats()["state"] == "half_open"
+    upstream.breaker.allow()  # The cancelled trial gave its slot back
+
+
+def test_scans_with_a_failed_lookup_are_degraded():
+    assert not is_degraded({"price": "฿12,990", "usage": "Calls and photos."})
+    assert not is_degraded({"price": "฿12,990"})  # A phone scan has no usage lookup
+    for answer in ("Error retrieving price from Gemini.", "Not available.", ""):
+        assert is_degraded({"price": "฿12,990", "usage": answer})
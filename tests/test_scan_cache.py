@@ -0,0 +1,72 @@
+from prodscan_common import scan_cache
+from prodscan_common.scan_cache import PerceptualCache
+
+FIRST = 0x0123456789ABCDEF
+SECOND = 0x7EDCBA9876543210
+
+
+def make_cache(monkeypatch, clock, tmp_path, **options):
+    monkeypatch.setattr(scan_cache, "time", clock)
+    return PerceptualCache(spill_path=str(tmp_path / "spill.db"), **options)
+
+
+def test_near_identical_frame_hits(monkeypatch, clock, tmp_path):
+    cache = make_cache(monkeypatch, clock, tmp_path, max_distance=4)
+    cache.put(FIRST, {"message": "Galaxy A55"})
+    assert cache.get(FIRST ^ 0b101) == {"message": "Galaxy A55"}
+    assert cache.get(FIRST ^ 0b11111) is None  # Five bits off
+    stats = cache.stats()
+    assert (stats["near_hits"], stats["misses"]) == (1, 1)
+
+
+def test_evicted_entry_is_found_in_the_spill(monkeypatch, clock, tmp_path):
+    cache = make_cache(monkeypatch, clock, tmp_path, max_entries=1)
+    cache.put(FIRST, {"message": "Galaxy A55"})
+    cache.put(SECOND, {"message": "iPhone 15"})
+
+    assert cache.get(FIRST ^ 1) == {"message": "Galaxy A55"}  # Promoted back, evicting SECOND
+    assert cache.get(SECOND) == {"message": "iPhone 15"}
+    stats = cache.stats()
+    assert (stats["evictions"], stats["spill_hits"], stats["misses"]) == (3, 2, 0)
+
+
+def test_entry_expires_after_ttl(monkeypatch, clock, tmp_path):
+    cache = make_cache(monkeypatch, clock, tmp_path, ttl=2)
+    cache.put(FIRST, {"message": "Galaxy A55"})
+    clock.advance(1.5)
+    assert cache.get(FIRST) is not None
+    clock.advance(1)
+    assert cache.get(FIRST) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_spilled_entry_expires_on_its_original_schedule(monkeypatch, clock, tmp_path):
+    cache = make_cache(monkeypatch, clock, tmp_path, max_entries=1, ttl=2)
+    cache.put(FIRST, {"message": "Galaxy A55"})
+    for _ in range(2):  # Evict FIRST to the spill and promote it back, twice
+        clock.advance(1)
+        cache.put(SECOND, {"message": "iPhone 15"})
+        assert cache.get(FIRST ^ 1) == {"message": "Galaxy A55"}
+
+    clock.advance(0.5)  # 2.5 s after FIRST was stored
+    assert cache.get(FIRST) is None
+    assert cache.get(FIRST ^ 1) is None
+
+
+def test_promoted_entry_is_keyed_by_its_own_hash(monkeypatch, clock, tmp_path):
+    cache = make_cache(monkeypatch, clock, tmp_path, max_entries=1)
+    cache.put(FIRST, {"message": "Galaxy A55"})
+    cache.put(SECOND, {"message": "iPhone 15"})
+    cache.get(FIRST ^ 1)
+    assert cache.get(FIRST) == {"message": "Galaxy A55"}
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_spill_handles_a_single_64_bit_band(monkeypatch, clock, tmp_path):
+    cache = make_cache(monkeypatch, clock, tmp_path, max_entries=1, max_distance=0)
+    top_bit = 0xF123456789ABCDEF  # Above SQLite's signed 64-bit range
+    cache.put(top_bit, {"message": "Galaxy A55"})
+    cache.put(FIRST, {"message": "iPhone 15"})
+
+    assert cache.get(top_bit) == {"message": "Galaxy A55"}
+    assert cache.stats()["spill_hits"] == 1
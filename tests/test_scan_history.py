@@ -0,0 +1,103 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from prodscan_common.scan_history import SCHEMA_VERSION, ScanHistory, migrate_database, parse_history_args
+
+LEGACY_SCANS = '''
+    CREATE TABLE scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_name TEXT, brand TEXT, brand_details TEXT, release_date TEXT,
+        usage TEXT, price TEXT, scan_time TEXT
+    )
+'''
+
+
+def build_legacy_db(path, scan_times):
+    """Schema version 0: TEXT scan_time in local time, no indexes, no user_version."""
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_SCANS)
+    conn.executemany("INSERT INTO scans (product_name, brand, price, scan_time) VALUES (?, ?, ?, ?)",
+                     [(f"Galaxy A{i}", "Samsung", "฿999", scan_time) for i, scan_time in enumerate(scan_times)])
+    conn.commit()
+    conn.close()
+
+
+def schema(path):
+    conn = sqlite3.connect(path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        rows = conn.execute("SELECT product_name, scan_time, typeof(scan_time) FROM scans ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    return version, indexes, rows
+
+
+def test_legacy_database_is_migrated_to_the_current_version(tmp_path):
+    path = str(tmp_path / "product_scans.db")
+    build_legacy_db(path, ["2024-01-02 03:04:05", "not a date"])
+
+    migrate_database(path)
+
+    version, indexes, rows = schema(path)
+    assert version == SCHEMA_VERSION
+    assert {"idx_scans_time", "idx_scans_product_time", "idx_scans_brand_time"} <= indexes
+    expected = int(datetime(2024, 1, 2, 3, 4, 5).timestamp()) * 1000  # Old text was local time
+    assert rows == [("Galaxy A0", expected, "integer"), ("Galaxy A1", 0, "integer")]
+
+
+def test_migration_is_idempotent(tmp_path):
+    path = str(tmp_path / "product_scans.db")
+    build_legacy_db(path, ["2024-01-02 03:04:05"])
+    migrate_database(path)
+    before = schema(path)
+    migrate_database(path)
+    assert schema(path) == before
+
+
+def test_new_database_starts_at_the_current_version(tmp_path):
+    path = str(tmp_path / "product_scans.db")
+    migrate_database(path)
+    version, indexes, rows = schema(path)
+    assert version == SCHEMA_VERSION
+    assert "idx_scans_time" in indexes
+    assert rows == []
+
+
+def test_migrated_history_pages_newest_first(tmp_path):
+    path = str(tmp_path / "product_scans.db")
+    build_legacy_db(path, [f"2024-01-0{day} 12:00:00" for day in range(1, 6)])
+    migrate_database(path)
+    history = ScanHistory(path, pool_size=1)
+
+    first = history.page(**parse_history_args({"limit": "3"}))
+    second = history.page(**parse_history_args({"limit": "3", "cursor": first["next_cursor"]}))
+
+    names = [scan["product_name"] for scan in first["scans"] + second["scans"]]
+    assert names == ["Galaxy A4", "Galaxy A3", "Galaxy A2", "Galaxy A1", "Galaxy A0"]
+    assert second["next_cursor"] is None
+
+
+@pytest.mark.parametrize("args", [
+    {"since": "inf"},
+    {"until": "-inf"},
+    {"since": "nan"},
+    {"since": "1e300"},
+    {"until": "yesterday"},
+    {"cursor": "99999999999999999999_1"},
+    {"cursor": "1_-99999999999999999999"},
+    {"cursor": "1"},
+    {"limit": "ten"},
+])
+def test_bad_history_arguments_are_value_errors(args):
+    with pytest.raises(ValueError):
+        parse_history_args(args)
+
+
+def test_history_arguments_are_parsed():
+    query = parse_history_args({"since": "1700000000.5", "until": "2024-01-01T00:00:00Z", "limit": "1000",
+                                "cursor": "1700000000000_42", "brand": "Samsung"})
+    assert query == {"product_name": None, "brand": "Samsung", "since": 1700000000500, "until": 1704067200000,
+                     "limit": 500, "cursor": (1700000000000, 42)}
@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from conftest import frame
+
+IMAGE = {"Content-Type": "image/jpeg"}
+
+
+def events(body):
+    return [json.loads(line) for line in body.splitlines()]
+
+
+def stream(web, image_data):
+    response = web.app.test_client().post("/scan/stream", data=image_data, headers=IMAGE)
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    return events(response.get_data(as_text=True))
+
+
+def test_phone_result_comes_before_its_price(web):
+    identified, done = stream(web, frame(11))
+    assert identified["event"] == "identified" and web.PENDING in identified["message"]
+    assert "iphone 15" in identified["message"]
+    assert done["event"] == "done" and web.PENDING not in done["message"]
+    assert "Estimate Price (Approximate): ฿" in done["message"]
+
+
+def test_other_products_stream_each_lookup_as_it_lands(web):
+    sent = stream(web, frame(12, bright=False))
+    names = [event["event"] for event in sent]
+    assert names[:2] == ["classified", "identified"] and names[-1] == "done"
+    assert sorted(names[2:-1]) == ["price", "usage"]
+    assert sent[0]["message"] == web.IDENTIFYING
+    assert sent[1]["message"].count(web.PENDING) == 2  # Usage and price still looked up
+    assert sent[2]["message"].count(web.PENDING) == 1
+    assert sent[-1]["message"] == sent[-2]["message"]  # The final card is the last one streamed
+
+
+def test_repeated_frame_streams_only_the_cached_card(web):
+    first = stream(web, frame(13))
+    assert stream(web, frame(13)) == [first[-1]]
+
+
+def test_bad_upload_is_a_400_before_any_event(web):
+    response = web.app.test_client().post("/scan/stream", data=b"", headers=IMAGE)
+    assert response.status_code == 400 and response.mimetype == "application/json"
+
+
+def test_async_stream_sends_the_same_events(web):
+    import web_async
+
+    async def run():
+        async with web_async.app.test_app() as test_app:
+            response = await test_app.test_client().post("/scan/stream", data=frame(14, bright=False),
+                                                         headers=IMAGE)
+            return response.status_code, await response.get_data(as_text=True)
+
+    status, body = asyncio.run(run())
+    names = [event["event"] for event in events(body)]
+    assert status == 200
+    assert names[:2] == ["classified", "identified"] and sorted(names[2:-1]) == ["price", "usage"]
+    assert names[-1] == "done"
+    assert web_async.admission._value == web_async.MAX_IN_FLIGHT  # Its slot is back once the stream ends
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from prodscan_common.singleflight import SingleFlight
+
+
+def wait_for_waiters(flights, group, count):
+    deadline = time.monotonic() + 5
+    while flights.stats().get(group, {}).get("waiting", 0) < count:
+        assert time.monotonic() < deadline, "waiters never joined the flight"
+        time.sleep(0.005)
+
+
+def test_waiters_share_the_leaders_exception():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+    error = RuntimeError("quota exhausted")
+
+    def failing_call():
+        calls.append(1)
+        release.wait(5)
+        raise error
+
+    outcomes = []
+
+    def lookup():
+        try:
+            flights.do("price", "galaxy a55", failing_call)
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=lookup) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    wait_for_waiters(flights, "price", 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert outcomes == [error] * 4
+    stats = flights.stats()["price"]
+    assert (stats["calls"], stats["coalesced"], stats["errors"], stats["in_flight"]) == (1, 3, 1, 0)
+
+
+def test_next_call_after_a_failure_starts_a_new_flight():
+    flights = SingleFlight()
+
+    def failing_call():
+        raise ValueError("bad answer")
+
+    with pytest.raises(ValueError):
+        flights.do("usage", "galaxy a55", failing_call)
+    assert flights.do("usage", "galaxy a55", lambda: "answer") == "answer"
+    assert flights.stats()["usage"]["calls"] == 2
+
+
+def test_async_waiters_share_the_leaders_exception():
+    flights = SingleFlight()
+    calls = []
+
+    async def failing_call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("quota exhausted")
+
+    async def main():
+        return await asyncio.gather(*(flights.ado("price", "galaxy a55", failing_call) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()["price"]["errors"] == 1
+
+
+def test_cancelled_async_waiter_leaves_the_shared_call_running():
+    flights = SingleFlight()
+
+    async def slow_call():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado("price", "galaxy a55", slow_call))
+        waiter = asyncio.ensure_future(flights.ado("price", "galaxy a55", slow_call))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await leader, waiter.cancelled()
+
+    assert asyncio.run(main()) == ("answer", True)
@@ -0,0 +1,70 @@
+import asyncio
+import base64
+from io import BytesIO
+
+import pytest
+from flask import Flask, request
+from quart import Quart, request as quart_request
+
+from prodscan_common.uploads import ScanUpload, UploadError, read_scan_upload, read_scan_upload_async
+
+FRAME = b"\xff\xd8\xff\xe0 not really a jpeg"
+FRAME_B64 = base64.b64encode(FRAME).decode("ascii")
+app = Flask(__name__)
+
+
+def read(**request_args):
+    with app.test_request_context("/scan", method="POST", **request_args):
+        return read_scan_upload(request)
+
+
+def test_raw_body_keeps_its_bytes_and_encodes_base64_only_when_asked():
+    upload = read(data=FRAME, content_type="image/jpeg")
+    assert (upload.mime_type, upload.data, upload._b64) == ("image/jpeg", FRAME, None)
+    assert upload.b64 == FRAME_B64
+
+
+def test_json_data_url_keeps_its_base64_text():
+    upload = read(json={"image": f"data:image/png;base64,{FRAME_B64}"})
+    assert (upload.mime_type, upload.b64, upload._data) == ("image/png", FRAME_B64, None)
+    assert upload.data == FRAME
+
+
+def test_bare_base64_is_taken_as_jpeg():
+    assert read(json={"image": FRAME_B64}).mime_type == "image/jpeg"
+
+
+def test_multipart_field_and_jpg_alias():
+    upload = read(data={"image": (BytesIO(FRAME), "frame.jpg", "image/jpg")}, content_type="multipart/form-data")
+    assert (upload.mime_type, upload.data) == ("image/jpeg", FRAME)
+
+
+@pytest.mark.parametrize("request_args", [
+    {"data": b"", "content_type": "image/jpeg"},
+    {"data": FRAME, "content_type": "image/gif"},
+    {"json": {"picture": FRAME_B64}},
+    {"data": b"not json", "content_type": "text/plain"},
+    {"data": {}, "content_type": "multipart/form-data"},
+])
+def test_unusable_uploads_are_refused(request_args):
+    with pytest.raises(UploadError):
+        read(**request_args)
+
+
+def test_invalid_base64_is_an_upload_error_when_decoded():
+    upload = ScanUpload("image/jpeg", b64="not base64!")
+    with pytest.raises(UploadError):
+        upload.data
+
+
+def test_async_reader_matches_the_sync_one():
+    quart_app = Quart(__name__)
+
+    async def read_async(**request_args):
+        async with quart_app.test_request_context("/scan", method="POST", **request_args):
+            return await read_scan_upload_async(quart_request)
+
+    upload = asyncio.run(read_async(data=FRAME, headers={"Content-Type": "image/webp"}))
+    assert (upload.mime_type, upload.data) == ("image/webp", FRAME)
+    upload = asyncio.run(read_async(json={"image": f"data:image/jpeg;base64,{FRAME_B64}"}))
+    assert upload.b64 == FRAME_B64
@@ -0,0 +1,100 @@
+import asyncio
+import base64
+
+import pytest
+
+from conftest import frame
+from inference import QueueFull
+
+
+@pytest.fixture
+def web_async(web):
+    import web_async
+    return web_async
+
+
+def serve(web_async, requests, setup=None):
+    """Sends each (method, path, request kwargs) to the started app; returns the
+    responses as (status, JSON body)."""
+    async def run():
+        async with web_async.app.test_app() as test_app:  # Runs before_serving (client, admission)
+            if setup:
+                setup()
+            client = test_app.test_client()
+            answers = []
+            for method, path, kwargs in requests:
+                response = await client.open(path, method=method, **kwargs)
+                answers.append((response.status_code, await response.get_json()))
+            return answers
+    return asyncio.run(run())
+
+
+def scan(web_async, request_kwargs, setup=None):
+    return serve(web_async, [("POST", "/scan", request_kwargs)], setup)[0]
+
+
+def metric(web_async, sample):
+    """Value of an unlabelled sample in the app's /metrics text."""
+    for line in web_async.metrics.render().splitlines():
+        if line.startswith(sample + " "):
+            return float(line.split()[-1])
+    return 0.0
+
+
+def raw(image_data):
+    return {"data": image_data, "headers": {"Content-Type": "image/jpeg"}}
+
+
+def test_phone_is_answered_locally_with_the_gemini_price(web_async):
+    status, body = scan(web_async, raw(frame(1)))
+    assert status == 200
+    assert "iphone 15" in body["message"] and "Estimate Price (Approximate): ฿" in body["message"]
+
+
+def test_other_products_are_identified_and_enriched_by_gemini(web_async):
+    data_url = "data:image/jpeg;base64," + base64.b64encode(frame(2, bright=False)).decode("ascii")
+    status, body = scan(web_async, {"json": {"image": data_url}})
+    assert status == 200
+    assert "Gadget" in body["message"]  # Identified by (the fake) Gemini
+    # Both follow-up lookups answered
+    assert "Used for everyday gadget" in body["message"] and "Estimate Price (Approximate): ฿" in body["message"]
+
+
+def test_repeated_frame_is_answered_from_the_scan_cache(web_async):
+    hits = web_async.scan_cache.stats()["exact_hits"]
+    first, second = serve(web_async, [("POST", "/scan", raw(frame(3)))] * 2)
+    assert first == second
+    assert web_async.scan_cache.stats()["exact_hits"] == hits + 1
+
+
+def test_unusable_upload_is_a_400(web_async):
+    status, body = scan(web_async, raw(b""))
+    assert status == 400 and body["message"].startswith("Error:")
+
+
+def test_scans_past_the_in_flight_limit_are_turned_away(web_async, monkeypatch):
+    monkeypatch.setattr(web_async, "ADMISSION_TIMEOUT", 0.01)
+
+    def no_free_slots():
+        web_async.admission = asyncio.Semaphore(0)
+
+    rejections = metric(web_async, "prodscan_admission_rejections_total")
+    status, body = scan(web_async, raw(frame(4)), setup=no_free_slots)
+    assert status == 503 and body["message"] == "Error: Server busy, try again."
+    assert metric(web_async, "prodscan_admission_rejections_total") == rejections + 1
+
+
+def test_full_inference_queue_is_a_503(web_async, monkeypatch):
+    def full(array, timeout=0):
+        raise QueueFull("Inference queue full")
+
+    monkeypatch.setattr(web_async.web.predictor, "submit", full)
+    free = web_async.web.preprocessor.buffers._free.qsize()
+    status, body = scan(web_async, raw(frame(5)))
+    assert status == 503 and body["message"] == "Error: Scanner is busy, try again shortly."
+    assert web_async.web.preprocessor.buffers._free.qsize() == free  # The unqueued buffer went back
+
+
+def test_health_and_readiness(web_async):
+    (health, _), (ready, readiness) = serve(web_async, [("GET", "/healthz", {}), ("GET", "/readyz", {})])
+    assert (health, ready, readiness["status"]) == (200, 200, "ready")